@@ -116,7 +116,8 @@ CREATE TABLE documents (
     page_count INTEGER,
     upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     processed BOOLEAN DEFAULT FALSE,
-    processed_at TIMESTAMP
+    processed_at TIMESTAMP,
+    analysis_result JSONB
 );
 
 -- Case notes
@@ -90,6 +90,7 @@ CREATE TABLE IF NOT EXISTS case_indicator_citations (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   case_indicator_id INTEGER NOT NULL,
   document_type TEXT,
+  document_id TEXT,
   page_number INTEGER,
   line_number INTEGER,
   timestamp_value TEXT,
@@ -100,6 +101,22 @@ CREATE TABLE IF NOT EXISTS case_indicator_citations (
   FOREIGN KEY (case_indicator_id) REFERENCES case_indicators(id) ON DELETE CASCADE
 );
 
+-- Documents (transcripts, evidence, appeals)
+CREATE TABLE IF NOT EXISTS documents (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  case_id INTEGER,
+  document_type TEXT NOT NULL,
+  document_name TEXT NOT NULL,
+  file_path TEXT,
+  content_text TEXT,
+  page_count INTEGER,
+  upload_date TEXT DEFAULT CURRENT_TIMESTAMP,
+  processed INTEGER DEFAULT 0,
+  processed_at TEXT,
+  analysis_result TEXT, -- JSON stored as text, with pattern fingerprints
+  FOREIGN KEY (case_id) REFERENCES cases(id) ON DELETE CASCADE
+);
+
 -- Audit log
 CREATE TABLE IF NOT EXISTS audit_log (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -119,5 +136,8 @@ CREATE INDEX IF NOT EXISTS idx_cases_priority ON cases(priority_score DESC);
 CREATE INDEX IF NOT EXISTS idx_cases_county ON cases(county);
 CREATE INDEX IF NOT EXISTS idx_case_indicators_case ON case_indicators(case_id);
 CREATE INDEX IF NOT EXISTS idx_case_indicators_indicator ON case_indicators(indicator_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_case_indicators_unique ON case_indicators(case_id, indicator_id);
+CREATE INDEX IF NOT EXISTS idx_documents_case ON documents(case_id);
+CREATE INDEX IF NOT EXISTS idx_documents_unprocessed ON documents(processed, id);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_users_org ON users(organization_id);
\ No newline at end of file
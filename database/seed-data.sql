@@ -67,4 +67,5 @@ INSERT INTO indicators (category_id, name, description, severity, weight) VALUES
 (9, 'Disproportionate Demographics', 'Defendant from demographic with higher wrongful conviction rates', 'low', 1.1),
 (9, 'Harsh Sentence', 'Unusually harsh sentence relative to the charge', 'medium', 1.2),
 (9, 'Implausible Narrative', 'Lack of motive or implausible narrative of guilt', 'medium', 1.3),
-(9, 'Maintained Innocence', 'Defendant maintains innocence consistently over time', 'low', 1.1);
\ No newline at end of file
+(9, 'Maintained Innocence', 'Defendant maintains innocence consistently over time', 'low', 1.1),
+(9, 'Repeat Actor', 'Investigators, analysts, informants or prosecutors also named in other cases', 'high', 1.4);
\ No newline at end of file
@@ -1,13 +1,51 @@
 """
 Main analyzer module that coordinates all detectors
 """
-from typing import List, Dict, Any
+import logging
+import re
+import time
+from typing import TYPE_CHECKING, List, Dict, Any, Callable, Optional, Iterator, Set, Tuple
+
+import metrics
 from detectors import (
-    ConfessionDetector,
-    EyewitnessDetector,
-    ForensicDetector,
-    MisconductDetector,
+    COMPACT_FORMAT,
+    Alignment,
+    Document,
+    DocumentResult,
+    IndicatorResult,
+    MappedDocument,
+    PatternEngine,
+    align,
+    build_detectors,
+    builtin_definitions,
+    fingerprint_patterns,
+    load_engine,
+    preprocess,
 )
+from cache import AnalysisCache
+from linguistics import LinguisticFilter
+from registry import IndicatorRegistry
+from streaming import analyze_stream, Source, DEFAULT_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    # Imported where an index is built, as it needs numpy
+    from duplicates import NearDuplicateIndex
+
+# Candidate matches scanned per category when the linguistic filter may
+# drop some of them (three per piece of evidence kept)
+FILTER_CANDIDATES = 9
+
+# Ways triage can combine an indicator's confidences across documents;
+# neither exceeds the highest of them, which bounds indicators not yet
+# evaluated
+TRIAGE_AGGREGATES = ('mean', 'max')
+
+
+def sum_confidences(confidences: Dict[str, float]) -> float:
+    """Default triage score: the sum of the case's indicator confidences"""
+    return sum(confidences.values())
 
 
 class WrongfulConvictionAnalyzer:
@@ -16,18 +54,128 @@ class WrongfulConvictionAnalyzer:
     for wrongful conviction indicators
     """
     
-    def __init__(self):
-        self.detectors = {
-            'confession': ConfessionDetector(),
-            'eyewitness': EyewitnessDetector(),
-            'forensic': ForensicDetector(),
-            'misconduct': MisconductDetector(),
+    def __init__(
+        self,
+        pattern_mode: str = 'proximity',
+        proximity_tokens: int = 10,
+        time_budget: Optional[float] = None,
+        cache: Optional[AnalysisCache] = None,
+        pattern_scope: str = 'document',
+        linguistic_filter: Optional[LinguisticFilter] = None,
+        registry: Optional[IndicatorRegistry] = None,
+        near_duplicates: Optional['NearDuplicateIndex'] = None,
+        pattern_artifact: Optional[str] = None
+    ):
+        """
+        Args:
+            pattern_mode: 'proximity' bounds `.*` gaps to nearby tokens in
+                the same sentence, 'legacy' runs patterns as written
+            proximity_tokens: Maximum tokens a proximity gap may span
+            time_budget: Per-document regex time budget in seconds
+            cache: Optional result cache consulted by analyze_document
+            pattern_scope: 'sentence' or 'turn' keeps matches within one
+                sentence or speaker turn, 'document' allows any match
+            linguistic_filter: Optional filter dropping negated or
+                unrelated matches before evidence is built
+            registry: Optional source of indicator definitions that can
+                change at runtime; the built-in definitions otherwise
+            near_duplicates: Optional index of recently scanned documents;
+                duplicates reuse their matches and near duplicates only
+                rescan the lines that differ
+            pattern_artifact: Optional file of precompiled patterns (see
+                detectors/artifact.py), loaded instead of compiling when
+                it matches the definitions and options
+        """
+        self.registry = registry
+        self._registry_version = None
+        # Registry version whose patterns failed to compile, not retried
+        self._rejected_version = None
+        if registry is not None:
+            self._registry_version, definitions = registry.snapshot()
+        else:
+            definitions = builtin_definitions()
+        self.detectors = build_detectors(definitions)
+        self.cache = cache
+        self.linguistics = linguistic_filter
+        self.near_duplicates = near_duplicates
+        self._engine_options = {
+            'mode': pattern_mode,
+            'proximity_tokens': proximity_tokens,
+            'time_budget': time_budget,
+            'scope': pattern_scope,
+        }
+        if linguistic_filter is not None:
+            self._engine_options['candidates'] = FILTER_CANDIDATES
+            self._engine_options['postfilter'] = linguistic_filter.key
+        # Compile every indicator pattern once for all documents
+        self.engine = None
+        if pattern_artifact:
+            self.engine = load_engine(pattern_artifact, self.detectors, **self._engine_options)
+        if self.engine is None:
+            self.engine = PatternEngine(self.detectors, **self._engine_options)
+    
+    def warm(self) -> None:
+        """
+        Build everything analysis would otherwise build on first use, so
+        that worker processes forked afterwards share it
+        """
+        self.refresh_patterns()
+        self.engine.warm()
+        if self.linguistics is not None:
+            self.linguistics.load()
+    
+    def indicator_names(self) -> Set[str]:
+        """Names of the indicators the detectors can report"""
+        return {
+            indicator_name
+            for detector in self.detectors.values()
+            for indicator_name, _ in detector.indicators.values()
         }
     
+    def refresh_patterns(self) -> bool:
+        """
+        Recompile if any detector's patterns changed since the last compile
+        
+        New registry definitions replace the detectors once their engine
+        has compiled; if it does not, the error is logged and the current
+        detectors and engine stay in use. Requests already running keep
+        the engine they started with, which carries its own detectors.
+        Returns True when the engine was rebuilt. The new engine version
+        also retires every cached result produced by the old patterns.
+        """
+        detectors = self.detectors
+        version = self._registry_version
+        if self.registry is not None:
+            self.registry.poll()
+            version, definitions = self.registry.snapshot()
+            if version == self._rejected_version:
+                return False
+            if version != self._registry_version:
+                detectors = build_detectors(definitions)
+        if fingerprint_patterns(detectors) == self.engine.fingerprint:
+            self.detectors = detectors
+            self._registry_version = version
+            return False
+        try:
+            engine = PatternEngine(detectors, **self._engine_options)
+        except (re.error, ValueError) as error:
+            logger.error('Keeping indicator patterns %s: %s', self.engine.fingerprint, error)
+            self._rejected_version = version
+            return False
+        self.detectors = detectors
+        self._registry_version = version
+        self.engine = engine
+        if self.cache is not None:
+            self.cache.clear_memory()
+        if self.near_duplicates is not None:
+            self.near_duplicates.clear()
+        return True
+    
     def analyze_document(
         self, 
         content: str, 
-        document_type: str = 'transcript'
+        document_type: str = 'transcript',
+        triage_threshold: Optional[float] = None
     ) -> Dict[str, Any]:
         """
         Analyze a document and return all detected indicators
@@ -35,30 +183,205 @@ class WrongfulConvictionAnalyzer:
         Args:
             content: The document text to analyze
             document_type: Type of document (transcript, evidence, appeal, etc.)
+            triage_threshold: Only decide whether the document's score
+                reaches this threshold (see triage)
         
         Returns:
             Dictionary containing detected indicators with evidence
         """
-        all_indicators = []
+        document = {'type': document_type, 'content': content}
+        if triage_threshold is not None:
+            return self.triage([document], triage_threshold)
+        return self.analyze_documents([document])[0]
+    
+    def _analyze_many(self, documents: List[Tuple[str, str]]) -> List[DocumentResult]:
+        """Analyze (content, document_type) pairs, filtering their matches in one batch"""
+        # Preprocess and scan once for all detectors, then let each build
+        # its indicators
+        engine = self.engine
+        scanned = []
+        for content, _ in documents:
+            document = preprocess(content)
+            scanned.append((document, self._scan(engine, document)))
+        all_hits = self._filter(scanned)
         
-        # Run all detectors
-        for detector_name, detector in self.detectors.items():
-            detected = detector.detect(content, document_type)
-            for indicator in detected:
-                indicator['detector'] = detector_name
-                all_indicators.append(indicator)
+        return [
+            self._build_result(engine, document, hits, document_type)
+            for (document, _), hits, (_, document_type) in zip(scanned, all_hits, documents)
+        ]
+    
+    def _scan(self, engine: PatternEngine, document) -> Dict[str, Any]:
+        """Scan a document, reusing the matches of a duplicate scanned before"""
+        index = self.near_duplicates
+        if index is None or not index.accepts(document):
+            return engine.scan(document)
+        signature = index.signature(document)
+        earlier = index.find(document, signature, engine.version)
+        if earlier is None:
+            hits = engine.scan(document)
+        elif earlier.document.text == document.text:
+            return earlier.hits
+        else:
+            alignment = Alignment(
+                align(earlier.document.text, document.text), earlier.hits, engine.candidates
+            )
+            hits = engine.scan(document, alignment)
+        index.add(document, signature, hits, engine.version)
+        return hits
+    
+    def _filter(self, scanned: List[Tuple[Any, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Apply the linguistic filter, keeping max_evidence spans per category"""
+        if self.linguistics is None:
+            return [hits for _, hits in scanned]
+        with metrics.stage('linguistics'):
+            filtered = self.linguistics.filter(scanned)
+        limit = self.engine.max_evidence
+        return [
+            {
+                detector_name: {category: spans[:limit] for category, spans in categories.items()}
+                for detector_name, categories in hits.items()
+            }
+            for hits in filtered
+        ]
+    
+    def _build_result(
+        self,
+        engine: PatternEngine,
+        document,
+        hits: Dict[str, Any],
+        document_type: str
+    ) -> DocumentResult:
+        indicators = []
+        for detector_name, detector in engine.detectors.items():
+            indicators.extend(detector.build_results(document, hits[detector_name], engine))
+        return DocumentResult(indicators, document_type, engine.category_fingerprints)
+    
+    def stale_categories(self, previous: Dict[str, Any]) -> Dict[str, List[str]]:
+        """
+        Categories whose fingerprint differs from the one a previous
+        result was produced with
         
-        return {
-            'total_indicators': len(all_indicators),
-            'indicators': all_indicators,
-            'document_type': document_type,
-            'analysis_complete': True
+        Args:
+            previous: Earlier analyze_document result
+        
+        Returns:
+            Detector name -> stale categories (detectors with none omitted)
+        """
+        self.refresh_patterns()
+        return self._stale(previous, self.engine)
+    
+    def _stale(self, previous: Dict[str, Any], engine: PatternEngine) -> Dict[str, List[str]]:
+        recorded = previous.get('fingerprints') or {}
+        stale = {}
+        for detector_name, fingerprints in engine.category_fingerprints.items():
+            previous_fingerprints = recorded.get(detector_name, {})
+            categories = [
+                category for category, fingerprint in fingerprints.items()
+                if previous_fingerprints.get(category) != fingerprint
+            ]
+            if categories:
+                stale[detector_name] = categories
+        return stale
+    
+    def reanalyze_document(
+        self,
+        content: str,
+        previous: Dict[str, Any],
+        document_type: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Bring a stored result up to date with the current patterns
+        
+        Only categories whose fingerprints changed are rescanned; the
+        indicators of every other category are carried over from the
+        previous result. The merged result matches what analyze_document
+        would return for the current patterns.
+        
+        Args:
+            content: The document text the previous result was produced from
+            previous: Earlier result stored with its fingerprints
+                (DocumentResult.to_dict(fingerprints=True))
+            document_type: Type of document (defaults to the previous one)
+        
+        Returns:
+            Dictionary containing detected indicators with evidence, and
+            the fingerprints to store with them
+        """
+        return self._reanalyze(content, previous, document_type).to_dict(fingerprints=True)
+    
+    def _reanalyze(
+        self,
+        content: str,
+        previous: Dict[str, Any],
+        document_type: Optional[str] = None
+    ) -> DocumentResult:
+        if document_type is None:
+            document_type = previous.get('document_type', 'transcript')
+        self.refresh_patterns()
+        engine = self.engine
+        document = preprocess(content)
+        context_size = engine.context_size
+        stale = self._stale(previous, engine)
+        if not stale:
+            result = DocumentResult.from_dict(previous, context_size, document)
+            result.document_type = document_type
+            return result
+        
+        carried = {
+            (indicator['detector'], indicator['indicator_name']): indicator
+            for indicator in previous.get('indicators', [])
         }
+        started = time.perf_counter()
+        
+        all_indicators = []
+        for detector_name, detector in engine.detectors.items():
+            rescanned = {}
+            if detector_name in stale:
+                hits = engine.scan_detector(
+                    document, detector_name, started, stale[detector_name]
+                )
+                hits = self._filter([(document, {detector_name: hits})])[0][detector_name]
+                for indicator in detector.build_results(document, hits, engine):
+                    rescanned[indicator.indicator_name] = indicator
+            
+            stale_categories = set(stale.get(detector_name, ()))
+            for category, (indicator_name, _) in detector.indicators.items():
+                if category in stale_categories:
+                    indicator = rescanned.get(indicator_name)
+                else:
+                    stored = carried.get((detector_name, indicator_name))
+                    indicator = stored and IndicatorResult.from_dict(stored, context_size, document)
+                if indicator is not None:
+                    all_indicators.append(indicator)
+        
+        return DocumentResult(all_indicators, document_type, engine.category_fingerprints)
+    
+    def analyze_stream(
+        self,
+        source: Source,
+        document_type: str = 'transcript',
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Analyze a very large document in overlapping windows
+        
+        Args:
+            source: File path, file-like object or iterable of text/bytes chunks
+            document_type: Type of document (transcript, evidence, appeal, etc.)
+            chunk_size: Characters scanned per window
+        
+        Returns:
+            Iterator of evidence events followed by the final result
+        """
+        return analyze_stream(self, source, document_type, chunk_size)
     
     def analyze_case(
         self, 
         case_id: int,
-        documents: List[Dict[str, str]]
+        documents: List[Dict[str, str]],
+        pool: Optional[Any] = None,
+        triage_threshold: Optional[float] = None,
+        score: Optional[Callable[[Dict[str, float]], float]] = None
     ) -> Dict[str, Any]:
         """
         Analyze all documents for a case
@@ -66,64 +389,363 @@ class WrongfulConvictionAnalyzer:
         Args:
             case_id: The case identifier
             documents: List of documents, each with 'type' and 'content'
+            pool: Optional AnalysisPool to analyze documents in parallel
+            triage_threshold: Only decide whether the case's score reaches
+                this threshold, without evidence (see triage)
+            score: Case score for triage (default sum_confidences)
         
         Returns:
             Dictionary containing all detected indicators across all documents
         """
-        case_indicators = []
+        if triage_threshold is not None:
+            return dict(case_id=case_id, **self.triage(documents, triage_threshold, score))
+        return self.analyze_cases([{'case_id': case_id, 'documents': documents}], pool)[0]
+    
+    def triage(
+        self,
+        documents: List[Dict[str, Any]],
+        threshold: float,
+        score: Optional[Callable[[Dict[str, float]], float]] = None,
+        aggregate: str = 'mean'
+    ) -> Dict[str, Any]:
+        """
+        Decide whether a case's score reaches a threshold, scanning as
+        little as possible
+        
+        Indicators are evaluated most valuable first, each across all the
+        documents, stopping at the first match in each document. After
+        each one the score of the indicators found so far is a lower
+        bound on the case's score, and adding every indicator not yet
+        evaluated at its highest possible confidence gives an upper
+        bound; evaluation stops as soon as either settles the question.
+        No evidence is extracted.
         
-        for doc in documents:
-            result = self.analyze_document(
-                doc.get('content', ''),
-                doc.get('type', 'unknown')
+        Args:
+            documents: List of documents, each with 'type' and 'content'
+            threshold: Score the case must reach to pass
+            score: Score of {indicator name: case confidence}, which must
+                not decrease when an indicator is added or a confidence
+                rises (default sum_confidences)
+            aggregate: Case confidence of an indicator found in several
+                documents: 'mean' as merge_case reports it, or 'max' as
+                reanalyze.py stores it in case_indicators
+        
+        Returns:
+            Dictionary with 'passed', the score bounds reached, the number
+            of indicators evaluated and the indicators found with their
+            case confidence
+        """
+        if aggregate not in TRIAGE_AGGREGATES:
+            raise ValueError(
+                f'Unknown aggregate {aggregate!r}; expected one of {TRIAGE_AGGREGATES}'
             )
-            
-            for indicator in result['indicators']:
-                indicator['document_type'] = doc.get('type')
-                case_indicators.append(indicator)
+        self.refresh_patterns()
+        engine = self.engine
+        score = score or sum_confidences
+        docs = [preprocess(doc.get('content', '')) for doc in documents]
         
-        # Remove duplicates and aggregate evidence
-        unique_indicators = self._aggregate_indicators(case_indicators)
+        # Indicator name -> its (detector, category) pairs and the highest
+        # confidence any of them can give it
+        candidates: Dict[str, List[Tuple[str, str]]] = {}
+        bounds: Dict[str, float] = {}
+        for detector_name, detector in engine.detectors.items():
+            for category, (indicator_name, _) in detector.indicators.items():
+                candidates.setdefault(indicator_name, []).append((detector_name, category))
+                bounds[indicator_name] = max(
+                    bounds.get(indicator_name, 0.0), detector.confidence_bound(category)
+                )
+        pending = sorted(bounds, key=lambda name: (-score({name: bounds[name]}), name))
+        
+        found: Dict[str, float] = {}
+        evaluated = 0
+        with metrics.stage('triage'):
+            while True:
+                lower = score(found)
+                upper = score(dict(found, **{name: bounds[name] for name in pending}))
+                if lower >= threshold or upper < threshold or not pending:
+                    break
+                name = pending.pop(0)
+                evaluated += 1
+                confidences = []
+                for document in docs:
+                    for detector_name, category in candidates[name]:
+                        if self._matches(engine, document, detector_name, category):
+                            detector = engine.detectors[detector_name]
+                            confidences.append(detector.adjust_confidence(
+                                category, document, detector.indicators[category][1]
+                            ))
+                if confidences:
+                    found[name] = (
+                        max(confidences) if aggregate == 'max'
+                        else sum(confidences) / len(confidences)
+                    )
         
         return {
-            'case_id': case_id,
+            'passed': lower >= threshold,
+            'threshold': threshold,
+            'score_lower_bound': lower,
+            'score_upper_bound': upper,
+            'indicators_evaluated': evaluated,
+            'indicators_total': len(bounds),
+            'indicators': [
+                {'indicator_name': name, 'confidence': confidence}
+                for name, confidence in found.items()
+            ],
+            'documents_analyzed': len(docs)
+        }
+    
+    def _matches(
+        self, engine: PatternEngine, document, detector_name: str, category: str
+    ) -> bool:
+        """Whether a category matches a document at all (after the linguistic filter)"""
+        spans = []
+        for span in engine.iter_spans(document, detector_name, category):
+            spans.append(span)
+            if self.linguistics is None or len(spans) >= engine.candidates:
+                break
+        if not spans or self.linguistics is None:
+            return bool(spans)
+        hits = {detector_name: {category: spans}}
+        return bool(self._filter([(document, hits)])[0][detector_name].get(category))
+    
+    def analyze_cases(
+        self,
+        cases: List[Dict[str, Any]],
+        pool: Optional[Any] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Analyze several cases, sharing one parallel dispatch across them
+        
+        Args:
+            cases: List of cases, each with 'case_id' and 'documents'
+            pool: Optional AnalysisPool to analyze documents in parallel
+        
+        Returns:
+            One analyze_case result per case, in input order
+        """
+        documents = [doc for case in cases for doc in case['documents']]
+        results = self.analyze_results(documents, pool)
+        
+        case_results = []
+        offset = 0
+        for case in cases:
+            count = len(case['documents'])
+            case_results.append(self.merge_case(case, results[offset:offset + count]))
+            offset += count
+        
+        return case_results
+    
+    def merge_case(
+        self,
+        case: Dict[str, Any],
+        results: List[DocumentResult]
+    ) -> Dict[str, Any]:
+        """
+        Build a case result from its documents' compact results
+        
+        Args:
+            case: Case with 'case_id' and 'documents'
+            results: One analyze_results result per document, in order
+        
+        Returns:
+            Dictionary containing all detected indicators across all documents
+        """
+        case_documents = case['documents']
+        case_indicators = []
+        
+        with metrics.stage('aggregate'):
+            # Merge in document order so evidence order is deterministic
+            for doc, result in zip(case_documents, results):
+                for indicator in result.indicators:
+                    case_indicators.append((doc.get('type'), indicator))
+            
+            # Remove duplicates and aggregate evidence
+            unique_indicators = self._aggregate_indicators(case_indicators)
+        
+        return {
+            'case_id': case['case_id'],
             'total_indicators': len(unique_indicators),
             'indicators': unique_indicators,
-            'documents_analyzed': len(documents)
+            'documents_analyzed': len(case_documents)
         }
     
+    def cache_key(self, document: Dict[str, str]) -> str:
+        """Cache key of a {'type', 'content'} document under the current patterns"""
+        content = document.get('content', '')
+        if isinstance(content, MappedDocument):
+            # Stored documents are identified by their hash, without reading them
+            content = f'sha256:{content.digest}'
+        elif isinstance(content, Document):
+            content = content.text
+        return AnalysisCache.key(
+            content,
+            document.get('type', 'unknown'),
+            f'{self.engine.version}:{COMPACT_FORMAT}'
+        )
+    
+    def cached(self, key: str, document: Dict[str, str]) -> Optional[DocumentResult]:
+        """The cached result of a document, or None"""
+        payload = self.cache.get(key)
+        if payload is None:
+            return None
+        return DocumentResult.from_compact(
+            payload, preprocess(document.get('content', '')), self.engine.category_fingerprints
+        )
+    
+    def analyze_documents(
+        self,
+        documents: List[Dict[str, str]],
+        pool: Optional[Any] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Analyze several documents, in parallel when given a pool
+        
+        Args:
+            documents: List of {'type', 'content'} documents
+            pool: Optional AnalysisPool to analyze documents in parallel
+        
+        Returns:
+            One analyze_document result per document, in input order
+        """
+        results = self.analyze_results(documents, pool)
+        with metrics.stage('contexts'):
+            return [result.to_dict() for result in results]
+    
+    def analyze_results(
+        self,
+        documents: List[Dict[str, Any]],
+        pool: Optional[Any] = None
+    ) -> List[DocumentResult]:
+        """
+        Analyze several documents into compact results
+        
+        Results hold match offsets into the documents and build evidence
+        strings and citations only when converted with to_dict(). Cached
+        documents are served locally and only misses are analyzed, in the
+        pool or else here in one batch. Documents carrying a 'previous'
+        result are brought up to date as by reanalyze_document.
+        
+        Args:
+            documents: List of {'type', 'content'} documents; content may
+                also be a Document, such as one opened from a DocumentStore
+            pool: Optional AnalysisPool to analyze documents in parallel
+        
+        Returns:
+            One DocumentResult per document, in input order
+        """
+        self.refresh_patterns()
+        if self.cache is None:
+            return self._analyze_uncached(documents, pool)
+        
+        keys = [self.cache_key(doc) for doc in documents]
+        results = [self.cached(key, doc) for key, doc in zip(keys, documents)]
+        
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            computed = self._analyze_uncached([documents[index] for index in missing], pool)
+            for index, result in zip(missing, computed):
+                self.cache.put(keys[index], result.to_compact())
+                results[index] = result
+        return results
+    
+    def _analyze_uncached(
+        self,
+        documents: List[Dict[str, Any]],
+        pool: Optional[Any] = None
+    ) -> List[DocumentResult]:
+        # Identical documents (an exhibit attached to several filings) are
+        # analyzed once
+        firsts: Dict[Any, int] = {}
+        copies: Dict[int, int] = {}
+        for index, doc in enumerate(documents):
+            if not doc.get('previous'):
+                first = firsts.setdefault(self._identity(doc.get('content', '')), index)
+                if first != index:
+                    copies[index] = first
+        if copies:
+            unique = [index for index in range(len(documents)) if index not in copies]
+            analyzed = dict(zip(unique, self._analyze_uncached(
+                [documents[index] for index in unique], pool
+            )))
+            return [
+                analyzed[index] if index not in copies else DocumentResult(
+                    analyzed[copies[index]].indicators,
+                    doc.get('type', 'unknown'),
+                    analyzed[copies[index]].fingerprints
+                )
+                for index, doc in enumerate(documents)
+            ]
+        
+        if pool is not None:
+            return pool.analyze_documents(documents)
+        
+        results: List[Optional[DocumentResult]] = [None] * len(documents)
+        fresh = []
+        for index, doc in enumerate(documents):
+            if doc.get('previous'):
+                # Incremental run: rescan only the categories that changed
+                results[index] = self._reanalyze(
+                    doc.get('content', ''), doc['previous'], doc.get('type', 'unknown')
+                )
+            else:
+                fresh.append(index)
+        # Analyzed together so the linguistic filter parses them in one batch
+        analyzed = self._analyze_many([
+            (documents[index].get('content', ''), documents[index].get('type', 'unknown'))
+            for index in fresh
+        ])
+        for index, result in zip(fresh, analyzed):
+            results[index] = result
+        return results
+    
+    @staticmethod
+    def _identity(content: Any) -> Any:
+        """What two documents with the same content have in common"""
+        if isinstance(content, MappedDocument):
+            return ('sha256', content.digest)
+        if isinstance(content, Document):
+            return content.text
+        return content
+    
     def _aggregate_indicators(
         self, 
-        indicators: List[Dict[str, Any]]
+        indicators: List[Tuple[Optional[str], IndicatorResult]]
     ) -> List[Dict[str, Any]]:
         """
         Aggregate duplicate indicators from different documents
+        
+        Takes (document type, indicator) pairs. Confidence is the mean over
+        the documents, which unlike a running pairwise average does not
+        depend on the order of the documents. Evidence quoted word for word
+        by several documents is listed once, citing the first of them.
         """
-        aggregated = {}
+        grouped: Dict[str, List[Tuple[Optional[str], IndicatorResult]]] = {}
+        for document_type, indicator in indicators:
+            grouped.setdefault(indicator.indicator_name, []).append((document_type, indicator))
         
-        for indicator in indicators:
-            name = indicator['indicator_name']
+        aggregated = []
+        for name, group in grouped.items():
+            evidence = []
+            citations = []
+            document_types = []
+            seen = set()
+            for document_type, indicator in group:
+                for citation in indicator.citations():
+                    if citation.context in seen:
+                        continue
+                    seen.add(citation.context)
+                    evidence.append(citation.context)
+                    citations.append(dict(citation.to_dict(), document_type=document_type))
+                if document_type not in document_types:
+                    document_types.append(document_type)
             
-            if name not in aggregated:
-                aggregated[name] = {
-                    'indicator_name': name,
-                    'confidence': indicator['confidence'],
-                    'evidence': indicator.get('evidence', []),
-                    'document_types': [indicator.get('document_type', 'unknown')],
-                    'detectors': [indicator.get('detector', 'unknown')]
-                }
-            else:
-                # Average confidence scores
-                current_conf = aggregated[name]['confidence']
-                new_conf = indicator['confidence']
-                aggregated[name]['confidence'] = (current_conf + new_conf) / 2
-                
-                # Add new evidence
-                aggregated[name]['evidence'].extend(indicator.get('evidence', []))
-                
-                # Track document types
-                doc_type = indicator.get('document_type', 'unknown')
-                if doc_type not in aggregated[name]['document_types']:
-                    aggregated[name]['document_types'].append(doc_type)
-        
-        return list(aggregated.values())
\ No newline at end of file
+            aggregated.append({
+                'indicator_name': name,
+                'confidence': sum(indicator.confidence for _, indicator in group) / len(group),
+                'evidence': evidence,
+                'citations': citations,
+                'document_types': document_types,
+                'detectors': [group[0][1].detector]
+            })
+        
+        return aggregated
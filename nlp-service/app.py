@@ -1,17 +1,246 @@
 """
 NLP Service API for Wrongful Conviction Detection
 """
-from flask import Flask, request, jsonify
+import startup  # first, so that the report times the other imports
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from analyzer import WrongfulConvictionAnalyzer
+from batch import analyze_batch, iter_lines, DEFAULT_MAX_IN_FLIGHT
+from cache import AnalysisCache
+from detectors import BUILTIN_PATH, PatternBudgetExceeded
+from entity_index import EntityIndex
+from jobs import PRIORITIES, JobQueue
+from linguistics import LinguisticFilter
+from pool import AnalysisPool, DocumentTimeout
+from registry import IndicatorRegistry
+from store import DocumentNotFound, DocumentStore, is_reference
+import json
+import metrics
 import os
+import threading
+import time
+
+startup.mark('imports')
 
 app = Flask(__name__)
-analyzer = WrongfulConvictionAnalyzer()
+
+cache_max_mb = int(os.getenv('CACHE_MAX_MB', 64))
+cache = AnalysisCache(
+    max_bytes=cache_max_mb * 1024 * 1024,
+    disk_path=os.getenv('CACHE_PATH') or None,
+    disk_max_bytes=int(os.getenv('CACHE_DISK_MAX_MB', 1024)) * 1024 * 1024
+) if cache_max_mb > 0 else None
+
+# Optional spaCy negation/dependency filter, loaded before the pool forks
+# so every worker starts with the model in memory
+linguistic_filter = LinguisticFilter(
+    model=os.getenv('SPACY_MODEL', 'en_core_web_sm'),
+    batch_size=int(os.getenv('LINGUISTIC_BATCH_SIZE', 256)),
+    n_process=int(os.getenv('LINGUISTIC_PROCESSES', 1))
+) if os.getenv('LINGUISTIC_FILTER', '').lower() in ('1', 'true', 'yes') else None
+if linguistic_filter is not None:
+    linguistic_filter.load()
+    startup.mark('linguistic model')
+
+# Indicator definitions, reloaded without a restart when the file (or, with
+# INDICATORS_FROM_DATABASE, the indicators table) changes
+registry = IndicatorRegistry(
+    path=os.getenv('INDICATOR_DEFINITIONS') or BUILTIN_PATH,
+    database_url=os.getenv('DATABASE_URL') if os.getenv(
+        'INDICATORS_FROM_DATABASE', ''
+    ).lower() in ('1', 'true', 'yes') else None,
+    poll_interval=float(os.getenv('INDICATOR_RELOAD_SECONDS', 10))
+)
+startup.mark('indicator definitions')
+
+# Recently scanned documents, whose matches exact and near duplicates reuse
+# (the module needs numpy, so it is only imported when enabled)
+near_duplicate_mb = int(os.getenv('NEAR_DUPLICATE_MB', 64))
+near_duplicates = None
+if near_duplicate_mb > 0:
+    from duplicates import NearDuplicateIndex
+    near_duplicates = NearDuplicateIndex(
+        threshold=float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.8)),
+        max_chars=near_duplicate_mb * 1024 * 1024
+    )
+    startup.mark('near-duplicate index')
+
+regex_budget_ms = os.getenv('REGEX_BUDGET_MS')
+analyzer = WrongfulConvictionAnalyzer(
+    pattern_mode=os.getenv('PATTERN_MODE', 'proximity'),
+    proximity_tokens=int(os.getenv('PROXIMITY_TOKENS', 10)),
+    time_budget=float(regex_budget_ms) / 1000 if regex_budget_ms else None,
+    cache=cache,
+    pattern_scope=os.getenv('PATTERN_SCOPE', 'document'),
+    linguistic_filter=linguistic_filter,
+    registry=registry,
+    near_duplicates=near_duplicates,
+    # Precompiled by `python startup.py build`; compiled here when missing or stale
+    pattern_artifact=os.getenv('PATTERN_ARTIFACT') or None
+)
+startup.mark('patterns')
+
+# Content-addressed store of documents that requests refer to by hash or
+# documents.file_path instead of sending their text
+document_store = DocumentStore(
+    os.getenv('DOCUMENT_STORE'),
+    document_root=os.getenv('DOCUMENT_ROOT') or None
+) if os.getenv('DOCUMENT_STORE') else None
+
+# Positional index of analyzed documents and their evidence for /search;
+# case documents that carry their documents.id are added as they are analyzed
+# (also imported only when enabled, for numpy)
+search_index = None
+if os.getenv('SEARCH_INDEX'):
+    from search_index import QueryError, SearchIndex
+    search_index = SearchIndex(os.getenv('SEARCH_INDEX'))
+
+# People and agencies named across cases, for Repeat Actor indicators
+entity_index = EntityIndex(
+    os.getenv('ENTITY_INDEX'),
+    min_cases=int(os.getenv('REPEAT_ACTOR_MIN_CASES', 2))
+) if os.getenv('ENTITY_INDEX') else None
+
+# Queue of analysis jobs run by `python jobs.py work` processes
+job_queue = JobQueue(
+    os.getenv('JOB_QUEUE'),
+    lease_seconds=float(os.getenv('JOB_LEASE_SECONDS', 300)),
+    max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+) if os.getenv('JOB_QUEUE') else None
+startup.mark('stores and indexes')
+
+# Build what the first request would otherwise build, before any fork
+analyzer.warm()
+startup.mark('warm')
+
+# Analysis worker processes, so case analysis uses every core. They are
+# forked on first use rather than at import: a server that forks after
+# importing the app (gunicorn) must start them in each of its workers.
+max_workers = int(os.getenv('MAX_WORKERS', os.cpu_count() or 1))
+document_timeout = os.getenv('DOCUMENT_TIMEOUT')
+pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """This process's AnalysisPool, started on first use; None if MAX_WORKERS is 1"""
+    global pool, _pool_pid
+    if max_workers <= 1:
+        return None
+    if pool is not None and _pool_pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if pool is None or _pool_pid != os.getpid():
+            pool = AnalysisPool(
+                analyzer,
+                workers=max_workers,
+                timeout=float(document_timeout) if document_timeout else None,
+                chunk_docs=int(os.getenv('BATCH_SIZE', 32))
+            )
+            _pool_pid = os.getpid()
+            startup.mark('worker pool')
+    return pool
+
+# Items a single /analyze/batch request may have in flight at once
+batch_concurrency = int(os.getenv('BATCH_CONCURRENCY', DEFAULT_MAX_IN_FLIGHT))
+
+@app.before_request
+def start_timing():
+    """Collect stage timings when instrumentation is on or the client asks"""
+    g.started = time.perf_counter()
+    g.timing_token = None
+    if request.headers.get('X-Analysis-Timing'):
+        g.timing_token = metrics.begin_request()
+
+@app.after_request
+def finish_timing(response):
+    """Record request time and return the X-Analysis-Timing breakdown"""
+    elapsed = time.perf_counter() - g.started
+    if metrics.enabled() and request.url_rule is not None:
+        metrics.registry.add_request(request.url_rule.rule, elapsed)
+    if g.timing_token is not None:
+        timings = metrics.end_request(g.timing_token)
+        g.timing_token = None
+        response.headers['X-Analysis-Timing'] = metrics.format_timing(timings, elapsed)
+    return response
+
+@app.errorhandler(PatternBudgetExceeded)
+def pattern_budget_exceeded(error):
+    """Report which detector pattern set blew the regex time budget"""
+    return jsonify({'error': str(error), 'budget': error.to_dict()}), 422
+
+@app.errorhandler(DocumentNotFound)
+def document_not_found(error):
+    """Report references to documents the store does not have"""
+    return jsonify({'error': str(error)}), 404
+
+def resolve_documents(documents):
+    """Replace content_hash and file_path references with stored documents"""
+    if document_store is None:
+        for doc in documents:
+            if is_reference(doc):
+                reference = doc.get('content_hash') or doc.get('file_path')
+                raise DocumentNotFound(f'{reference} (DOCUMENT_STORE is not configured)')
+        return documents
+    return [document_store.resolve(doc) for doc in documents]
+
+def is_threshold(value):
+    """Whether a request's triage_threshold is absent or a number"""
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+
+def index_documents(case_id, documents, results):
+    """Add case documents that carry an id to the search index"""
+    indexed = False
+    for doc, result in zip(documents, results):
+        if doc.get('id') is not None:
+            search_index.add(doc['id'], case_id, doc.get('type'), doc.get('content', ''), result)
+            indexed = True
+    if indexed:
+        search_index.commit()
+        # Merging can take a while for large segments; it never blocks readers
+        threading.Thread(target=search_index.merge, daemon=True).start()
+
+def link_entities(cases, results):
+    """
+    Index the cases' entities, then add their Repeat Actor indicators
+
+    Returns the other cases whose Repeat Actor indicator changed, each with
+    its new indicator (None when it no longer has one), for the caller to
+    store or rescore.
+    """
+    # All cases first, so people recurring within one request are linked
+    changed = set()
+    for case in cases:
+        changed |= entity_index.add_case(case['case_id'], case['documents'])
+    for result in results:
+        changed.discard(result['case_id'])
+        indicator = entity_index.indicator(result['case_id'])
+        if indicator is not None:
+            result['indicators'].append(indicator)
+            result['total_indicators'] += 1
+    return [
+        {'case_id': case_id, 'indicator': entity_index.indicator(case_id)}
+        for case_id in sorted(changed, key=str)
+    ]
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'service': 'nlp-analyzer'})
+    status = {'status': 'healthy', 'service': 'nlp-analyzer'}
+    if cache is not None:
+        status['cache'] = cache.stats()
+    if near_duplicates is not None and max_workers <= 1:
+        # With a pool, each worker process keeps its own index
+        status['near_duplicates'] = near_duplicates.stats()
+    if linguistic_filter is not None:
+        status['linguistic_filter'] = 'parser' if linguistic_filter.load() else 'lexical'
+    status['startup'] = startup.report()
+    return jsonify(status)
+
+@app.errorhandler(DocumentTimeout)
+def document_timeout_exceeded(error):
+    """Report documents that exceeded the per-document timeout"""
+    return jsonify({'error': str(error), 'documents': error.indices}), 504
 
 @app.route('/analyze/document', methods=['POST'])
 def analyze_document():
@@ -23,18 +252,83 @@ def analyze_document():
         "content": "document text",
         "document_type": "transcript|evidence|appeal"
     }
+    
+    Instead of "content", a document in the DOCUMENT_STORE can be named
+    by "content_hash" (as returned by PUT /documents) or "file_path" (a
+    documents.file_path under DOCUMENT_ROOT); it is then scanned in place.
+    With "triage_threshold", only whether the document reaches that score
+    is decided, as for /analyze/case.
     """
-    data = request.get_json()
+    with metrics.stage('parse'):
+        data = request.get_json()
     
-    if not data or 'content' not in data:
+    if not data or ('content' not in data and not is_reference(data)):
         return jsonify({'error': 'Missing content field'}), 400
+    if not is_threshold(data.get('triage_threshold')):
+        return jsonify({'error': 'triage_threshold must be a number'}), 400
+    
+    document = {
+        key: data[key] for key in ('content', 'content_hash', 'file_path') if key in data
+    }
+    document['type'] = data.get('document_type', 'transcript')
     
-    content = data['content']
-    document_type = data.get('document_type', 'transcript')
+    if data.get('triage_threshold') is not None:
+        result = analyzer.triage(resolve_documents([document]), data['triage_threshold'])
+        with metrics.stage('serialize'):
+            return jsonify(result)
     
-    result = analyzer.analyze_document(content, document_type)
+    # With a pool, detection runs in a worker process and this thread
+    # only waits, so one slow document cannot stall other requests
+    result = analyzer.analyze_documents(resolve_documents([document]), get_pool())[0]
     
-    return jsonify(result)
+    with metrics.stage('serialize'):
+        return jsonify(result)
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """
+    Analyze a very large document sent as the raw request body
+    
+    Accepts plain text (chunked transfer encoding is fine) and streams
+    NDJSON back: one event per evidence span as it is found, then the
+    final result.
+    
+    Query parameters:
+        document_type: transcript|evidence|appeal (default transcript)
+    """
+    document_type = request.args.get('document_type', 'transcript')
+    events = analyzer.analyze_stream(request.stream, document_type)
+    
+    return Response(
+        stream_with_context(json.dumps(event) + '\n' for event in events),
+        mimetype='application/x-ndjson'
+    )
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch_endpoint():
+    """
+    Analyze an NDJSON stream of documents and cases
+    
+    Each request line is a document or a case:
+    {"id": "doc-1", "content": "...", "document_type": "transcript"}
+    {"id": "case-123", "case_id": 123, "documents": [{"type": "...", "content": "..."}]}
+    
+    Streams NDJSON back as each item finishes, in completion order:
+    {"id": "doc-1", "result": {...}} or {"id": "doc-1", "error": "..."}
+    
+    Query parameters:
+        concurrency: Items in flight at once (capped at BATCH_CONCURRENCY)
+    """
+    concurrency = request.args.get('concurrency', batch_concurrency, type=int)
+    concurrency = max(1, min(concurrency, batch_concurrency))
+    outputs = analyze_batch(
+        analyzer, iter_lines(request.stream), get_pool(), concurrency, document_store
+    )
+    
+    return Response(
+        stream_with_context(json.dumps(output) + '\n' for output in outputs),
+        mimetype='application/x-ndjson'
+    )
 
 @app.route('/analyze/case', methods=['POST'])
 def analyze_case():
@@ -49,48 +343,220 @@ def analyze_case():
             {"type": "evidence", "content": "..."}
         ]
     }
+    
+    Documents may name stored content by "content_hash" or "file_path"
+    instead of carrying "content", as for /analyze/document. With
+    SEARCH_INDEX configured, documents that carry their "id" (documents.id)
+    are added to the search index, replacing any earlier copy. With
+    ENTITY_INDEX configured, the people the documents name are linked to
+    other cases, and a "Repeat Actor" indicator lists those who recur;
+    "relinked_cases" lists earlier cases whose Repeat Actor indicator this
+    changed, with the new indicator, so they can be rescored.
+    
+    With "triage_threshold" set, the documents are only scanned until it
+    is known whether the case's score (the sum of its indicators'
+    confidences) reaches it; the result has "passed", the score bounds
+    and the indicators found, without evidence, and nothing is indexed.
     """
-    data = request.get_json()
+    with metrics.stage('parse'):
+        data = request.get_json()
     
     if not data or 'case_id' not in data or 'documents' not in data:
         return jsonify({'error': 'Missing required fields'}), 400
+    if not is_threshold(data.get('triage_threshold')):
+        return jsonify({'error': 'triage_threshold must be a number'}), 400
     
     case_id = data['case_id']
-    documents = data['documents']
+    documents = resolve_documents(data['documents'])
+    
+    if data.get('triage_threshold') is not None:
+        result = analyzer.analyze_case(
+            case_id, documents, triage_threshold=data['triage_threshold']
+        )
+        with metrics.stage('serialize'):
+            return jsonify(result)
+    
+    results = analyzer.analyze_results(documents, get_pool())
+    result = analyzer.merge_case({'case_id': case_id, 'documents': documents}, results)
+    if search_index is not None:
+        index_documents(case_id, documents, results)
+    if entity_index is not None:
+        result['relinked_cases'] = link_entities(
+            [{'case_id': case_id, 'documents': documents}], [result]
+        )
+    
+    with metrics.stage('serialize'):
+        return jsonify(result)
+
+@app.route('/analyze/bulk', methods=['POST'])
+def analyze_bulk():
+    """
+    Analyze many cases in one request across the worker pool
     
-    result = analyzer.analyze_case(case_id, documents)
+    Expects JSON:
+    {
+        "cases": [
+            {"case_id": 123, "documents": [{"type": "transcript", "content": "..."}]},
+            {"case_id": 124, "documents": [...]}
+        ]
+    }
     
-    return jsonify(result)
+    With ENTITY_INDEX configured, "relinked_cases" lists the other cases
+    whose Repeat Actor indicator changed, as for /analyze/case.
+    """
+    with metrics.stage('parse'):
+        data = request.get_json()
+    
+    if not data or 'cases' not in data:
+        return jsonify({'error': 'Missing cases field'}), 400
+    
+    cases = data['cases']
+    if any('case_id' not in case or 'documents' not in case for case in cases):
+        return jsonify({'error': 'Each case needs case_id and documents'}), 400
+    
+    cases = [dict(case, documents=resolve_documents(case['documents'])) for case in cases]
+    results = analyzer.analyze_cases(cases, get_pool())
+    response = {'cases': results, 'count': len(results)}
+    if entity_index is not None:
+        response['relinked_cases'] = link_entities(cases, results)
+    
+    with metrics.stage('serialize'):
+        return jsonify(response)
+
+@app.route('/documents', methods=['PUT'])
+def store_document():
+    """
+    Add a document to the DOCUMENT_STORE from the raw request body
+    
+    The body is written to disk as it arrives, never decoded or held in
+    memory. Returns {"content_hash": "..."}, by which analysis requests
+    can then refer to the document instead of sending its text.
+    """
+    if document_store is None:
+        return jsonify({'error': 'DOCUMENT_STORE is not configured'}), 404
+    
+    content_hash = document_store.put_stream(request.stream)
+    return jsonify({'content_hash': content_hash}), 201
+
+@app.route('/jobs', methods=['POST'])
+def enqueue_job():
+    """
+    Queue analysis work for the job workers
+    
+    Expects JSON, naming a stored document:
+    {"document_id": 42, "priority": "ingest", "organization_id": 7}
+    or carrying a case (or just documents) as for /analyze/case:
+    {"case_id": 123, "documents": [...], "priority": "interactive"}
+    
+    priority is interactive (default), ingest or backfill. A document
+    already waiting is not queued again. Returns 202 with the job_id to
+    poll GET /jobs/<job_id> with.
+    """
+    if job_queue is None:
+        return jsonify({'error': 'JOB_QUEUE is not configured'}), 404
+    
+    data = request.get_json()
+    if not data or ('document_id' not in data and 'documents' not in data):
+        return jsonify({'error': 'Missing document_id or documents field'}), 400
+    priority = data.get('priority', 'interactive')
+    if priority not in PRIORITIES:
+        return jsonify({'error': f'Unknown priority {priority!r}'}), 400
+    
+    payload = {
+        key: data[key] for key in ('document_id', 'case_id', 'documents') if key in data
+    }
+    job_id, created = job_queue.enqueue(payload, priority, data.get('organization_id'))
+    return jsonify({'job_id': job_id, 'deduplicated': not created}), 202
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a queued job, with its result once done"""
+    if job_queue is None:
+        return jsonify({'error': 'JOB_QUEUE is not configured'}), 404
+    
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs', methods=['GET'])
+def job_stats():
+    """Jobs by priority class and state"""
+    if job_queue is None:
+        return jsonify({'error': 'JOB_QUEUE is not configured'}), 404
+    return jsonify(job_queue.stats())
+
+@app.route('/search', methods=['GET'])
+def search():
+    """
+    Find documents by words, phrases and indicator evidence
+    
+    Query parameters:
+        q: Query, e.g. "analyst smith" NEAR/20 "hair analysis" or
+           indicator:"discredited forensic methods" microscopic
+        limit: Documents returned (default 50)
+    
+    Returns the matching documents, most matches first, each with its
+    case, detected indicators and the word positions of its matches.
+    """
+    if search_index is None:
+        return jsonify({'error': 'SEARCH_INDEX is not configured'}), 404
+    
+    query = request.args.get('q', '')
+    limit = max(1, request.args.get('limit', 50, type=int))
+    try:
+        return jsonify(search_index.search(query, limit))
+    except QueryError as error:
+        return jsonify({'error': str(error)}), 400
+
+@app.route('/entities', methods=['GET'])
+def entities():
+    """
+    Find the cases naming a person or agency
+    
+    Query parameters:
+        name: e.g. "Detective John Smith", "Smith" or "Springfield Police Dept."
+        role: detective|officer|analyst|expert|informant|prosecutor|witness,
+              for a bare surname
+    """
+    if entity_index is None:
+        return jsonify({'error': 'ENTITY_INDEX is not configured'}), 404
+    
+    name = request.args.get('name', '')
+    if not name.strip():
+        return jsonify({'error': 'Missing name parameter'}), 400
+    return jsonify({'entities': entity_index.lookup(name, request.args.get('role'))})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus metrics: per-pattern, per-detector and per-stage counters"""
+    extra = {}
+    if cache is not None:
+        stats = cache.stats()
+        extra = {
+            f'nlp_cache_{name}': stats[name]
+            for name in ('memory_hits', 'disk_hits', 'misses', 'evictions',
+                         'memory_entries', 'memory_bytes')
+        }
+    body = metrics.render_prometheus(analyzer.engine.patterns, extra)
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 @app.route('/indicators', methods=['GET'])
 def get_indicators():
-    """Get list of all detectable indicators"""
+    """Get list of all detectable indicators, from the current definitions"""
+    analyzer.refresh_patterns()
+    engine = analyzer.engine
     indicators = [
-        # Confession-related
-        'Coerced or False Confession',
-        'Confession Recanted',
-        'Confession Missing Details',
-        'Long High-Pressure Interrogation',
-        # Eyewitness-related
-        'Single Unreliable Eyewitness',
-        'Cross-Racial Identification',
-        'Suggestive Lineup Procedures',
-        'Witness Uncertainty',
-        'Witness Recantation',
-        'Inconsistent Witness Statements',
-        # Forensic-related
-        'No Physical Evidence',
-        'Forensic Evidence Disproven',
-        'Discredited Forensic Methods',
-        'DNA Not Tested',
-        # Misconduct-related
-        'Brady Violations',
-        'Fabricated Witness Statements',
-        'Official Misconduct',
-        'Inflammatory Arguments',
+        indicator_name
+        for detector in engine.detectors.values()
+        for indicator_name, _ in detector.indicators.values()
     ]
     
-    return jsonify({'indicators': indicators, 'count': len(indicators)})
+    return jsonify({
+        'indicators': indicators,
+        'count': len(indicators),
+        'version': registry.version
+    })
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5001))
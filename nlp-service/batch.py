@@ -0,0 +1,249 @@
+"""
+Streaming batch analysis of NDJSON documents and cases
+"""
+import json
+import queue
+from typing import Iterator, Iterable, Dict, Any, List, Optional, Union, IO
+
+from detectors import DocumentResult, PatternBudgetExceeded
+from pool import DocumentTimeout
+from store import DocumentNotFound, DocumentStore, is_reference
+
+# Items analyzed concurrently per batch request
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# Bytes read from the request body at a time
+READ_SIZE = 1 << 16
+
+
+def iter_lines(stream: IO[bytes], read_size: int = READ_SIZE) -> Iterator[bytes]:
+    """
+    Split a binary stream into lines, reading it in blocks
+
+    WSGI input streams often implement readline() a byte at a time.
+    """
+    pending = b''
+    while True:
+        block = stream.read(read_size)
+        if not block:
+            break
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+class BatchItem:
+    """One NDJSON line: a document or a case, with its pending results"""
+
+    def __init__(self, item_id: Any, data: Dict[str, Any]):
+        self.id = item_id
+        self.data = data
+        self.is_case = 'documents' in data
+        if self.is_case:
+            self.documents = data['documents']
+        else:
+            document = {
+                key: data[key] for key in ('content', 'content_hash', 'file_path') if key in data
+            }
+            document['type'] = data.get('document_type', 'transcript')
+            self.documents = [document]
+        self.results: List[Optional[DocumentResult]] = [None] * len(self.documents)
+        self.keys: List[Optional[str]] = [None] * len(self.documents)
+        self.pending_chunks = 0
+
+    def output(self, analyzer) -> Dict[str, Any]:
+        if self.is_case:
+            case = {'case_id': self.data['case_id'], 'documents': self.documents}
+            return {'id': self.id, 'result': analyzer.merge_case(case, self.results)}
+        return {'id': self.id, 'result': self.results[0].to_dict()}
+
+
+def _error(item_id: Any, error: BaseException) -> Dict[str, Any]:
+    output = {'id': item_id, 'error': str(error)}
+    if isinstance(error, PatternBudgetExceeded):
+        output['budget'] = error.to_dict()
+    return output
+
+
+def _in_item(error: BaseException, submitted: List[int]) -> BaseException:
+    """Number a timeout's documents as in the item rather than as submitted"""
+    if isinstance(error, DocumentTimeout):
+        return DocumentTimeout([submitted[i] for i in error.indices], error.timeout)
+    return error
+
+
+def _document_error(document: Any) -> Optional[str]:
+    """Why a request document cannot be analyzed, or None if it can"""
+    if not isinstance(document, dict):
+        return 'Each document must be a JSON object'
+    if 'content' not in document and not is_reference(document):
+        return 'Missing content field'
+    if 'content' in document and not isinstance(document['content'], str):
+        return 'content must be a string'
+    for key in ('content_hash', 'file_path'):
+        if key in document and not isinstance(document[key], str):
+            return f'{key} must be a string'
+    return None
+
+
+def _parse(
+    number: int,
+    line: Union[str, bytes],
+    store: Optional[DocumentStore] = None
+) -> Union[BatchItem, Dict[str, Any]]:
+    """Parse one NDJSON line into a BatchItem, or an error output"""
+    try:
+        data = json.loads(line)
+    except ValueError as error:
+        return {'id': number, 'error': f'Invalid JSON on line {number}: {error}'}
+
+    item_id = data.get('id', number) if isinstance(data, dict) else number
+    if not isinstance(data, dict):
+        return {'id': item_id, 'error': 'Each line must be a JSON object'}
+    if 'documents' in data:
+        if 'case_id' not in data:
+            return {'id': item_id, 'error': 'Missing case_id field'}
+        if not isinstance(data['documents'], list):
+            return {'id': item_id, 'error': 'documents must be a list'}
+
+    item = BatchItem(item_id, data)
+    for document in item.documents:
+        error = _document_error(document)
+        if error is not None:
+            return {'id': item_id, 'error': error}
+    if any(is_reference(doc) for doc in item.documents):
+        if store is None:
+            return {'id': item_id, 'error': 'DOCUMENT_STORE is not configured'}
+        try:
+            item.documents = [store.resolve(doc) for doc in item.documents]
+        except DocumentNotFound as error:
+            return _error(item_id, error)
+    return item
+
+
+def _items(
+    lines: Iterable[Union[str, bytes]],
+    store: Optional[DocumentStore] = None
+) -> Iterator[Union[BatchItem, Dict[str, Any]]]:
+    number = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        number += 1
+        yield _parse(number, line, store)
+
+
+def analyze_batch(
+    analyzer,
+    lines: Iterable[Union[str, bytes]],
+    pool=None,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    store: Optional[DocumentStore] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Analyze NDJSON lines and yield one output per line as it finishes
+
+    Each line is a document ({"id", "content", "document_type"}) or a case
+    ({"id", "case_id", "documents"}); "id" defaults to the line number.
+    Outputs are {"id", "result"} or {"id", "error"} and, with a pool, come
+    back in completion order rather than input order. Given a store,
+    documents may carry a "content_hash" or "file_path" reference instead
+    of "content".
+
+    At most max_in_flight items are analyzed at once. No further input is
+    read until one finishes, so a slow consumer or a busy pool pushes back
+    on the client instead of buffering the request in memory.
+    """
+    if pool is None:
+        for item in _items(lines, store):
+            if isinstance(item, dict):
+                yield item
+                continue
+            try:
+                item.results = analyzer.analyze_results(item.documents)
+                output = item.output(analyzer)
+            except Exception as error:
+                # One bad item must not end the stream
+                yield _error(item.id, error)
+                continue
+            yield output
+        return
+
+    completed: 'queue.Queue' = queue.Queue()
+    in_flight: Dict[int, BatchItem] = {}
+    items = _items(lines, store)
+    sequence = 0
+    exhausted = False
+
+    def dispatch(item: BatchItem) -> Optional[Dict[str, Any]]:
+        """Start an item; returns its output right away if nothing is left to run"""
+        nonlocal sequence
+        sequence += 1
+        tag = sequence
+
+        missing = []
+        for index, doc in enumerate(item.documents):
+            if analyzer.cache is not None:
+                item.keys[index] = analyzer.cache_key(doc)
+                item.results[index] = analyzer.cached(item.keys[index], doc)
+            if item.results[index] is None:
+                missing.append(index)
+        if not missing:
+            return item.output(analyzer)
+
+        in_flight[tag] = item
+        item.pending_chunks = pool.submit(
+            [item.documents[index] for index in missing],
+            lambda chunk, results: completed.put(
+                (tag, [missing[i] for i in chunk], results, None)
+            ),
+            lambda error: completed.put((tag, None, None, _in_item(error, missing)))
+        )
+        return None
+
+    while True:
+        while not exhausted and len(in_flight) < max_in_flight:
+            item = next(items, None)
+            if item is None:
+                exhausted = True
+            elif isinstance(item, dict):
+                yield item
+            else:
+                analyzer.refresh_patterns()
+                try:
+                    output = dispatch(item)
+                except Exception as error:
+                    # One bad item must not end the stream
+                    in_flight.pop(sequence, None)
+                    output = _error(item.id, error)
+                if output is not None:
+                    yield output
+
+        if not in_flight:
+            return
+
+        # The pool fails chunks that overrun its timeout, so this returns
+        tag, indices, results, error = completed.get()
+
+        item = in_flight.get(tag)
+        if item is None:
+            continue  # a chunk of an item that already failed
+        if error is not None:
+            del in_flight[tag]
+            yield _error(item.id, error)
+            continue
+
+        for index, result in zip(indices, results):
+            item.results[index] = result
+            if analyzer.cache is not None:
+                analyzer.cache.put(item.keys[index], result.to_compact())
+        item.pending_chunks -= 1
+        if item.pending_chunks == 0:
+            del in_flight[tag]
+            try:
+                output = item.output(analyzer)
+            except Exception as error:
+                output = _error(item.id, error)
+            yield output
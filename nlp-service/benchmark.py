@@ -0,0 +1,550 @@
+"""
+Benchmark suite for detectors, the analyzer and the HTTP endpoints
+
+Generates synthetic court transcripts of each requested size with a
+controlled density of indicator sentences, then measures latency
+percentiles and throughput for every detector, every pattern,
+analyze_document, analyze_case and the /analyze/* endpoints, plus peak
+RSS per document size. Each size runs in its own process so peak RSS is
+attributable to it. Multi-document requests use distinct transcripts and
+the near-duplicate index is off, so reused matches do not pass for fast
+scanning (run a server benchmarked with --url with NEAR_DUPLICATE_MB=0);
+the dedupe benchmark measures the index on its own.
+
+Results are written as JSON. Given a baseline from an earlier run, any
+metric whose median slows down by more than --threshold fails the run.
+The run also fails when the linguistic filter slows analyze_document by
+more than --linguistic-overhead, its throughput target for corpus
+reprocessing.
+
+Usage:
+    python benchmark.py --sizes 1KB,100KB,1MB --output bench.json
+    python benchmark.py --baseline bench.json --threshold 0.25
+    python benchmark.py --sizes 100MB --skip patterns,endpoints
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import resource
+import sys
+import time
+from typing import List, Dict, Any, Callable, Iterator
+
+# Benchmarks measure analysis, not cache hits or pool start-up
+os.environ.setdefault('CACHE_MAX_MB', '0')
+os.environ.setdefault('DOCUMENT_CACHE_MB', '0')
+os.environ.setdefault('NEAR_DUPLICATE_MB', '0')
+os.environ.setdefault('MAX_WORKERS', '1')
+
+from analyzer import WrongfulConvictionAnalyzer  # noqa: E402
+from linguistics import LinguisticFilter  # noqa: E402
+from detectors import PATTERN_MODES, Document  # noqa: E402
+
+SIZE_UNITS = {'B': 1, 'KB': 1 << 10, 'MB': 1 << 20, 'GB': 1 << 30}
+
+BENCHMARKS = ('detectors', 'patterns', 'analyzer', 'linguistics', 'endpoints', 'dedupe')
+
+NAMES = ['Alvarez', 'Brooks', 'Chen', 'Dawson', 'Ellis', 'Fischer', 'Grant', 'Holloway']
+PLACES = ['store', 'bus station', 'parking lot', 'apartment', 'restaurant', 'gas station']
+TIMES = ['eight', 'nine thirty', 'ten fifteen', 'eleven', 'midnight', 'six in the evening']
+
+# Lines that match no detector pattern
+NEUTRAL_LINES = [
+    'Q. Please state your name for the record.',
+    'A. {name}.',
+    'Q. Where were you on the evening of the third?',
+    'A. I was at the {place} around {time}.',
+    'Q. Who else was present at the {place}?',
+    'A. My cousin and two people from work.',
+    'Q. And what did you do next?',
+    'A. I called my sister and drove home.',
+    'Q. How far is the {place} from your home?',
+    'A. About ten minutes by car.',
+    'Q. Did you speak with Officer {name} that evening?',
+    'A. Yes, he asked me some questions outside.',
+    'A. I do not remember.',
+    'A. Yes.',
+    'A. No, sir.',
+    'MR. {name}: Objection, Your Honor. Relevance.',
+    'THE COURT: Overruled. You may answer.',
+    'THE COURT: Sustained. Move on, counsel.',
+    'MR. {name}: Your Honor, may I approach?',
+    'THE COURT: You may.',
+    '(Whereupon, a short recess was taken.)',
+    'Q. I am showing you what has been marked as Exhibit {number}.',
+    'A. That is the receipt from the {place}.',
+    'Q. What time did you leave the {place}?',
+    'A. Shortly after {time}.',
+]
+
+# One line per indicator category, each matching that category
+INDICATOR_LINES = [
+    'A. They said they would charge my mother, so I was scared and I confessed.',
+    'A. I recanted that statement the very next week.',
+    'Q. The confession was vague and lacked any detail about the weapon?',
+    'A. They kept me in that room for 14 hours without a break.',
+    'MR. {name}: The only witness had a brief glance in dim lighting.',
+    'Q. Were you aware this was a cross-racial identification?',
+    'A. In the photo array he was the only one with a beard. He stood out.',
+    'A. I am not sure. Maybe it was him.',
+    'Q. Did the witness recant her identification before trial?',
+    'Q. Your testimony today contradicts your earlier statement, does it not?',
+    'MR. {name}: There was no physical evidence tying my client to the scene.',
+    'Q. That hair analysis was later discredited as evidence, correct?',
+    'A. Bite mark comparison is now considered junk science.',
+    'A. The DNA on the jacket was never tested.',
+    'MR. {name}: The prosecution withheld evidence that the informant was paid.',
+    'A. I believe the officer fabricated evidence in his report.',
+    'MR. {name}: This case is a textbook example of police misconduct.',
+    'MR. {name}: Counsel made an inflammatory argument in an improper closing.',
+]
+
+LINES_PER_PAGE = 25
+
+
+def parse_size(size: str) -> int:
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?B)\s*', size.upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f'Invalid size: {size}')
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def format_size(size: int) -> str:
+    for unit in ('GB', 'MB', 'KB'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f'{size // SIZE_UNITS[unit]}{unit}'
+    return f'{size}B'
+
+
+def iter_transcript_lines(density: float, seed: int) -> Iterator[str]:
+    """
+    Endless numbered transcript lines with page headers
+
+    density is the fraction of lines that carry an indicator.
+    """
+    rng = random.Random(seed)
+    line_number = 0
+    page = 1
+    while True:
+        if line_number % LINES_PER_PAGE == 0:
+            yield f'{"Page " + str(page):>60}'
+            page += 1
+        template = rng.choice(
+            INDICATOR_LINES if rng.random() < density else NEUTRAL_LINES
+        )
+        text = template.format(
+            name=rng.choice(NAMES),
+            place=rng.choice(PLACES),
+            time=rng.choice(TIMES),
+            number=rng.randint(1, 99)
+        )
+        line_number += 1
+        yield f'{line_number % LINES_PER_PAGE or LINES_PER_PAGE:>2}   {text}'
+
+
+def generate_transcript(size: int, density: float = 0.005, seed: int = 0) -> str:
+    """Synthetic court transcript of exactly `size` characters"""
+    lines = []
+    total = 0
+    for line in iter_transcript_lines(density, seed):
+        lines.append(line)
+        total += len(line) + 1
+        if total >= size:
+            break
+    return '\n'.join(lines)[:size]
+
+
+def amend_transcript(text: str, every: int = 50) -> str:
+    """text with one line in every `every` changed, like an amended filing"""
+    lines = text.split('\n')
+    for index in range(0, len(lines), every):
+        lines[index] += ' (amended)'
+    return '\n'.join(lines)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(
+    function: Callable[[], Any],
+    characters: int,
+    repeats: int,
+    max_seconds: float
+) -> Dict[str, Any]:
+    """Latency percentiles of repeated calls, stopping early on slow inputs"""
+    timings = []
+    started = time.perf_counter()
+    for _ in range(repeats):
+        call_started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - call_started)
+        if time.perf_counter() - started > max_seconds:
+            break
+
+    timings.sort()
+    median = percentile(timings, 0.5)
+    return {
+        'runs': len(timings),
+        'p50_ms': round(median * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'mb_per_sec': round(characters / max(median, 1e-9) / 1e6, 2),
+    }
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+
+def bench_detectors(analyzer, text: str, options) -> Dict[str, Any]:
+    engine = analyzer.engine
+    document = Document(text)
+    return {
+        f'detector:{name}': measure(
+            lambda name=name: engine.scan_detector(document, name),
+            len(text), options.repeats, options.max_seconds
+        )
+        for name in analyzer.detectors
+    }
+
+
+def bench_patterns(analyzer, text: str, options) -> Dict[str, Any]:
+    """Time each raw pattern on its own, as the engine would prepare it"""
+    engine = analyzer.engine
+    lowered = text.lower()
+    results = {}
+    for detector_name, categories in engine.patterns.items():
+        for category, patterns in categories.items():
+            for index, pattern in enumerate(patterns):
+                regex = re.compile(engine.prepare_pattern(pattern.lower()))
+                result = measure(
+                    lambda regex=regex: sum(1 for _ in regex.finditer(lowered)),
+                    len(text), options.repeats, options.max_seconds
+                )
+                result['pattern'] = pattern
+                result['matches'] = sum(1 for _ in regex.finditer(lowered))
+                results[f'pattern:{detector_name}.{category}[{index}]'] = result
+    return results
+
+
+def bench_analyzer(analyzer, texts: List[str], options) -> Dict[str, Any]:
+    documents = [
+        {'type': document_type, 'content': text}
+        for document_type, text in zip(('transcript', 'evidence', 'appeal'), texts)
+    ]
+    return {
+        'analyze_document': measure(
+            lambda: analyzer.analyze_document(texts[0], 'transcript'),
+            len(texts[0]), options.repeats, options.max_seconds
+        ),
+        'analyze_case': measure(
+            lambda: analyzer.analyze_case(1, documents),
+            sum(map(len, texts)), options.repeats, options.max_seconds
+        ),
+    }
+
+
+def bench_dedupe(text: str, options) -> Dict[str, Any]:
+    """Time analyze_case on a transcript, a copy and an amended copy, reusing matches"""
+    from duplicates import NearDuplicateIndex
+    index = NearDuplicateIndex()
+    analyzer = WrongfulConvictionAnalyzer(
+        pattern_mode=options.mode,
+        proximity_tokens=options.tokens,
+        near_duplicates=index
+    )
+    documents = [
+        {'type': 'transcript', 'content': text},
+        {'type': 'appeal', 'content': text},
+        {'type': 'transcript', 'content': amend_transcript(text)},
+    ]
+
+    def analyze() -> None:
+        # Each run starts from an empty index, as a case seen for the first time
+        index.clear()
+        analyzer.analyze_case(1, documents)
+    return {
+        'dedupe:analyze_case': measure(
+            analyze, sum(len(document['content']) for document in documents),
+            options.repeats, options.max_seconds
+        ),
+    }
+
+
+def bench_linguistics(text: str, options) -> Dict[str, Any]:
+    """Time analyze_document with the linguistic filter, model loaded up front"""
+    linguistic_filter = LinguisticFilter(model=options.spacy_model)
+    linguistic_filter.load()
+    analyzer = WrongfulConvictionAnalyzer(
+        pattern_mode=options.mode,
+        proximity_tokens=options.tokens,
+        linguistic_filter=linguistic_filter
+    )
+    return {
+        'linguistic:analyze_document': measure(
+            lambda: analyzer.analyze_document(text, 'transcript'),
+            len(text), options.repeats, options.max_seconds
+        ),
+    }
+
+
+def check_linguistic_overhead(report: Dict[str, Any], max_overhead: float) -> List[str]:
+    """Sizes where the linguistic filter slows analysis beyond the target"""
+    failures = []
+    for label, result in report['sizes'].items():
+        metrics = result['metrics']
+        plain, filtered = metrics.get('analyze_document'), metrics.get('linguistic:analyze_document')
+        if plain is None or filtered is None:
+            continue
+        if filtered['p50_ms'] > plain['p50_ms'] * (1 + max_overhead):
+            failures.append(
+                f'{label} linguistic filter: {plain["p50_ms"]:.2f}ms -> '
+                f'{filtered["p50_ms"]:.2f}ms (target +{max_overhead:.0%})'
+            )
+    return failures
+
+
+def bench_endpoints(texts: List[str], options) -> Dict[str, Any]:
+    """Time the /analyze/* endpoints in-process, or against --url"""
+    text = texts[0]
+    document = json.dumps({'content': text, 'document_type': 'transcript'}).encode()
+    case = json.dumps({
+        'case_id': 1,
+        'documents': [{'type': 'transcript', 'content': content} for content in texts]
+    }).encode()
+    batch = b'\n'.join(
+        json.dumps({'id': index, 'content': content}).encode()
+        for index, content in enumerate(texts)
+    )
+    total = sum(map(len, texts))
+    requests = {
+        'endpoint:/analyze/document': ('/analyze/document', document, 'application/json',
+                                       len(text)),
+        'endpoint:/analyze/case': ('/analyze/case', case, 'application/json', total),
+        'endpoint:/analyze/batch': ('/analyze/batch', batch, 'application/x-ndjson', total),
+        'endpoint:/analyze/stream': ('/analyze/stream', text.encode(), 'text/plain', len(text)),
+    }
+
+    post = _http_poster(options.url) if options.url else _test_client_poster()
+    return {
+        name: measure(
+            lambda path=path, body=body, content_type=content_type:
+                post(path, body, content_type),
+            characters, options.repeats, options.max_seconds
+        )
+        for name, (path, body, content_type, characters) in requests.items()
+    }
+
+
+def _test_client_poster() -> Callable[[str, bytes, str], None]:
+    from app import app
+    client = app.test_client()
+
+    def post(path: str, body: bytes, content_type: str) -> None:
+        response = client.post(path, data=body, content_type=content_type)
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} returned {response.status_code}')
+    return post
+
+
+def _http_poster(url: str) -> Callable[[str, bytes, str], None]:
+    import http.client
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=600)
+
+    def post(path: str, body: bytes, content_type: str) -> None:
+        connection.request('POST', path, body, {'Content-Type': content_type})
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f'{path} returned {response.status}')
+    return post
+
+
+def run_size(size: int, options) -> Dict[str, Any]:
+    """Run every selected benchmark on one document size"""
+    # Distinct transcripts for multi-document requests, so none is a duplicate
+    texts = [
+        generate_transcript(size, options.density, options.seed + index) for index in range(3)
+    ]
+    text = texts[0]
+    analyzer = WrongfulConvictionAnalyzer(
+        pattern_mode=options.mode,
+        proximity_tokens=options.tokens
+    )
+    results: Dict[str, Any] = {}
+    if 'detectors' in options.benchmarks:
+        results.update(bench_detectors(analyzer, text, options))
+    if 'patterns' in options.benchmarks and size <= options.pattern_max_size:
+        results.update(bench_patterns(analyzer, text, options))
+    if 'analyzer' in options.benchmarks:
+        results.update(bench_analyzer(analyzer, texts, options))
+    if 'linguistics' in options.benchmarks:
+        results.update(bench_linguistics(text, options))
+    if 'endpoints' in options.benchmarks:
+        results.update(bench_endpoints(texts, options))
+    if 'dedupe' in options.benchmarks:
+        results.update(bench_dedupe(text, options))
+    return {'metrics': results, 'peak_rss_mb': peak_rss_mb()}
+
+
+def _run_size_in_child(size: int, options, connection) -> None:
+    try:
+        connection.send(run_size(size, options))
+    except Exception as error:
+        connection.send({'error': f'{type(error).__name__}: {error}'})
+    connection.close()
+
+
+def run(options) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'pattern_mode': options.mode,
+            'proximity_tokens': options.tokens,
+            'density': options.density,
+            'url': options.url,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'sizes': {},
+    }
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    for size in options.sizes:
+        label = format_size(size)
+        print(f'Benchmarking {label}...', file=sys.stderr)
+        receiver, sender = context.Pipe(duplex=False)
+        child = context.Process(target=_run_size_in_child, args=(size, options, sender))
+        child.start()
+        sender.close()
+        result = receiver.recv()
+        child.join()
+        if 'error' in result:
+            raise RuntimeError(f'{label}: {result["error"]}')
+        report['sizes'][label] = result
+    return report
+
+
+def compare(
+    report: Dict[str, Any],
+    baseline: Dict[str, Any],
+    threshold: float,
+    min_delta_ms: float
+) -> List[str]:
+    """Regressions of median latency beyond the threshold, as messages"""
+    regressions = []
+    for label, current in report['sizes'].items():
+        previous = baseline.get('sizes', {}).get(label)
+        if previous is None:
+            continue
+        for name, metric in current['metrics'].items():
+            old = previous['metrics'].get(name)
+            if old is None:
+                continue
+            new_ms, old_ms = metric['p50_ms'], old['p50_ms']
+            if new_ms > old_ms * (1 + threshold) and new_ms - old_ms > min_delta_ms:
+                regressions.append(
+                    f'{label} {name}: {old_ms:.2f}ms -> {new_ms:.2f}ms '
+                    f'(+{(new_ms / max(old_ms, 1e-9) - 1) * 100:.0f}%)'
+                )
+    return regressions
+
+
+def print_report(report: Dict[str, Any], slowest_patterns: int = 5) -> None:
+    for label, result in report['sizes'].items():
+        print(f'\n{label} (peak RSS {result["peak_rss_mb"]} MB)')
+        metrics = result['metrics']
+        patterns = sorted(
+            (name for name in metrics if name.startswith('pattern:')),
+            key=lambda name: -metrics[name]['p50_ms']
+        )
+        shown = [name for name in metrics if not name.startswith('pattern:')]
+        shown += patterns[:slowest_patterns]
+        for name in shown:
+            metric = metrics[name]
+            print(
+                f'  {name:<44} p50 {metric["p50_ms"]:10.2f}ms  '
+                f'p99 {metric["p99_ms"]:10.2f}ms  {metric["mb_per_sec"]:8.2f} MB/s  '
+                f'({metric["runs"]} runs)'
+            )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', default='1KB,10KB,100KB,1MB',
+                        help='comma-separated document sizes, 1KB up to 100MB')
+    parser.add_argument('--density', type=float, default=0.005,
+                        help='fraction of transcript lines carrying an indicator')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=20,
+                        help='runs per measurement')
+    parser.add_argument('--max-seconds', type=float, default=10.0,
+                        help='stop repeating a measurement after this long')
+    parser.add_argument('--pattern-max-size', type=parse_size, default=parse_size('1MB'),
+                        help='largest size the per-pattern benchmark runs on')
+    parser.add_argument('--skip', default='',
+                        help=f'comma-separated benchmarks to skip: {", ".join(BENCHMARKS)}')
+    parser.add_argument('--mode', choices=PATTERN_MODES,
+                        default=os.getenv('PATTERN_MODE', 'proximity'))
+    parser.add_argument('--tokens', type=int, default=int(os.getenv('PROXIMITY_TOKENS', 10)))
+    parser.add_argument('--spacy-model', default=os.getenv('SPACY_MODEL', 'en_core_web_sm'))
+    parser.add_argument('--linguistic-overhead', type=float, default=0.5,
+                        help='fail when the linguistic filter makes analyze_document '
+                             'this much slower than plain regex analysis')
+    parser.add_argument('--url', help='benchmark endpoints on a running server instead '
+                                      'of in-process, e.g. http://localhost:5001')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fail when a median is this much slower than the baseline')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='ignore regressions smaller than this many milliseconds')
+    options = parser.parse_args()
+
+    options.sizes = [parse_size(size) for size in options.sizes.split(',')]
+    skipped = {name.strip() for name in options.skip.split(',') if name.strip()}
+    unknown = skipped - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+    options.benchmarks = [name for name in BENCHMARKS if name not in skipped]
+
+    report = run(options)
+    print_report(report)
+
+    if options.output:
+        with open(options.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+    failures = check_linguistic_overhead(report, options.linguistic_overhead)
+    for failure in failures:
+        print(f'SLOW {failure}')
+
+    if options.baseline:
+        with open(options.baseline) as handle:
+            baseline = json.load(handle)
+        regressions = compare(report, baseline, options.threshold, options.min_delta_ms)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        print(f'\n{len(regressions)} regressions beyond {options.threshold:.0%} '
+              f'of {options.baseline}')
+        return 1 if regressions or failures else 0
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
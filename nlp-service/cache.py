@@ -0,0 +1,194 @@
+"""
+Content-addressed cache of document analysis results
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+# Recompute the disk tier's total size after this many writes
+DISK_SIZE_CHECK_INTERVAL = 64
+
+
+class AnalysisCache:
+    """
+    Two-tier cache of analyze_document results
+
+    Entries are keyed by a hash of the content, document type and pattern
+    set version, so any change to a detector's patterns makes old entries
+    unreachable. The in-process tier is an LRU bounded by serialized size.
+    The optional disk tier is a SQLite file that every gunicorn worker can
+    share, evicting least recently used entries beyond its size limit.
+    Each thread queries it on a connection of its own, outside the lock
+    guarding the in-process tier, so a slow disk never stalls memory hits.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        disk_path: Optional[str] = None,
+        disk_max_bytes: int = 1024 * 1024 * 1024
+    ):
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path
+        self.disk_max_bytes = disk_max_bytes
+
+        self._memory: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._memory_bytes = 0
+        # Guards the in-process tier and the counters, never disk I/O
+        self._lock = threading.Lock()
+        self._disk = threading.local()
+        self._disk_writes = 0
+
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+
+    @staticmethod
+    def key(content: str, document_type: str, version: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(version.encode())
+        digest.update(b'\0')
+        digest.update(document_type.encode())
+        digest.update(b'\0')
+        digest.update(content.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh copy of the cached result, or None"""
+        with self._lock:
+            payload = self._memory.get(key)
+            if payload is not None:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+        if payload is not None:
+            return json.loads(payload)
+
+        payload = self._disk_get(key)
+        if payload is not None:
+            with self._lock:
+                self.counters['disk_hits'] += 1
+            self._memory_put(key, payload)
+            return json.loads(payload)
+
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        payload = json.dumps(result, separators=(',', ':')).encode()
+        self._memory_put(key, payload)
+        self._disk_put(key, payload)
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = sum(
+                self.counters[name] for name in ('memory_hits', 'disk_hits', 'misses')
+            )
+            hits = self.counters['memory_hits'] + self.counters['disk_hits']
+            return dict(
+                self.counters,
+                hit_rate=round(hits / lookups, 4) if lookups else 0.0,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_bytes,
+                disk_enabled=self.disk_path is not None
+            )
+
+    def _memory_put(self, key: str, payload: bytes) -> None:
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._memory[key] = payload
+            self._memory_bytes += len(payload)
+            while self._memory_bytes > self.max_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                self.counters['evictions'] += 1
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """This thread's disk tier connection, reopened after a fork"""
+        if self.disk_path is None:
+            return None
+        disk = self._disk
+        if getattr(disk, 'connection', None) is None or disk.pid != os.getpid():
+            connection = sqlite3.connect(self.disk_path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS analysis_cache ('
+                'key TEXT PRIMARY KEY, result BLOB NOT NULL, '
+                'size INTEGER NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS idx_analysis_cache_accessed '
+                'ON analysis_cache(accessed_at)'
+            )
+            disk.connection = connection
+            disk.pid = os.getpid()
+        return disk.connection
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        connection = self._connection()
+        if connection is None:
+            return None
+        row = connection.execute(
+            'SELECT result FROM analysis_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute(
+            'UPDATE analysis_cache SET accessed_at = ? WHERE key = ?',
+            (time.time(), key)
+        )
+        return row[0]
+
+    def _disk_put(self, key: str, payload: bytes) -> None:
+        connection = self._connection()
+        if connection is None or len(payload) > self.disk_max_bytes:
+            return
+        connection.execute(
+            'INSERT OR REPLACE INTO analysis_cache (key, result, size, accessed_at) '
+            'VALUES (?, ?, ?, ?)',
+            (key, payload, len(payload), time.time())
+        )
+        with self._lock:
+            self._disk_writes += 1
+            check_size = self._disk_writes % DISK_SIZE_CHECK_INTERVAL == 0
+        if check_size:
+            self._disk_evict(connection)
+
+    def _disk_evict(self, connection: sqlite3.Connection) -> None:
+        """Trim the disk tier to 90% of its limit, least recently used first"""
+        total = connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM analysis_cache'
+        ).fetchone()[0]
+        if total <= self.disk_max_bytes:
+            return
+
+        target = total - int(self.disk_max_bytes * 0.9)
+        freed = 0
+        evicted = []
+        for key, size in connection.execute(
+            'SELECT key, size FROM analysis_cache ORDER BY accessed_at'
+        ):
+            evicted.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        connection.executemany('DELETE FROM analysis_cache WHERE key = ?', evicted)
+        with self._lock:
+            self.counters['evictions'] += len(evicted)
@@ -0,0 +1,164 @@
+"""
+Database access for batch jobs, against PostgreSQL or the SQLite schema
+"""
+import os
+import sqlite3
+from typing import List, Tuple, Any, Iterator, Sequence, Set
+
+
+class Database:
+    """
+    Thin wrapper over a DB-API connection
+
+    SQL is written with '?' placeholders and translated per dialect.
+    """
+
+    dialect = ''
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def _sql(self, sql: str) -> str:
+        return sql
+
+    def execute(self, sql: str, params: Sequence[Any] = ()):
+        cursor = self.connection.cursor()
+        cursor.execute(self._sql(sql), params)
+        return cursor
+
+    def query(self, sql: str, params: Sequence[Any] = ()) -> List[Tuple]:
+        return self.execute(sql, params).fetchall()
+
+    def insert_many(self, sql: str, rows: List[Sequence[Any]]) -> None:
+        """Run a single-row INSERT statement for many rows at once"""
+        if rows:
+            self.connection.cursor().executemany(self._sql(sql), rows)
+
+    def update_many(self, sql: str, rows: List[Sequence[Any]]) -> None:
+        """Run an UPDATE (or any other statement) once per row"""
+        if rows:
+            self.connection.cursor().executemany(self._sql(sql), rows)
+
+    def iter_batches(
+        self,
+        sql: str,
+        params: Sequence[Any],
+        batch_size: int
+    ) -> Iterator[List[Tuple]]:
+        """Stream the rows of a query in batches"""
+        cursor = self.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+    def table_exists(self, table: str) -> bool:
+        raise NotImplementedError
+
+    def columns(self, table: str) -> Set[str]:
+        raise NotImplementedError
+
+    def in_clause(self, values: Sequence[Any]) -> str:
+        return ', '.join('?' for _ in values)
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class SQLiteDatabase(Database):
+    dialect = 'sqlite'
+
+    def table_exists(self, table: str) -> bool:
+        rows = self.query(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        )
+        return bool(rows)
+
+    def columns(self, table: str) -> Set[str]:
+        return {row[1] for row in self.query(f'PRAGMA table_info({table})')}
+
+
+class PostgresDatabase(Database):
+    dialect = 'postgresql'
+
+    def _sql(self, sql: str) -> str:
+        return sql.replace('?', '%s')
+
+    def insert_many(self, sql: str, rows: List[Sequence[Any]]) -> None:
+        """Send all rows as multi-row VALUES lists instead of one per statement"""
+        if not rows:
+            return
+        from psycopg2.extras import execute_values
+
+        # execute_values expands a single 'VALUES %s' into many rows
+        head, _, tail = self._sql(sql).partition('VALUES')
+        template = tail.strip()
+        values_end = template.index(')') + 1
+        execute_values(
+            self.connection.cursor(),
+            f'{head}VALUES %s{template[values_end:]}',
+            rows,
+            template=template[:values_end],
+            page_size=1000
+        )
+
+    def update_many(self, sql: str, rows: List[Sequence[Any]]) -> None:
+        """Send rows in pages of statements instead of one round trip each"""
+        if not rows:
+            return
+        from psycopg2.extras import execute_batch
+
+        execute_batch(self.connection.cursor(), self._sql(sql), rows, page_size=1000)
+
+    def iter_batches(
+        self,
+        sql: str,
+        params: Sequence[Any],
+        batch_size: int
+    ) -> Iterator[List[Tuple]]:
+        """Stream rows through a server-side cursor that survives commits"""
+        cursor = self.connection.cursor(name='nlp_batch_cursor', withhold=True)
+        cursor.itersize = batch_size
+        cursor.execute(self._sql(sql), params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            cursor.close()
+
+    def table_exists(self, table: str) -> bool:
+        return bool(self.query('SELECT to_regclass(?)', (table,))[0][0])
+
+    def columns(self, table: str) -> Set[str]:
+        rows = self.query(
+            'SELECT column_name FROM information_schema.columns WHERE table_name = ?',
+            (table,)
+        )
+        return {row[0] for row in rows}
+
+
+def connect(url: str) -> Database:
+    """
+    Open a database from a URL
+
+    Accepts postgresql://... (requires psycopg2), sqlite:///path/to.db or a
+    plain path to a SQLite file.
+    """
+    if url.startswith(('postgresql://', 'postgres://')):
+        try:
+            import psycopg2
+        except ImportError:
+            raise RuntimeError('psycopg2 is required for PostgreSQL databases')
+        return PostgresDatabase(psycopg2.connect(url))
+
+    path = url[len('sqlite:///'):] if url.startswith('sqlite:///') else url
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'SQLite database not found: {path}')
+    return SQLiteDatabase(sqlite3.connect(path))
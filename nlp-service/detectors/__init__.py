@@ -1,12 +1,72 @@
 """
 NLP Detectors for Wrongful Conviction Indicators
 """
+from .alignment import Alignment, align
+from .artifact import load_engine, save_engine
+from .base import BaseDetector
+from .citations import Citation, LineIndex
+from .definitions import (
+    BUILTIN_PATH,
+    builtin_definitions,
+    build_detectors,
+    load_definitions,
+    validate_definitions,
+)
+from .document import (
+    Document,
+    DocumentCache,
+    MappedDocument,
+    MappedText,
+    SCOPES,
+    preprocess,
+    scannable,
+)
+from .entities import Entity, ROLE_LABELS, extract_entities, name_words, person_key, agency_key
+from .engine import (
+    PatternEngine,
+    PatternBudgetExceeded,
+    PATTERN_MODES,
+    fingerprint_patterns,
+)
+from .results import IndicatorResult, DocumentResult, COMPACT_FORMAT
 from .confession_detector import ConfessionDetector
 from .eyewitness_detector import EyewitnessDetector
 from .forensic_detector import ForensicDetector
 from .misconduct_detector import MisconductDetector
 
 __all__ = [
+    'Alignment',
+    'align',
+    'load_engine',
+    'save_engine',
+    'BaseDetector',
+    'Citation',
+    'LineIndex',
+    'BUILTIN_PATH',
+    'builtin_definitions',
+    'build_detectors',
+    'load_definitions',
+    'validate_definitions',
+    'Document',
+    'DocumentCache',
+    'MappedDocument',
+    'MappedText',
+    'SCOPES',
+    'preprocess',
+    'scannable',
+    'Entity',
+    'ROLE_LABELS',
+    'extract_entities',
+    'name_words',
+    'person_key',
+    'agency_key',
+    'PatternEngine',
+    'PatternBudgetExceeded',
+    'PATTERN_MODES',
+    'fingerprint_patterns',
+    'IndicatorResult',
+    'DocumentResult',
+    'COMPACT_FORMAT',
     'ConfessionDetector',
     'EyewitnessDetector',
     'ForensicDetector',
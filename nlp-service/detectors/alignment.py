@@ -0,0 +1,188 @@
+"""
+Alignment of a document with an earlier one it mostly repeats, so only
+the text that differs is scanned again
+
+Re-filed motions, amended transcripts and exhibits attached to several
+filings share most of their lines with a document already analyzed. An
+Alignment pairs the text the two have in common with the earlier
+document's raw matches. Within shared text, a category's next match is
+read off the earlier matches; the regex only searches the rest. Matches
+are exactly those of a full scan: a match starting inside shared text at
+least the category's maximum match width before its end reads nothing
+but shared text, and finditer's positions there follow the earlier
+document's.
+"""
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import List, Dict, Tuple, Pattern, Match, Optional
+
+from .prefilter import Search
+
+Span = Tuple[int, int]
+
+# (offset in the earlier document, offset in this one, length)
+Block = Tuple[int, int, int]
+
+
+def align(earlier: str, text: str) -> List[Block]:
+    """
+    Runs of identical text in two documents, in order
+
+    Lines that occur once in each document are paired up where their
+    order agrees (as in patience diff), and runs of equal lines are grown
+    from each pair; this stays near linear for long documents that share
+    most of their lines, where a general diff would not.
+    """
+    earlier_lines = earlier.split('\n')
+    lines = text.split('\n')
+    earlier_offsets = [0, *accumulate(len(line) + 1 for line in earlier_lines)]
+    offsets = [0, *accumulate(len(line) + 1 for line in lines)]
+
+    blocks = []
+    earlier_end = end = 0
+    for earlier_line, line in _unique_pairs(earlier_lines, lines):
+        if line < end:
+            continue
+        # Grow the run back to the previous one and forward to a difference
+        while (earlier_line > earlier_end and line > end
+               and earlier_lines[earlier_line - 1] == lines[line - 1]):
+            earlier_line -= 1
+            line -= 1
+        earlier_end, end = earlier_line, line
+        while (earlier_end < len(earlier_lines) and end < len(lines)
+               and earlier_lines[earlier_end] == lines[end]):
+            earlier_end += 1
+            end += 1
+        start = offsets[line]
+        earlier_start = earlier_offsets[earlier_line]
+        # The last line of either text has no newline after it
+        length = min(
+            offsets[end] - start, len(text) - start,
+            earlier_offsets[earlier_end] - earlier_start, len(earlier) - earlier_start
+        )
+        blocks.append((earlier_start, start, length))
+    return blocks
+
+
+def _unique_pairs(earlier_lines: List[str], lines: List[str]) -> List[Tuple[int, int]]:
+    """
+    (earlier index, index) of lines occurring once in each document, the
+    longest subsequence of them in the same order in both
+    """
+    counts: Dict[str, int] = {}
+    for line in earlier_lines:
+        counts[line] = counts.get(line, 0) + 1
+    positions: Dict[str, int] = {}
+    for index, line in enumerate(lines):
+        if counts.get(line) == 1:
+            positions[line] = -1 if line in positions else index
+    pairs = [
+        (earlier_index, positions[line])
+        for earlier_index, line in enumerate(earlier_lines)
+        if positions.get(line, -1) >= 0
+    ]
+
+    # Longest increasing subsequence of the second indices
+    tails: List[int] = []        # pair ending the best chain of each length
+    tail_indices: List[int] = []
+    previous: List[int] = []
+    for position, (_, index) in enumerate(pairs):
+        length = bisect_left(tail_indices, index)
+        previous.append(tails[length - 1] if length else -1)
+        if length == len(tails):
+            tails.append(position)
+            tail_indices.append(index)
+        else:
+            tails[length] = position
+            tail_indices[length] = index
+    chain = []
+    position = tails[-1] if tails else -1
+    while position >= 0:
+        chain.append(pairs[position])
+        position = previous[position]
+    return chain[::-1]
+
+
+class Alignment:
+    """
+    Text a document shares with an earlier, already scanned document
+
+    blocks are runs of identical text (see align); hits are the earlier
+    document's raw scan results, at most `candidates` spans per category,
+    so a category with fewer is known to have no other match.
+    """
+
+    def __init__(
+        self,
+        blocks: List[Block],
+        hits: Dict[str, Dict[str, List[Span]]],
+        candidates: int
+    ):
+        self.blocks = blocks
+        self.hits = hits
+        self.candidates = candidates
+
+    def shared(self) -> int:
+        """Characters of the document shared with the earlier one"""
+        return sum(length for _, _, length in self.blocks)
+
+    def search(
+        self,
+        detector_name: str,
+        category: str,
+        regex: Pattern,
+        target: str,
+        window: int,
+        fallback: Search
+    ) -> Optional[Search]:
+        """
+        A Search answering from the earlier matches within shared text
+        (less the last window characters of each run) and with fallback
+        elsewhere; None when no run is long enough to help
+        """
+        zones = [
+            (start, start + length - window, start - earlier_start)
+            for earlier_start, start, length in self.blocks
+            if length > window
+        ]
+        if not zones:
+            return None
+        zone_starts = [start for start, _, _ in zones]
+        spans = self.hits.get(detector_name, {}).get(category, [])
+        starts = [start for start, _ in spans]
+        ends = [end for _, end in spans]
+        complete = len(spans) < self.candidates
+
+        def shared_search(pos: int, stop: int, shift: int) -> Optional[Match]:
+            """The leftmost match starting in [pos, stop), all of it shared text"""
+            earlier_pos = pos - shift
+            index = bisect_left(starts, earlier_pos)
+            if index and ends[index - 1] > earlier_pos:
+                # Inside an earlier match: finditer never searched from here
+                return fallback(pos, stop)
+            if index < len(starts):
+                start = starts[index] + shift
+                if start >= stop:
+                    return None
+                match = regex.match(target, start, min(len(target), start + window))
+                return match if match is not None else fallback(pos, stop)
+            return None if complete else fallback(pos, stop)
+
+        def search(pos: int, limit: Optional[int] = None) -> Optional[Match]:
+            while limit is None or pos < limit:
+                index = bisect_right(zone_starts, pos) - 1
+                if index >= 0 and pos < zones[index][1]:
+                    _, zone_end, shift = zones[index]
+                    stop = zone_end if limit is None else min(zone_end, limit)
+                    match = shared_search(pos, stop, shift)
+                else:
+                    stop = zone_starts[index + 1] if index + 1 < len(zones) else None
+                    if limit is not None:
+                        stop = limit if stop is None else min(stop, limit)
+                    match = fallback(pos, stop)
+                if match is not None or stop is None:
+                    return match
+                pos = stop
+            return None
+
+        return search
@@ -0,0 +1,122 @@
+"""
+Precompiled pattern artifact: a PatternEngine saved with its regexes
+already compiled, so that a new process loads it instead of compiling
+
+Pickle stores a compiled regex as its source, which is parsed and
+compiled again on load. The artifact stores the compiled program of each
+regex instead (as re's compiler emits it) and rebuilds the pattern
+object from it directly, together with the rest of a warmed engine: the
+prefilter's anchors and Aho-Corasick automaton, match windows, and the
+fallback, per-pattern and bytes regexes. Programs are only valid for the
+Python build that compiled them, so an artifact from another build, or
+for other definitions or engine options, is ignored and the engine is
+compiled as usual.
+"""
+import copyreg
+import io
+import logging
+import os
+import pickle
+import re
+import sys
+from typing import Any, Dict, Optional, Pattern
+
+import _sre
+
+from .document import binary_pattern, remember_binary
+from .engine import PatternEngine, engine_version, fingerprint_patterns
+
+try:
+    from re import _compiler as sre_compile, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_compile
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_FORMAT = 1
+
+# Regex programs change between Python builds
+PROGRAM_FORMAT = (sys.hexversion, _sre.MAGIC, _sre.CODESIZE)
+
+
+def _program(regex: Pattern) -> tuple:
+    """Arguments that make _sre.compile rebuild regex without parsing it"""
+    parsed = sre_parse.parse(regex.pattern, regex.flags)
+    groupindex = dict(parsed.state.groupdict)
+    indexgroup = [None] * parsed.state.groups
+    for name, index in groupindex.items():
+        indexgroup[index] = name
+    # Opcodes are named int constants, which do not pickle
+    code = [int(word) for word in sre_compile._code(parsed, regex.flags)]
+    program = (
+        regex.pattern, regex.flags, code,
+        parsed.state.groups - 1, groupindex, tuple(indexgroup)
+    )
+    if _sre.compile(*program) != regex:
+        raise ValueError(f'Cannot precompile {regex.pattern!r}')
+    return program
+
+
+def _reduce_pattern(regex: Pattern):
+    return _sre.compile, _program(regex)
+
+
+class _Pickler(pickle.Pickler):
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[re.Pattern] = _reduce_pattern
+
+
+def save_engine(engine: PatternEngine, path: str) -> None:
+    """Warm engine and write it, with its compiled regexes, to path"""
+    engine.warm()
+    state = {key: value for key, value in vars(engine).items() if key != 'detectors'}
+    buffer = io.BytesIO()
+    # A header readable without rebuilding any regex, then the engine
+    pickle.dump({
+        'format': (ARTIFACT_FORMAT, PROGRAM_FORMAT),
+        'version': engine.version,
+        'prefilter': engine.prefilter is not None,
+    }, buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    _Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump({
+        'engine': state,
+        'binary': {regex: binary_pattern(regex) for regex in engine.regexes()},
+    })
+    # Written aside and renamed, so a starting process never reads half a file
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as handle:
+        handle.write(buffer.getbuffer())
+    os.replace(temporary, path)
+
+
+def load_engine(path: str, detectors: Dict[str, Any], **options: Any) -> Optional[PatternEngine]:
+    """
+    The engine saved at path if it was compiled from these detectors with
+    these PatternEngine options, else None
+    """
+    try:
+        with open(path, 'rb') as handle:
+            header = pickle.load(handle)
+            if header.get('format') != (ARTIFACT_FORMAT, PROGRAM_FORMAT):
+                logger.warning('Pattern artifact %s was built by another Python; compiling', path)
+                return None
+            expected = engine_version(fingerprint_patterns(detectors), **options)
+            if (
+                header['version'] != expected
+                or header['prefilter'] != options.get('prefilter', True)
+            ):
+                logger.warning('Pattern artifact %s is out of date; compiling', path)
+                return None
+            artifact = pickle.load(handle)
+    except (OSError, ImportError, pickle.UnpicklingError, EOFError, AttributeError,
+            ValueError) as error:
+        logger.warning('Cannot load pattern artifact %s: %s', path, error)
+        return None
+
+    engine = PatternEngine.__new__(PatternEngine)
+    vars(engine).update(artifact['engine'])
+    engine.detectors = dict(detectors)
+    # Not part of the compiled state
+    engine.time_budget = options.get('time_budget')
+    remember_binary(artifact['binary'])
+    return engine
@@ -0,0 +1,112 @@
+"""
+Base class shared by the pattern-driven detectors
+"""
+from typing import List, Dict, Any, Tuple, Optional, Union
+
+from .definitions import builtin_definitions
+from .document import Document, preprocess
+from .engine import PatternEngine
+from .results import IndicatorResult
+
+
+class BaseDetector:
+    """
+    Turns the hits of a PatternEngine scan into indicator results
+
+    A detector's `patterns` (category -> regexes), `indicators` (category
+    -> indicator name and base confidence) and `scopes` (categories kept
+    within a 'sentence' or speaker 'turn') come from its entry in the
+    indicator definitions, the built-in ones unless others are given.
+    Subclasses only add behaviour that needs code, such as
+    adjust_confidence (and confidence_bound to match).
+    """
+
+    name = ''
+
+    def __init__(self, definition: Optional[Dict[str, Any]] = None, name: Optional[str] = None):
+        if name is not None:
+            self.name = name
+        self.patterns: Dict[str, List[str]] = {}
+        self.indicators: Dict[str, Tuple[str, float]] = {}
+        self.scopes: Dict[str, str] = {}
+        self._engine = None
+        if definition is None:
+            definition = builtin_definitions()['detectors'].get(self.name, {})
+        self.configure(definition)
+
+    def configure(self, definition: Dict[str, Any]) -> None:
+        """Take categories from a detector's definition"""
+        patterns, indicators, scopes = {}, {}, {}
+        for category, spec in definition.get('categories', {}).items():
+            patterns[category] = list(spec['patterns'])
+            indicators[category] = (spec['indicator'], spec['confidence'])
+            if 'scope' in spec:
+                scopes[category] = spec['scope']
+        self.patterns, self.indicators, self.scopes = patterns, indicators, scopes
+        self._engine = None
+
+    def detect(
+        self,
+        text: Union[str, Document],
+        document_type: str,
+        engine: Optional[PatternEngine] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Detect indicators in text
+
+        Uses the analyzer's shared engine when given, otherwise compiles
+        this detector's patterns once on first use.
+        """
+        if engine is None:
+            engine = self._own_engine()
+
+        document = preprocess(text)
+        hits = engine.scan_detector(document, self.name)
+        results = []
+        for indicator in self.build_results(document, hits, engine):
+            result = indicator.to_dict()
+            del result['detector']
+            results.append(result)
+        return results
+
+    def build_results(
+        self,
+        document: Document,
+        hits: Dict[str, List[Tuple[int, int]]],
+        engine: PatternEngine
+    ) -> List[IndicatorResult]:
+        """Build compact indicator results from this detector's scan hits"""
+        results = []
+
+        for category, (indicator_name, confidence) in self.indicators.items():
+            spans = hits.get(category)
+            if not spans:
+                continue
+            results.append(IndicatorResult(
+                indicator_name,
+                self.adjust_confidence(category, document, confidence),
+                self.name,
+                spans,
+                engine.context_size,
+                document
+            ))
+
+        return results
+
+    def adjust_confidence(
+        self,
+        category: str,
+        document: Document,
+        confidence: float
+    ) -> float:
+        """Hook for detectors that adjust confidence based on the document"""
+        return confidence
+
+    def confidence_bound(self, category: str) -> float:
+        """Highest confidence adjust_confidence can give a category"""
+        return self.indicators[category][1]
+
+    def _own_engine(self) -> PatternEngine:
+        if self._engine is None:
+            self._engine = PatternEngine({self.name: self})
+        return self._engine
@@ -0,0 +1,148 @@
+"""
+Evidence citations located by page and line from match offsets
+"""
+from bisect import bisect_right
+from typing import List, Dict, Any, Optional
+
+# Characters between line-count checkpoints
+BLOCK_SIZE = 1 << 16
+
+
+class LineIndex:
+    """
+    Maps character offsets to page and line numbers
+
+    Line and page counts are checkpointed every BLOCK_SIZE characters
+    once per document, so locating a match only counts line breaks from
+    the nearest checkpoint rather than from the start of the document.
+    Counting uses str.count, which keeps building the index far cheaper
+    than a regex scan even on documents with millions of lines.
+
+    Pages are separated by form feeds (as emitted by pdftotext and most
+    transcript exports) and lines are numbered from 1 on each page, the
+    way transcripts are cited; a form feed also ends a line. Text can be
+    added incrementally with extend() and old text dropped with trim(),
+    for documents analyzed as a stream.
+    """
+
+    def __init__(self, text: str = ''):
+        # Each segment: [start offset, text, line breaks before each block]
+        self.segments: List[List[Any]] = []
+        self.length = 0
+        self.breaks = 0
+        # Start offset and line breaks before it, per page
+        self.page_starts = [0]
+        self.page_breaks = [0]
+        self._pending = text
+
+    def _build(self) -> None:
+        """Index text passed to the constructor, on first lookup"""
+        if self._pending:
+            text, self._pending = self._pending, ''
+            self.extend(text)
+
+    def extend(self, text: str) -> None:
+        """Index text that follows everything indexed so far"""
+        self._build()
+        start = self.length
+        checkpoints = []
+        position = 0
+        for block in range(0, len(text), BLOCK_SIZE):
+            checkpoints.append(self.breaks)
+            end = block + BLOCK_SIZE
+            feed = text.find('\f', block, end)
+            while feed != -1:
+                self.breaks = self._count(text, self.breaks, position, feed + 1)
+                position = feed + 1
+                self.page_starts.append(start + position)
+                self.page_breaks.append(self.breaks)
+                feed = text.find('\f', position, end)
+            self.breaks = self._count(text, self.breaks, position, end)
+            position = end
+        self.segments.append([start, text, checkpoints])
+        self.length += len(text)
+
+    @staticmethod
+    def _count(text: str, before: int, start: int, end: int) -> int:
+        return before + text.count('\n', start, end) + text.count('\f', start, end)
+
+    def trim(self, offset: int) -> None:
+        """Forget text no longer needed to locate offsets >= offset"""
+        self._build()
+        while len(self.segments) > 1 and self.segments[1][0] <= offset:
+            self.segments.pop(0)
+
+    def locate(self, offset: int) -> Dict[str, int]:
+        """Page and line (both 1-based) containing an offset"""
+        self._build()
+        index = bisect_right([segment[0] for segment in self.segments], offset) - 1
+        start, text, checkpoints = self.segments[max(index, 0)]
+        relative = offset - start
+        block = min(relative // BLOCK_SIZE, len(checkpoints) - 1)
+        if block < 0:
+            line = 0
+        else:
+            line = self._count(text, checkpoints[block], block * BLOCK_SIZE, relative)
+        page = bisect_right(self.page_starts, offset) - 1
+        return {
+            'page_number': page + 1,
+            'line_number': line - self.page_breaks[page] + 1,
+        }
+
+
+class Citation:
+    """
+    One evidence span, with its quote and surrounding context sliced
+    from the document only when asked for
+
+    offset is the absolute position of text[0], for text that is a
+    window of a larger document.
+    """
+
+    __slots__ = ('text', 'start', 'end', 'context_size', 'lines', 'offset')
+
+    def __init__(
+        self,
+        text: str,
+        start: int,
+        end: int,
+        context_size: int,
+        lines: Optional[LineIndex] = None,
+        offset: int = 0
+    ):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.context_size = context_size
+        self.lines = lines
+        self.offset = offset
+
+    @property
+    def context(self) -> str:
+        """The quote and its context as one string, as stored in 'evidence'"""
+        window_start = max(0, self.start - self.context_size)
+        return self.text[window_start:self.end + self.context_size].strip()
+
+    @property
+    def quoted_text(self) -> str:
+        return self.text[self.start:self.end]
+
+    @property
+    def context_before(self) -> str:
+        return self.text[max(0, self.start - self.context_size):self.start]
+
+    @property
+    def context_after(self) -> str:
+        return self.text[self.end:self.end + self.context_size]
+
+    def to_dict(self) -> Dict[str, Any]:
+        citation = {
+            'offset': self.offset + self.start,
+            'end': self.offset + self.end,
+            'quoted_text': self.quoted_text,
+            'context_before': self.context_before,
+            'context_after': self.context_after,
+        }
+        if self.lines is not None:
+            citation.update(self.lines.locate(self.offset + self.start))
+        return citation
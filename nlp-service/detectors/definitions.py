@@ -0,0 +1,137 @@
+"""
+Declarative indicator definitions: patterns, indicator names and base
+confidences, grouped by detector and category
+
+The built-in definitions ship as indicators.json next to this module:
+
+    {
+      "version": 1,
+      "detectors": {
+        "misconduct": {
+          "categories": {
+            "brady_violation": {
+              "indicator": "Brady Violations",
+              "confidence": 0.9,
+              "patterns": ["brady.*violation", "withheld.*evidence"],
+              "scope": "sentence"
+            }
+          }
+        }
+      }
+    }
+
+"scope" is optional. Detectors and categories are reported in file order.
+"""
+import copy
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Any
+
+from .document import SCOPES
+
+BUILTIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indicators.json')
+
+# Inline flags for a whole pattern, which re only accepts at its start; the
+# engine joins a category's patterns, so they would no longer be there
+GLOBAL_FLAGS = re.compile(r'(?<!\\)\(\?[aiLmsux]+\)')
+
+# Group names the engine gives the patterns of a category
+ENGINE_GROUP = re.compile(r'\(\?P<p\d+>')
+
+
+def load_definitions(path: str = BUILTIN_PATH) -> Dict[str, Any]:
+    """Read and validate a definitions file"""
+    with open(path, encoding='utf-8') as handle:
+        definitions = json.load(handle)
+    validate_definitions(definitions)
+    return definitions
+
+
+@lru_cache(maxsize=1)
+def _builtin() -> Dict[str, Any]:
+    return load_definitions(BUILTIN_PATH)
+
+
+def builtin_definitions() -> Dict[str, Any]:
+    """A private copy of the definitions shipped with the service"""
+    return copy.deepcopy(_builtin())
+
+
+def validate_definitions(definitions: Dict[str, Any]) -> None:
+    """
+    Raise ValueError unless every category is complete and its patterns
+    compile, both on their own and joined the way the engine joins them
+    """
+    detectors = definitions.get('detectors') if isinstance(definitions, dict) else None
+    if not isinstance(detectors, dict):
+        raise ValueError('Indicator definitions need a "detectors" object')
+
+    names = set()
+    for detector_name, detector in detectors.items():
+        categories = detector.get('categories') if isinstance(detector, dict) else None
+        if not isinstance(categories, dict):
+            raise ValueError(f'Detector {detector_name} needs a "categories" object')
+        for category, spec in categories.items():
+            where = f'{detector_name}.{category}'
+            if not isinstance(spec, dict):
+                raise ValueError(f'{where}: expected an object')
+            indicator = spec.get('indicator')
+            if not isinstance(indicator, str) or not indicator:
+                raise ValueError(f'{where}: missing indicator name')
+            if indicator in names:
+                raise ValueError(f'{where}: indicator {indicator!r} is defined twice')
+            names.add(indicator)
+            confidence = spec.get('confidence')
+            if not isinstance(confidence, (int, float)) or not 0 <= confidence <= 1:
+                raise ValueError(f'{where}: confidence must be a number between 0 and 1')
+            patterns = spec.get('patterns')
+            if not isinstance(patterns, list) or not patterns:
+                raise ValueError(f'{where}: needs a non-empty list of patterns')
+            for pattern in patterns:
+                try:
+                    re.compile(pattern)
+                except (re.error, TypeError) as error:
+                    raise ValueError(f'{where}: invalid pattern {pattern!r}: {error}')
+                if GLOBAL_FLAGS.search(pattern):
+                    raise ValueError(
+                        f'{where}: pattern {pattern!r} sets global inline flags; '
+                        'scope them to a group, as in (?i:...)'
+                    )
+                if ENGINE_GROUP.search(pattern):
+                    raise ValueError(f'{where}: pattern {pattern!r} uses a reserved group name')
+            try:
+                re.compile('|'.join(
+                    f'(?P<p{index}>{pattern})' for index, pattern in enumerate(patterns)
+                ))
+            except re.error as error:
+                raise ValueError(f'{where}: patterns cannot be combined: {error}')
+            if spec.get('scope', 'document') not in SCOPES:
+                raise ValueError(f'{where}: scope must be one of {SCOPES}')
+
+
+def build_detectors(definitions: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    One detector per defined detector name
+
+    Names with a detector class of their own (for confidence adjustments
+    that need code) get that class; any other name gets a plain
+    BaseDetector driven entirely by its definition.
+    """
+    from .base import BaseDetector
+    from .confession_detector import ConfessionDetector
+    from .eyewitness_detector import EyewitnessDetector
+    from .forensic_detector import ForensicDetector
+    from .misconduct_detector import MisconductDetector
+
+    classes = {
+        detector_class.name: detector_class
+        for detector_class in (
+            ConfessionDetector, EyewitnessDetector, ForensicDetector, MisconductDetector
+        )
+    }
+    return {
+        name: classes.get(name, BaseDetector)(definition, name)
+        for name, definition in definitions['detectors'].items()
+    }
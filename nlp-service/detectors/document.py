@@ -0,0 +1,352 @@
+"""
+Preprocessed form of a document, built once and shared by every detector
+"""
+import mmap
+import os
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Any, Pattern, Optional, Union
+
+from .citations import LineIndex
+
+SCOPES = ('document', 'sentence', 'turn')
+
+# Typographic characters folded to ASCII; every replacement keeps the
+# length of the text so offsets stay valid in the original
+NORMALIZE = str.maketrans({
+    '\u2018': "'", '\u2019': "'", '\u201b': "'", '\u2032': "'",
+    '\u201c': '"', '\u201d': '"', '\u201f': '"', '\u2033': '"',
+    '\u2010': '-', '\u2011': '-', '\u2012': '-', '\u2013': '-', '\u2014': '-',
+    '\u00a0': ' ', '\u2007': ' ', '\u202f': ' ',
+})
+
+# Speaker labels opening a turn in a transcript: "Q.", "A:", "THE COURT:",
+# "MR. SMITH:", at the start of a line (after an optional printed line
+# number), or an inline "Q." / "A." right after the previous sentence in
+# OCR text run together. Every pattern starts with a literal character,
+# which lets the regex engine skip ahead quickly.
+LABEL = r"""(Q|A|THE [A-Z]+(?: [A-Z]+)?|(?:MR|MRS|MS|DR)\.? [A-Z][A-Za-z'-]+)(?:[:.](?=\s)|:)"""
+LINE_SPEAKER = re.compile(r'\n[ \t]*(?:\d{1,3}[ \t]+)?' + LABEL)
+FIRST_SPEAKER = re.compile(r'[ \t]*(?:\d{1,3}[ \t]+)?' + LABEL)
+INLINE_SPEAKER = re.compile(r'[.?!] {1,2}(Q|A)\.(?=\s)')
+
+# Sentence ends: terminal punctuation before whitespace, blank lines and
+# page breaks. Single line breaks are usually wrapping, not sentence ends,
+# and initials, speaker labels and titles such as "Mr." are not either.
+SENTENCE_END = re.compile(
+    r'[.!?](?<!\b[A-Z]\.)(?<!\b[MDJS][Rr]\.)(?<!\bM[Ss]\.)(?<!\bM[Rr][Ss]\.)'
+    r'(?<!\bSt\.)(?<!\bvs\.)(?<!\bNo\.)[.!?]*["\')\]]*(?=\s)'
+    r'|\n[ \t]*\n|\f'
+)
+
+TOKEN = re.compile(r"\w+(?:'\w+)*")
+
+# Estimated memory of the offset arrays (tokens, sentences, turns, anchors)
+# per character of text, and of the objects of an empty document
+OFFSET_BYTES = 3
+DOCUMENT_OVERHEAD = 2048
+
+
+class Document:
+    """
+    Text of one document with everything derived from it computed lazily
+    and at most once: normalized and lowercased text, sentence and speaker
+    turn boundaries, token offsets, prefilter anchor positions and the
+    page/line index.
+
+    All offsets refer to the original text, which has the same length as
+    the normalized text.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self._normalized: Optional[str] = None
+        self._lowered: Optional[str] = None
+        self._lines: Optional[LineIndex] = None
+        self._sentence_starts: Optional[array] = None
+        self._turns: Optional[Tuple[array, List[Optional[str]]]] = None
+        self._tokens: Optional[Tuple[array, array]] = None
+        self._anchors: Optional[Tuple[str, Dict[Tuple[str, str], array]]] = None
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Estimated memory the document holds once everything is derived:
+        the text, its lowercase copy (and normalized copy, unless ASCII)
+        and the offset arrays
+        """
+        copies = 2 if self.text.isascii() else 3
+        return (
+            sys.getsizeof(self.text) * copies
+            + len(self.text) * OFFSET_BYTES + DOCUMENT_OVERHEAD
+        )
+
+    @property
+    def normalized(self) -> str:
+        """Text with typographic quotes, dashes and spaces folded to ASCII"""
+        if self._normalized is None:
+            # Plain ASCII (most documents) has nothing to fold
+            text = self.text
+            self._normalized = text if text.isascii() else text.translate(NORMALIZE)
+        return self._normalized
+
+    @property
+    def lowered(self) -> str:
+        """Normalized text in lowercase"""
+        if self._lowered is None:
+            self._lowered = self.normalized.lower()
+        return self._lowered
+
+    @property
+    def aligned(self) -> bool:
+        """Whether offsets in the lowercased text match the original"""
+        return len(self.lowered) == len(self.text)
+
+    @property
+    def lines(self) -> LineIndex:
+        if self._lines is None:
+            self._lines = LineIndex(self.text)
+        return self._lines
+
+    @property
+    def turns(self) -> Tuple[array, List[Optional[str]]]:
+        """
+        Start offsets and speakers of the speaker turns
+
+        Text before the first speaker label is a turn with speaker None.
+        """
+        if self._turns is None:
+            first_speaker, text = scannable(FIRST_SPEAKER, self.normalized)
+            line_speaker, _ = scannable(LINE_SPEAKER, self.normalized)
+            inline_speaker, _ = scannable(INLINE_SPEAKER, self.normalized)
+            first = first_speaker.match(text)
+            found = [(match.start() + 1, match.group(1)) for match in line_speaker.finditer(text)]
+            found += [(match.start(1), match.group(1)) for match in inline_speaker.finditer(text)]
+            found.sort()
+            starts = array('q', [0])
+            starts.extend(start for start, _ in found)
+            speakers = [_text(first.group(1)) if first else None]
+            speakers.extend(_text(speaker) for _, speaker in found)
+            self._turns = (starts, speakers)
+        return self._turns
+
+    @property
+    def sentence_starts(self) -> array:
+        """Start offsets of the sentences; a new turn also starts a sentence"""
+        if self._sentence_starts is None:
+            regex, text = scannable(SENTENCE_END, self.normalized)
+            ends = [match.end() for match in regex.finditer(text)]
+            turn_starts, _ = self.turns
+            starts = sorted(set(ends).union(turn_starts).union((0,)))
+            self._sentence_starts = array('q', starts)
+        return self._sentence_starts
+
+    @property
+    def tokens(self) -> Tuple[array, array]:
+        """Start and end offsets of every word token"""
+        if self._tokens is None:
+            regex, text = scannable(TOKEN, self.lowered if self.aligned else self.normalized)
+            spans = [match.span() for match in regex.finditer(text)]
+            self._tokens = (
+                array('q', [start for start, _ in spans]),
+                array('q', [end for _, end in spans]),
+            )
+        return self._tokens
+
+    def anchors(self, prefilter: Any) -> Dict[Tuple[str, str], array]:
+        """Positions of a LiteralPrefilter's anchors, located once per prefilter"""
+        if self._anchors is None or self._anchors[0] != prefilter.key:
+            self._anchors = (prefilter.key, prefilter.locate(self.lowered))
+        return self._anchors[1]
+
+    def sentence(self, offset: int) -> Tuple[int, int]:
+        """Start and end of the sentence containing offset"""
+        return _unit(self.sentence_starts, offset, len(self.text))
+
+    def turn(self, offset: int) -> Tuple[int, int, Optional[str]]:
+        """Start, end and speaker of the turn containing offset"""
+        starts, speakers = self.turns
+        start, end = _unit(starts, offset, len(self.text))
+        return start, end, speakers[bisect_right(starts, offset) - 1]
+
+    def unit_end(self, scope: str, offset: int) -> int:
+        """End of the sentence or turn containing offset ('document': the end)"""
+        if scope == 'sentence':
+            return self.sentence(offset)[1]
+        if scope == 'turn':
+            return self.turn(offset)[1]
+        return len(self.text)
+
+
+class MappedText:
+    """
+    Read-only view of ASCII text held in a bytes buffer such as an mmap
+
+    Slices are decoded to str on demand, so code written for str (evidence
+    contexts, line counting) only ever copies the parts it reads.
+    """
+
+    __slots__ = ('buffer',)
+
+    def __init__(self, buffer: Any):
+        self.buffer = buffer
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def __getitem__(self, index: Union[int, slice]) -> str:
+        if isinstance(index, slice):
+            return self.buffer[index].decode('ascii')
+        return chr(self.buffer[index])
+
+    def find(self, sub: str, start: int = 0, end: Optional[int] = None) -> int:
+        end = len(self.buffer) if end is None else end
+        return self.buffer.find(sub.encode(), start, end)
+
+    def count(self, sub: str, start: int = 0, end: Optional[int] = None) -> int:
+        # Only called on bounded ranges (LineIndex blocks)
+        return self.buffer[start:end].count(sub.encode())
+
+
+class MappedDocument(Document):
+    """
+    An ASCII document scanned in place from memory-mapped files
+
+    The text and its lowercase copy are mmaps of two files of a
+    DocumentStore, so no whole-document string is built: regexes run as
+    bytes patterns directly over the mapped pages (see scannable()) and
+    evidence decodes only the slices it quotes. Pickles as its file paths,
+    so pool workers map the same pages rather than receive a copy.
+    """
+
+    def __init__(self, path: str, lowered_path: str, digest: str):
+        super().__init__(MappedText(_map(path)))
+        self.path = path
+        self.lowered_path = lowered_path
+        self.digest = digest
+        # ASCII text has nothing to normalize
+        self._normalized = self.text
+        self._lowered = MappedText(_map(lowered_path))
+
+    def __reduce__(self):
+        return MappedDocument, (self.path, self.lowered_path, self.digest)
+
+    @property
+    def nbytes(self) -> int:
+        # The text and its lowercase copy are file pages, not process memory
+        return len(self.text) * OFFSET_BYTES + DOCUMENT_OVERHEAD
+
+
+def _map(path: str) -> mmap.mmap:
+    with open(path, 'rb') as handle:
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _text(value: Union[str, bytes]) -> str:
+    return value.decode('ascii') if isinstance(value, bytes) else value
+
+
+# Bytes versions of the regexes scanned over MappedText, by regex
+_binary_patterns: Dict[Pattern, Optional[Pattern]] = {}
+MAX_BINARY_PATTERNS = 1024
+
+
+def binary_pattern(regex: Pattern) -> Optional[Pattern]:
+    """regex compiled as a bytes pattern, or None if it is not ASCII"""
+    try:
+        return _binary_patterns[regex]
+    except KeyError:
+        pass
+    try:
+        binary = re.compile(regex.pattern.encode('ascii'), regex.flags & ~re.UNICODE)
+    except UnicodeEncodeError:
+        binary = None
+    remember_binary({regex: binary})
+    return binary
+
+
+def remember_binary(patterns: Dict[Pattern, Optional[Pattern]]) -> None:
+    """Add bytes versions compiled elsewhere, e.g. loaded from a pattern artifact"""
+    if len(_binary_patterns) + len(patterns) > MAX_BINARY_PATTERNS:
+        _binary_patterns.clear()
+    _binary_patterns.update(patterns)
+
+
+def scannable(regex: Pattern, text: Any) -> Tuple[Pattern, Any]:
+    """
+    The regex and target to scan text with: for MappedText, the bytes
+    version of the regex over the mapped buffer
+
+    On ASCII text the two find the same matches. A pattern that is not
+    ASCII itself runs on a decoded copy of the text instead.
+    """
+    if not isinstance(text, MappedText):
+        return regex, text
+    binary = binary_pattern(regex)
+    if binary is None:
+        return regex, text[:]
+    return binary, text.buffer
+
+
+def _unit(starts: array, offset: int, length: int) -> Tuple[int, int]:
+    index = bisect_right(starts, offset) - 1
+    end = starts[index + 1] if index + 1 < len(starts) else length
+    return starts[index], end
+
+
+class DocumentCache:
+    """
+    Recently preprocessed documents, keyed by their text
+
+    Lets the detectors, the documents of a case and repeated requests for
+    the same text share one Document. Bounded by the documents' estimated
+    memory (Document.nbytes), derived structures included.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.documents: 'OrderedDict[str, Document]' = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, text: str) -> Document:
+        with self.lock:
+            document = self.documents.get(text)
+            if document is not None:
+                self.documents.move_to_end(text)
+                return document
+
+        document = Document(text)
+        if document.nbytes > self.max_bytes:
+            return document
+        with self.lock:
+            if text not in self.documents:
+                self.documents[text] = document
+                self.nbytes += document.nbytes
+                while self.nbytes > self.max_bytes:
+                    _, evicted = self.documents.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+        return document
+
+    def clear(self) -> None:
+        with self.lock:
+            self.documents.clear()
+            self.nbytes = 0
+
+
+# Shared by every analyzer in the process
+documents = DocumentCache(max_bytes=int(os.getenv('DOCUMENT_CACHE_MB', 32)) << 20)
+
+
+def preprocess(text: Union[str, Document]) -> Document:
+    """The shared Document for a text (a Document is returned as is)"""
+    if isinstance(text, Document):
+        return text
+    return documents.get(text)
@@ -0,0 +1,589 @@
+"""
+Shared pattern engine that compiles every detector pattern once
+"""
+import hashlib
+import json
+import re
+import time
+from functools import partial
+from typing import List, Dict, Any, Tuple, Pattern, Match, Optional, Iterator, Iterable, Union
+
+import metrics
+from .alignment import Alignment
+from .citations import Citation, LineIndex
+from .document import Document, SCOPES, binary_pattern, preprocess, scannable
+from .prefilter import LiteralPrefilter, Search, bounded_search, match_window
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+Span = Tuple[int, int]
+
+PATTERN_MODES = ('legacy', 'proximity')
+
+# Average token width (word plus separator) used to size proximity gaps
+CHARS_PER_TOKEN = 8
+
+# Bumped whenever the shape of analysis results or the preprocessing of
+# documents changes, so results cached or stored earlier are recomputed
+RESULT_FORMAT = 3
+
+# Escapes such as \S or \W change meaning when lowercased
+UPPERCASE_ESCAPE = re.compile(r'\\[A-Z]')
+
+
+def proximity_gap(max_tokens: int) -> str:
+    """
+    Regex for a gap of roughly max_tokens tokens within one sentence
+
+    The gap is a single width-bounded character class that cannot cross
+    sentence punctuation or a line break, so each start position costs a
+    bounded amount of work and the scan stays linear in the input,
+    unlike `.*` which backtracks across the rest of the line.
+    """
+    return r'[^.!?\n]{0,%d}' % (max_tokens * CHARS_PER_TOKEN)
+
+
+def rewrite_proximity(pattern: str, max_tokens: int) -> str:
+    """Replace every unbounded `.*` gap in a pattern with a proximity gap"""
+    gap = proximity_gap(max_tokens)
+    rewritten = []
+    in_class = False
+    i = 0
+
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            rewritten.append(pattern[i:i + 2])
+            i += 2
+            continue
+        if in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            # A leading ']' (after an optional '^') is a literal
+            if pattern.startswith('^', i + 1):
+                rewritten.append('[^')
+                i += 2
+            else:
+                rewritten.append('[')
+                i += 1
+            if pattern.startswith(']', i):
+                rewritten.append(']')
+                i += 1
+            continue
+        elif pattern.startswith('.*', i):
+            i += 3 if pattern.startswith('?', i + 2) else 2
+            rewritten.append(gap)
+            continue
+        rewritten.append(char)
+        i += 1
+
+    return ''.join(rewritten)
+
+
+def fingerprint_patterns(detectors: Dict[str, Any]) -> str:
+    """Hash of every detector's patterns and indicator metadata"""
+    definition = {
+        name: {
+            'patterns': detector.patterns,
+            'indicators': detector.indicators,
+            'scopes': getattr(detector, 'scopes', {}),
+        }
+        for name, detector in detectors.items()
+    }
+    encoded = json.dumps(definition, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def fingerprint_category(
+    patterns: List[str],
+    indicator: Tuple[str, float],
+    options: Tuple
+) -> str:
+    """Hash of one category's patterns, indicator and engine options"""
+    encoded = json.dumps([patterns, list(indicator), list(options)]).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def engine_version(
+    fingerprint: str,
+    mode: str = 'proximity',
+    proximity_tokens: int = 10,
+    max_evidence: int = 3,
+    context_size: int = 100,
+    scope: str = 'document',
+    candidates: Optional[int] = None,
+    postfilter: str = '',
+    **_
+) -> str:
+    """Version of an engine compiled with these options, for caching"""
+    version = (
+        f'{fingerprint}:{mode}:{proximity_tokens}:{max_evidence}:{context_size}'
+        f':{scope}:{RESULT_FORMAT}'
+    )
+    if postfilter:
+        version += f':{candidates or max_evidence}:{postfilter}'
+    return version
+
+
+class PatternBudgetExceeded(Exception):
+    """Raised when scanning one document exceeds the regex time budget"""
+
+    def __init__(
+        self,
+        detector: str,
+        category: str,
+        patterns: List[str],
+        elapsed: float,
+        budget: float
+    ):
+        self.detector = detector
+        self.category = category
+        self.patterns = patterns
+        self.elapsed = elapsed
+        self.budget = budget
+        super().__init__(
+            f'Regex time budget of {budget * 1000:.0f}ms exceeded after '
+            f'{elapsed * 1000:.0f}ms in {detector}.{category}'
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'detector': self.detector,
+            'category': self.category,
+            'patterns': self.patterns,
+            'elapsed_ms': round(self.elapsed * 1000, 1),
+            'budget_ms': round(self.budget * 1000, 1),
+        }
+
+
+class PatternEngine:
+    """
+    Compiles the patterns of all detectors up front and scans documents
+    with one combined alternation per indicator category.
+
+    Every pattern of a category is wrapped in a named group (p0, p1, ...)
+    so a match maps back to the pattern that produced it, and the same
+    pass yields both the detection and its evidence spans. Documents are
+    lowercased once and scanned case-sensitively with case-folded
+    patterns, which is considerably faster than re.IGNORECASE.
+
+    In 'proximity' mode every `.*` gap is rewritten to match at most
+    `proximity_tokens` tokens within the same sentence, which keeps
+    scanning linear on long single-line OCR text. 'legacy' mode keeps
+    the patterns exactly as written. An optional per-document
+    `time_budget` (seconds) aborts a scan with PatternBudgetExceeded.
+
+    `scope` keeps every match within one 'sentence' or speaker 'turn' of
+    the document ('document' allows any match); detectors can override
+    it per category with a `scopes` mapping. Scans take a preprocessed
+    Document (plain text is preprocessed on the way in).
+
+    When a filter runs over the scan's matches before evidence is built,
+    `candidates` spans are collected per category instead of max_evidence
+    and `postfilter` names the filter, so cached and stored results
+    record that they were filtered.
+
+    With `prefilter` (the default) the literals each category requires
+    are located in one pass per document first, and categories are only
+    searched around them; see LiteralPrefilter. Matches are the same
+    either way.
+
+    A scan given an Alignment with an earlier document only searches the
+    text the two do not share, taking the earlier matches for the rest.
+    """
+
+    def __init__(
+        self,
+        detectors: Dict[str, Any],
+        max_evidence: int = 3,
+        context_size: int = 100,
+        mode: str = 'proximity',
+        proximity_tokens: int = 10,
+        time_budget: Optional[float] = None,
+        scope: str = 'document',
+        candidates: Optional[int] = None,
+        postfilter: str = '',
+        prefilter: bool = True
+    ):
+        if mode not in PATTERN_MODES:
+            raise ValueError(f'Unknown pattern mode: {mode}')
+        if scope not in SCOPES:
+            raise ValueError(f'Unknown pattern scope: {scope}')
+
+        self.max_evidence = max_evidence
+        self.context_size = context_size
+        self.mode = mode
+        self.proximity_tokens = proximity_tokens
+        self.time_budget = time_budget
+        self.scope = scope
+        self.candidates = candidates or max_evidence
+        self.postfilter = postfilter
+        # The detectors compiled here; analysis uses these rather than the
+        # analyzer's, which may be swapped for new definitions meanwhile
+        self.detectors = dict(detectors)
+        self.patterns: Dict[str, Dict[str, List[str]]] = {}
+        self.fingerprint = fingerprint_patterns(detectors)
+        # Identifies everything that can change results, for caching
+        self.version = engine_version(
+            self.fingerprint, mode, proximity_tokens, max_evidence, context_size, scope,
+            self.candidates, postfilter
+        )
+        self.compiled: Dict[str, Dict[str, Pattern]] = {}
+        self._ignorecase: Dict[str, Dict[str, Pattern]] = {}
+        self._single: Optional[Dict[str, Dict[str, List[Pattern]]]] = None
+        self._windows: Dict[Tuple[str, str], Optional[int]] = {}
+        # Scope of each category: 'document', 'sentence' or 'turn'
+        self.scopes: Dict[str, Dict[str, str]] = {}
+        # Per-category fingerprints, recorded on results for incremental runs
+        self.category_fingerprints: Dict[str, Dict[str, str]] = {}
+
+        options = (mode, proximity_tokens, max_evidence, context_size, RESULT_FORMAT)
+        if postfilter:
+            options += (self.candidates, postfilter)
+        for detector_name, detector in detectors.items():
+            overrides = getattr(detector, 'scopes', {})
+            self.scopes[detector_name] = {
+                category: overrides.get(category, scope)
+                for category in detector.patterns
+            }
+            self.category_fingerprints[detector_name] = {
+                category: fingerprint_category(
+                    patterns,
+                    detector.indicators.get(category, ('', 0.0)),
+                    options + (self.scopes[detector_name][category],)
+                )
+                for category, patterns in detector.patterns.items()
+            }
+            self.patterns[detector_name] = {
+                category: list(patterns)
+                for category, patterns in detector.patterns.items()
+            }
+            self.compiled[detector_name] = {
+                category: self._compile(patterns, fold=True)
+                for category, patterns in detector.patterns.items()
+            }
+        self.prefilter = LiteralPrefilter(self.compiled) if prefilter else None
+
+    def _compile(self, patterns: List[str], fold: bool) -> Pattern:
+        """Combine a category's patterns into one alternation of named groups"""
+        flags = re.IGNORECASE
+        if fold and not any(UPPERCASE_ESCAPE.search(p) for p in patterns):
+            patterns = [pattern.lower() for pattern in patterns]
+            flags = 0
+
+        patterns = [self.prepare_pattern(pattern) for pattern in patterns]
+        alternation = '|'.join(
+            f'(?P<p{index}>{pattern})' for index, pattern in enumerate(patterns)
+        )
+        return re.compile(alternation, flags)
+
+    def prepare_pattern(self, pattern: str) -> str:
+        """Apply the engine's pattern mode to one raw pattern"""
+        if self.mode == 'proximity':
+            return rewrite_proximity(pattern, self.proximity_tokens)
+        return pattern
+
+    def warm(self) -> None:
+        """
+        Build what scanning otherwise builds on first use: the IGNORECASE
+        fallbacks, the per-pattern regexes that metrics samples, match
+        windows and the bytes regexes for memory-mapped documents
+
+        Worker processes forked afterwards share all of it instead of
+        each compiling its own.
+        """
+        for detector_name, categories in self.compiled.items():
+            self._fallback(detector_name)
+            for category in categories:
+                self.window(detector_name, category)
+        self._single_patterns()
+        for regex in self.regexes():
+            binary_pattern(regex)
+
+    def regexes(self) -> Iterator[Pattern]:
+        """Every regex compiled so far"""
+        for compiled in (self.compiled, self._ignorecase):
+            for categories in compiled.values():
+                yield from categories.values()
+        for categories in (self._single or {}).values():
+            for regexes in categories.values():
+                yield from regexes
+
+    def _fallback(self, detector_name: str) -> Dict[str, Pattern]:
+        """IGNORECASE patterns for text whose lowercase form changes length"""
+        if detector_name not in self._ignorecase:
+            self._ignorecase[detector_name] = {
+                category: self._compile(patterns, fold=False)
+                for category, patterns in self.patterns[detector_name].items()
+            }
+        return self._ignorecase[detector_name]
+
+    def scan(
+        self,
+        document: Union[str, Document],
+        alignment: Optional[Alignment] = None
+    ) -> Dict[str, Dict[str, List[Span]]]:
+        """
+        Scan a document for every category of every detector
+
+        Returns detector name -> matched category -> evidence spans, in
+        document order. Categories without a match are omitted.
+        """
+        document = preprocess(document)
+        with metrics.stage('lowercase'):
+            document.lowered  # computed once here so the stage is timed
+        with metrics.stage('scan'):
+            started = time.perf_counter()
+            hits = {
+                detector_name: self.scan_detector(
+                    document, detector_name, started, alignment=alignment
+                )
+                for detector_name in self.compiled
+            }
+        if metrics.sample_patterns():
+            self.time_patterns(document)
+        return hits
+
+    def scan_detector(
+        self,
+        document: Union[str, Document],
+        detector_name: str,
+        started: Optional[float] = None,
+        categories: Optional[Iterable[str]] = None,
+        alignment: Optional[Alignment] = None
+    ) -> Dict[str, List[Span]]:
+        """
+        Scan a document for the categories of one detector (or only the
+        given categories)
+
+        Scanning a category stops as soon as it has enough evidence.
+        """
+        document = preprocess(document)
+        if started is None:
+            started = time.perf_counter()
+
+        if categories is None:
+            categories = self.compiled[detector_name]
+        instrumented = metrics.enabled()
+
+        hits = {}
+        for category in categories:
+            if instrumented:
+                spans = self._scan_instrumented(document, detector_name, category, alignment)
+            else:
+                spans = []
+                for span in self.iter_spans(document, detector_name, category, 0, alignment):
+                    spans.append(span)
+                    if len(spans) >= self.candidates:
+                        break
+            if spans:
+                hits[category] = spans
+
+            if self.time_budget is not None:
+                elapsed = time.perf_counter() - started
+                if elapsed > self.time_budget:
+                    raise PatternBudgetExceeded(
+                        detector_name,
+                        category,
+                        self.patterns[detector_name][category],
+                        elapsed,
+                        self.time_budget
+                    )
+        return hits
+
+    def _scan_instrumented(
+        self,
+        document: Document,
+        detector_name: str,
+        category: str,
+        alignment: Optional[Alignment] = None
+    ) -> List[Span]:
+        """scan_detector's loop for one category, recording per-pattern counters"""
+        started = time.perf_counter()
+        spans = []
+        matches: Dict[int, int] = {}
+        end = 0
+        for match in self._iter_matches(document, detector_name, category, 0, alignment):
+            spans.append(match.span())
+            end = match.end()
+            index = int(match.lastgroup[1:])
+            matches[index] = matches.get(index, 0) + 1
+            if len(spans) >= self.candidates:
+                break
+        elapsed = time.perf_counter() - started
+
+        # An early stop only scanned up to the last match
+        scanned = end if len(spans) >= self.candidates else len(document)
+        metrics.registry.add_category(
+            detector_name, category, elapsed, matches,
+            len(self.patterns[detector_name][category]), scanned
+        )
+        return spans
+
+    def time_patterns(self, document: Document) -> None:
+        """Time every pattern on its own over a document, for profiling"""
+        text, lowered = document.normalized, document.lowered
+        single = self._single_patterns()
+        for detector_name, categories in single.items():
+            for category, regexes in categories.items():
+                for index, regex in enumerate(regexes):
+                    scanned, target = scannable(
+                        regex, lowered if regex.flags & re.IGNORECASE == 0 else text
+                    )
+                    started = time.perf_counter()
+                    found = 0
+                    for _ in scanned.finditer(target):
+                        found += 1
+                        if found >= self.max_evidence:
+                            break
+                    metrics.registry.add_pattern_time(
+                        detector_name, category, index, time.perf_counter() - started
+                    )
+        with metrics.registry.lock:
+            metrics.registry.pattern_samples += 1
+
+    def _single_patterns(self) -> Dict[str, Dict[str, List[Pattern]]]:
+        """Each pattern compiled on its own, built on first use"""
+        if self._single is None:
+            self._single = {
+                detector_name: {
+                    category: [self._compile([pattern], fold=True) for pattern in patterns]
+                    for category, patterns in categories.items()
+                }
+                for detector_name, categories in self.patterns.items()
+            }
+        return self._single
+
+    def _iter_matches(
+        self,
+        document: Document,
+        detector_name: str,
+        category: str,
+        pos: int = 0,
+        alignment: Optional[Alignment] = None
+    ) -> Iterator[Match]:
+        search = None
+        if document.aligned:
+            regex, target = scannable(self.compiled[detector_name][category], document.lowered)
+            if self.prefilter is not None:
+                search = self.prefilter.search(
+                    document.anchors(self.prefilter), detector_name, category, regex, target
+                )
+        else:
+            # Offsets in the lowered copy would not line up with the text
+            regex, target = scannable(self._fallback(detector_name)[category], document.normalized)
+
+        scope = self.scopes[detector_name][category]
+        window = self.window(detector_name, category)
+        if alignment is not None and document.aligned and scope == 'document' and window:
+            search = alignment.search(
+                detector_name, category, regex, target, window,
+                search or bounded_search(regex, target, window)
+            ) or search
+        if scope != 'document':
+            return self._iter_scoped(regex, target, document, scope, pos, search)
+        if search is None:
+            return regex.finditer(target, pos)
+        return self._iter_search(search, len(target), pos)
+
+    @staticmethod
+    def _iter_search(search: Search, length: int, pos: int) -> Iterator[Match]:
+        """finditer driven by a search function"""
+        while pos <= length:
+            match = search(pos)
+            if match is None:
+                return
+            yield match
+            pos = match.end() if match.end() > match.start() else match.end() + 1
+
+    @staticmethod
+    def _iter_scoped(
+        regex: Pattern,
+        target: str,
+        document: Document,
+        scope: str,
+        pos: int,
+        search: Optional[Search] = None
+    ) -> Iterator[Match]:
+        """
+        finditer restricted to matches inside one sentence or turn
+
+        A match running past the end of its unit is retried within the
+        unit, which finds the leftmost match that fits, if any. Matches
+        that fit cost nothing extra. search replaces regex.search for
+        finding the next candidate.
+        """
+        if search is None:
+            search = partial(regex.search, target)
+        while pos <= len(target):
+            match = search(pos)
+            if match is None:
+                return
+            unit_end = document.unit_end(scope, match.start())
+            if match.end() > unit_end:
+                match = regex.search(target, match.start(), unit_end)
+                if match is None:
+                    pos = unit_end
+                    continue
+            yield match
+            pos = match.end() if match.end() > match.start() else match.end() + 1
+
+    def iter_spans(
+        self,
+        document: Union[str, Document],
+        detector_name: str,
+        category: str,
+        pos: int = 0,
+        alignment: Optional[Alignment] = None
+    ) -> Iterator[Span]:
+        """Yield the spans matched by one category, starting at pos"""
+        document = preprocess(document)
+        for match in self._iter_matches(document, detector_name, category, pos, alignment):
+            yield match.span()
+
+    def window(self, detector_name: str, category: str) -> Optional[int]:
+        """
+        Longest match of a category; None when unbounded, when it can be
+        empty, or when it uses assertions, which read beyond the match
+        """
+        key = (detector_name, category)
+        if key not in self._windows:
+            regex = self.compiled[detector_name][category]
+            parsed = sre_parse.parse(regex.pattern, regex.flags)
+            self._windows[key] = match_window(parsed) if parsed.getwidth()[0] else None
+        return self._windows[key]
+
+    def max_match_width(self, limit: int) -> int:
+        """
+        Longest span any compiled pattern can match, capped at limit
+
+        Patterns with unbounded repetition (legacy `.*`, `\\s*`, ...)
+        count as limit.
+        """
+        widest = 0
+        for categories in self.compiled.values():
+            for regex in categories.values():
+                width = sre_parse.parse(regex.pattern, regex.flags).getwidth()[1]
+                widest = max(widest, min(width, limit))
+        return widest
+
+    def contexts(self, text: str, spans: List[Span]) -> List[str]:
+        """Slice the context window around each evidence span"""
+        return [citation.context for citation in self.citations(text, spans)]
+
+    def citations(
+        self,
+        text: str,
+        spans: List[Span],
+        lines: Optional[LineIndex] = None,
+        offset: int = 0
+    ) -> List[Citation]:
+        """Citations for evidence spans, located by page and line when given lines"""
+        return [
+            Citation(text, start, end, self.context_size, lines, offset)
+            for start, end in spans
+        ]
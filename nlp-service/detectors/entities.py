@@ -0,0 +1,176 @@
+"""
+People and agencies named in a document, with names normalized so the same
+actor can be recognized across cases
+"""
+import re
+from typing import List, Dict, NamedTuple, Optional, Tuple
+
+from .document import Document, scannable
+
+# Titles introducing a name, by the role they imply. Words also match in
+# lower case ("informant Jerry Lee"), abbreviations only as written.
+ROLE_TITLES = {
+    'detective': r'[Dd]etective|Det\.|[Ii]nvestigator|Inv\.',
+    'officer': (
+        r'[Oo]fficer|Ofc\.|[Dd]eputy|[Tt]rooper|[Pp]atrolman|[Ss]ergeant|Sgt\.|'
+        r'[Ll]ieutenant|Lt\.|[Cc]aptain|Capt\.|(?:[Ss]pecial )?[Aa]gent'
+    ),
+    'analyst': r'[Aa]nalyst|[Ee]xaminer|[Cc]riminalist|[Cc]hemist|[Ss]erologist',
+    'expert': r'Dr\.|Doctor|Professor',
+    'informant': r'[Ii]nformant',
+    'prosecutor': r'[Pp]rosecutor|(?:Assistant )?District Attorney|A\.?D\.?A\.',
+    'witness': r'[Ww]itness',
+}
+
+# How each role is written before a name in reports
+ROLE_LABELS = {
+    'detective': 'Detective',
+    'officer': 'Officer',
+    'analyst': 'Analyst',
+    'expert': 'Dr.',
+    'informant': 'Informant',
+    'prosecutor': 'Prosecutor',
+    'witness': 'Witness',
+}
+
+NAME_WORD = r"(?:Mc|Mac|O')?[A-Z][a-z]+(?:-[A-Z][a-z]+)?"
+PERSON = re.compile(
+    r'\b(?:' + '|'.join(f'(?P<{role}>{titles})' for role, titles in ROLE_TITLES.items())
+    + rf')[ \t]+(?P<name>{NAME_WORD}(?:[ \t]+(?:[A-Z]\.|{NAME_WORD})){{0,2}})'
+)
+
+AGENCY = re.compile(
+    r"\b(?P<agency>(?:[A-Z][a-z]+ ){1,4}(?:Police Department|Police Dept\.|"
+    r"Sheriff's (?:Office|Department)|State Police|Highway Patrol|"
+    r"Crime Lab(?:oratory)?|Forensic (?:Science )?Lab(?:oratory)?|"
+    r"Medical Examiner's Office|District Attorney's Office))"
+    r'|\b(?P<acronym>FBI|DEA|ATF|GBI|TBI|[A-Z]{2,3}PD)\b'
+)
+
+# Capitalized words after a title that are not part of a name
+NOT_NAMES = {
+    'the', 'and', 'of', 'on', 'in', 'at', 'for', 'to', 'he', 'she', 'was', 'is',
+    'division', 'bureau', 'unit', 'department', 'squad', 'office', 'report',
+    'testimony', 'testified', 'stated', 'said', 'no', 'number', 'badge',
+}
+SUFFIXES = {'jr', 'sr', 'ii', 'iii', 'iv'}
+
+ACRONYMS = {
+    'fbi': 'federal bureau of investigation',
+    'dea': 'drug enforcement administration',
+    'atf': 'bureau of alcohol tobacco firearms and explosives',
+    'gbi': 'georgia bureau of investigation',
+    'tbi': 'tennessee bureau of investigation',
+}
+AGENCY_WORDS = {'dept': 'department', 'lab': 'laboratory'}
+
+
+class Entity(NamedTuple):
+    """
+    A person or agency named in a document
+
+    key is the normalized name the index links cases by: 'person:john
+    smith' for a full name, '<role>:smith' for a bare surname (too common
+    to link across roles) and 'agency:<name>' for an agency.
+    """
+    key: str
+    kind: str                 # 'person' or 'agency'
+    role: Optional[str]
+    name: str                 # display form, e.g. 'John Smith'
+    mentions: int
+
+
+def name_words(name: str) -> List[str]:
+    """Lowercase words of a person's name without initials, suffixes or apostrophes"""
+    words = [
+        word.replace("'", '')
+        for word in re.findall(r"[a-z]+(?:['-][a-z]+)*", name.lower())
+    ]
+    return [word for word in words if len(word) > 1 and word not in SUFFIXES]
+
+
+def person_key(words: List[str], role: Optional[str]) -> str:
+    """Key of a person from name_words: first and last name, else role and surname"""
+    if len(words) > 1:
+        return f'person:{words[0]} {words[-1]}'
+    return f'{role or "person"}:{words[0]}'
+
+
+def agency_key(name: str) -> str:
+    words = re.findall(r"[a-z]+", name.lower().replace("'s", ''))
+    if words and words[0] == 'the':
+        words = words[1:]
+    words = [AGENCY_WORDS.get(word, word) for word in words]
+    return 'agency:' + ACRONYMS.get(' '.join(words), ' '.join(words))
+
+
+def extract_entities(document: Document) -> List[Entity]:
+    """
+    People named with a title ("Detective John Smith", "informant Lee",
+    "DR. JONES:" as a transcript speaker) and agencies, one Entity per key
+
+    A bare surname is linked to the full name given earlier or later in the
+    same document when exactly one person there has that surname.
+    """
+    found: List[Tuple[List[str], Optional[str]]] = []     # (name words, role)
+    regex, text = scannable(PERSON, document.normalized)
+    for match in regex.finditer(text):
+        role = next(group for group in ROLE_TITLES if match.group(group) is not None)
+        name = match.group('name')
+        if isinstance(name, bytes):
+            name = name.decode('ascii')
+        words = name_words(name)
+        # Stop at the first word that is not part of a name
+        for index, word in enumerate(words):
+            if word in NOT_NAMES:
+                words = words[:index]
+                break
+        if words:
+            found.append((words, role))
+    _, speakers = document.turns
+    for speaker in speakers:
+        if speaker and speaker.startswith('DR'):
+            words = name_words(speaker)[1:]
+            if words:
+                found.append((words, 'expert'))
+
+    # Surnames given with a first name somewhere in the document
+    full_names: Dict[str, Optional[List[str]]] = {}
+    for words, _ in found:
+        if len(words) > 1:
+            surname = words[-1]
+            if full_names.get(surname, words) != words:
+                full_names[surname] = None      # ambiguous
+            else:
+                full_names[surname] = words
+
+    entities: Dict[str, Entity] = {}
+    for words, role in found:
+        if len(words) == 1 and full_names.get(words[0]):
+            words = full_names[words[0]]
+        key = person_key(words, role)
+        entity = entities.get(key)
+        if entity is None:
+            shown = (words[0], words[-1]) if len(words) > 1 else words
+            name = ' '.join(word.title() for word in shown)
+            entities[key] = Entity(key, 'person', role, name, 1)
+        else:
+            entities[key] = entity._replace(
+                role=entity.role or role, mentions=entity.mentions + 1
+            )
+
+    regex, text = scannable(AGENCY, document.normalized)
+    for match in regex.finditer(text):
+        name = match.group('agency') or match.group('acronym')
+        if isinstance(name, bytes):
+            name = name.decode('ascii')
+        key = agency_key(name)
+        entity = entities.get(key)
+        if entity is None:
+            if name.startswith('The '):
+                name = name[4:]
+            entities[key] = Entity(key, 'agency', None, name, 1)
+        else:
+            entities[key] = entity._replace(mentions=entity.mentions + 1)
+
+    return list(entities.values())
@@ -0,0 +1,282 @@
+"""
+Literal prefilter: one pass over a document for the literal words the
+patterns require, so regexes only run where they can match
+
+Nearly every pattern requires some literal in each of its matches:
+`brady` in `brady.*violation`, one of `hesitat` or `uncertain` in
+`(hesitat|uncertain)`. These anchors are read off the parsed patterns
+and located in the lowercased document in a single pass, with an
+Aho-Corasick automaton when pyahocorasick is installed (str.find per
+literal otherwise). A category none of whose anchors occur is skipped
+without running its regex; otherwise the regex only searches windows
+of the category's maximum match width around the anchor hits. The
+matches found are exactly those of an unfiltered scan.
+
+Categories with a pattern that requires no literal of MIN_LITERAL
+characters, and case-insensitive ones, are scanned in full.
+"""
+import hashlib
+import re
+from array import array
+from bisect import bisect_left
+from typing import (
+    List, Dict, Tuple, Any, Pattern, Match, Optional, Callable, FrozenSet, Iterator
+)
+
+try:
+    import ahocorasick
+except ImportError:  # optional; falls back to str.find
+    ahocorasick = None
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+Key = Tuple[str, str]
+# search(pos, limit=None): the leftmost match starting at or after pos
+# (and before limit), as regex.search(target, pos) would find it
+Search = Callable[..., Optional[Match]]
+
+# Shorter literals occur nearly everywhere and would filter nothing
+MIN_LITERAL = 3
+
+# Characters of a memory-mapped document decoded at a time
+BLOCK_SIZE = 1 << 20
+
+REPEATS = {
+    sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+    getattr(sre_constants, 'POSSESSIVE_REPEAT', sre_constants.MAX_REPEAT),
+}
+
+# Operators that can look past the end of a search window, or whose
+# width the parser cannot bound
+UNWINDOWED = {
+    sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT,
+    sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS,
+}
+
+
+def required_literals(parsed: 'sre_parse.SubPattern') -> Optional[FrozenSet[str]]:
+    """
+    Literals at least one of which occurs in every match of a parsed
+    pattern, choosing the longest available; None when there are none
+    """
+    best = None
+    run: List[str] = []
+    for op, av in parsed.data:
+        if op == sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+        best = _better(best, _run(run))
+        run = []
+        if op == sre_constants.SUBPATTERN:
+            if not av[1] & sre_constants.SRE_FLAG_IGNORECASE:
+                best = _better(best, required_literals(av[3]))
+        elif op == sre_constants.BRANCH:
+            alternatives = [required_literals(branch) for branch in av[1]]
+            if all(alternatives):
+                best = _better(best, _shortest(frozenset().union(*alternatives)))
+        elif op in REPEATS and av[0] >= 1:
+            best = _better(best, required_literals(av[2]))
+        elif op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+            best = _better(best, required_literals(av))
+    return _better(best, _run(run))
+
+
+def _run(run: List[str]) -> Optional[FrozenSet[str]]:
+    return frozenset((''.join(run),)) if len(run) >= MIN_LITERAL else None
+
+
+def _shortest(literals: FrozenSet[str]) -> FrozenSet[str]:
+    """Drop literals containing another one, whose hits the other already finds"""
+    return frozenset(
+        literal for literal in literals
+        if not any(other != literal and other in literal for other in literals)
+    )
+
+
+def _better(
+    first: Optional[FrozenSet[str]],
+    second: Optional[FrozenSet[str]]
+) -> Optional[FrozenSet[str]]:
+    """The more selective of two anchor sets: longer shortest literal, then fewer literals"""
+    if first is None or second is None:
+        return first or second
+
+    def selectivity(literals: FrozenSet[str]) -> Tuple[int, int]:
+        return min(len(literal) for literal in literals), -len(literals)
+    return second if selectivity(second) > selectivity(first) else first
+
+
+def match_window(parsed: 'sre_parse.SubPattern') -> Optional[int]:
+    """Longest possible match, or None when unbounded or it uses assertions"""
+    if _uses(parsed, UNWINDOWED):
+        return None
+    width = parsed.getwidth()[1]
+    return width if width < sre_constants.MAXREPEAT - 1 else None
+
+
+def _uses(parsed: 'sre_parse.SubPattern', ops: set) -> bool:
+    for op, av in parsed.data:
+        if op in ops:
+            return True
+        if any(_uses(sub, ops) for sub in _subpatterns(av)):
+            return True
+    return False
+
+
+def _subpatterns(value):
+    if isinstance(value, sre_parse.SubPattern):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _subpatterns(item)
+
+
+class LiteralPrefilter:
+    """Anchor literals of every compiled category, located together in one pass"""
+
+    def __init__(self, compiled: Dict[str, Dict[str, Pattern]]):
+        self.anchors: Dict[Key, FrozenSet[str]] = {}
+        self.windows: Dict[Key, Optional[int]] = {}
+        for detector_name, categories in compiled.items():
+            for category, regex in categories.items():
+                if regex.flags & re.IGNORECASE:
+                    continue
+                parsed = sre_parse.parse(regex.pattern, regex.flags)
+                literals = required_literals(parsed)
+                if literals is not None:
+                    self.anchors[(detector_name, category)] = literals
+                    self.windows[(detector_name, category)] = match_window(parsed)
+
+        # Literal -> categories anchored by it
+        self.owners: Dict[str, List[Key]] = {}
+        for key, literals in self.anchors.items():
+            for literal in sorted(literals):
+                self.owners.setdefault(literal, []).append(key)
+        # Identifies the anchors, for positions cached on documents
+        encoded = repr(sorted((key, sorted(literals)) for key, literals in self.anchors.items()))
+        self.key = hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+        self._automaton = None
+        if ahocorasick is not None and self.owners:
+            self._automaton = ahocorasick.Automaton()
+            for literal, owners in self.owners.items():
+                self._automaton.add_word(literal, (len(literal), owners))
+            self._automaton.make_automaton()
+
+    def locate(self, text: Any) -> Dict[Key, array]:
+        """
+        Sorted start offsets of each category's anchors in lowercased text
+        (a str, or a MappedText decoded a block at a time)
+        """
+        found: Dict[Key, array] = {key: array('q') for key in self.anchors}
+        if self._automaton is not None:
+            for offset, block, limit in _blocks(text, max(map(len, self.owners))):
+                for end, (length, owners) in self._automaton.iter(block):
+                    start = end - length + 1
+                    if start < limit:
+                        for key in owners:
+                            found[key].append(offset + start)
+        else:
+            find = text.find
+            for literal, owners in self.owners.items():
+                starts = array('q')
+                start = find(literal)
+                while start >= 0:
+                    starts.append(start)
+                    start = find(literal, start + 1)
+                for key in owners:
+                    found[key].extend(starts)
+        return {key: array('q', sorted(starts)) for key, starts in found.items()}
+
+    def search(
+        self,
+        positions: Dict[Key, array],
+        detector_name: str,
+        category: str,
+        regex: Pattern,
+        target: str
+    ) -> Optional[Search]:
+        """
+        A function returning the leftmost match at or after a position, as
+        regex.search(target, pos) would, using the anchor positions; None
+        when the category has no anchors
+        """
+        key = (detector_name, category)
+        if key not in self.anchors:
+            return None
+        return anchored_search(regex, target, positions[key], self.windows[key])
+
+
+def _blocks(text: Any, longest: int) -> Iterator[Tuple[int, str, int]]:
+    """
+    (offset, block, limit) pieces of text as str: the whole of a str, or
+    BLOCK_SIZE characters at a time of a MappedText, each extended so that
+    literals starting before its limit end inside it
+    """
+    if isinstance(text, str):
+        yield 0, text, len(text)
+        return
+    for offset in range(0, len(text), BLOCK_SIZE):
+        yield offset, text[offset:offset + BLOCK_SIZE + longest - 1], BLOCK_SIZE
+
+
+def anchored_search(
+    regex: Pattern,
+    target: str,
+    positions: array,
+    window: Optional[int]
+) -> Search:
+    """
+    regex.search for a regex every match of which contains an anchor
+    starting at one of positions and spans at most window characters
+
+    A match containing the first anchor at or after pos starts at most
+    window characters before it and ends at most window characters after
+    its own start, so searching the span between is exact for matches
+    starting up to that anchor. Anchors closer together than window are
+    searched as one span.
+    """
+    count = len(positions)
+
+    def search(pos: int, limit: Optional[int] = None) -> Optional[Match]:
+        index = bisect_left(positions, pos)
+        if window is None:
+            match = regex.search(target, pos) if index < count else None
+            return _before(match, limit)
+        while index < count:
+            first = last = positions[index]
+            if limit is not None and first - window >= limit:
+                return None
+            index += 1
+            while index < count and positions[index] - last <= window:
+                last = positions[index]
+                index += 1
+            match = regex.search(target, max(pos, first - window), last + window)
+            if match is not None and match.start() <= last:
+                return _before(match, limit)
+        return None
+
+    return search
+
+
+def bounded_search(regex: Pattern, target: str, window: Optional[int]) -> Search:
+    """
+    regex.search as a Search; with a limit, a regex whose matches span at
+    most window characters searches no further than the limit plus window
+    """
+    def search(pos: int, limit: Optional[int] = None) -> Optional[Match]:
+        if limit is None:
+            return regex.search(target, pos)
+        if window is None:
+            return _before(regex.search(target, pos), limit)
+        return _before(regex.search(target, pos, limit + window - 1), limit)
+
+    return search
+
+
+def _before(match: Optional[Match], limit: Optional[int]) -> Optional[Match]:
+    return match if match is None or limit is None or match.start() < limit else None
@@ -0,0 +1,182 @@
+"""
+Compact analysis results, converted to the JSON shape only at the API boundary
+"""
+import sys
+from array import array
+from typing import List, Dict, Any, Tuple, Optional, Iterable
+
+from .citations import Citation
+from .document import Document
+
+Span = Tuple[int, int]
+
+# Tag of the compact encoding stored in the analysis cache
+COMPACT_FORMAT = 'compact-2'
+
+
+class IndicatorResult:
+    """
+    One indicator detected in one document
+
+    Evidence is kept as a flat array of match offsets into the shared
+    Document rather than as context strings and citation dicts, which are
+    only sliced out by to_dict(). The Document is not pickled: results
+    coming back from a worker process are reattached to the parent's copy
+    of the text with attach().
+    """
+
+    __slots__ = ('indicator_name', 'confidence', 'detector', 'spans', 'context_size', 'document')
+
+    def __init__(
+        self,
+        indicator_name: str,
+        confidence: float,
+        detector: str,
+        spans: Iterable[Span],
+        context_size: int,
+        document: Optional[Document] = None
+    ):
+        # Interned, so millions of results share one string per indicator
+        self.indicator_name = sys.intern(indicator_name)
+        self.confidence = confidence
+        self.detector = sys.intern(detector)
+        self.spans = array('q', [offset for span in spans for offset in span])
+        self.context_size = context_size
+        self.document = document
+
+    def __getstate__(self) -> Tuple:
+        return (self.indicator_name, self.confidence, self.detector, self.spans, self.context_size)
+
+    def __setstate__(self, state: Tuple) -> None:
+        name, self.confidence, detector, self.spans, self.context_size = state
+        self.indicator_name = sys.intern(name)
+        self.detector = sys.intern(detector)
+        self.document = None
+
+    def iter_spans(self) -> Iterable[Span]:
+        spans = self.spans
+        return zip(spans[0::2], spans[1::2])
+
+    def citations(self) -> List[Citation]:
+        document = self.document
+        return [
+            Citation(document.text, start, end, self.context_size, document.lines)
+            for start, end in self.iter_spans()
+        ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        citations = self.citations()
+        return {
+            'indicator_name': self.indicator_name,
+            'confidence': self.confidence,
+            'evidence': [citation.context for citation in citations],
+            'citations': [citation.to_dict() for citation in citations],
+            'detector': self.detector
+        }
+
+    @classmethod
+    def from_dict(
+        cls,
+        indicator: Dict[str, Any],
+        context_size: int,
+        document: Optional[Document] = None
+    ) -> 'IndicatorResult':
+        """Rebuild from a to_dict() result, e.g. one stored by an earlier run"""
+        return cls(
+            indicator['indicator_name'],
+            indicator['confidence'],
+            indicator.get('detector', 'unknown'),
+            [(citation['offset'], citation['end']) for citation in indicator.get('citations', [])],
+            context_size,
+            document
+        )
+
+
+class DocumentResult:
+    """Indicators detected in one document, as returned by analyze_document"""
+
+    __slots__ = ('indicators', 'document_type', 'fingerprints')
+
+    def __init__(
+        self,
+        indicators: List[IndicatorResult],
+        document_type: str,
+        fingerprints: Dict[str, Dict[str, str]]
+    ):
+        self.indicators = indicators
+        self.document_type = document_type
+        self.fingerprints = fingerprints
+
+    def __getstate__(self) -> Tuple:
+        return (self.indicators, self.document_type, self.fingerprints)
+
+    def __setstate__(self, state: Tuple) -> None:
+        self.indicators, self.document_type, self.fingerprints = state
+
+    def attach(self, document: Document) -> 'DocumentResult':
+        """Point every indicator at the document's text; returns self"""
+        for indicator in self.indicators:
+            indicator.document = document
+        return self
+
+    def to_dict(self, fingerprints: bool = False) -> Dict[str, Any]:
+        """
+        The analyze_document response; with fingerprints, also the pattern
+        fingerprints reanalyze_document needs, for results that are stored
+        """
+        result = {
+            'total_indicators': len(self.indicators),
+            'indicators': [indicator.to_dict() for indicator in self.indicators],
+            'document_type': self.document_type,
+            'analysis_complete': True
+        }
+        if fingerprints:
+            result['fingerprints'] = self.fingerprints
+        return result
+
+    def to_compact(self) -> Dict[str, Any]:
+        """
+        JSON-serializable form without any text, for the analysis cache
+
+        Fingerprints are left out: the cache key already names the engine
+        that produced the result, which supplies them again.
+        """
+        return {
+            'document_type': self.document_type,
+            'context_size': self.indicators[0].context_size if self.indicators else 0,
+            'indicators': [
+                [indicator.indicator_name, indicator.confidence, indicator.detector,
+                 indicator.spans.tolist()]
+                for indicator in self.indicators
+            ]
+        }
+
+    @classmethod
+    def from_compact(
+        cls,
+        payload: Dict[str, Any],
+        document: Document,
+        fingerprints: Dict[str, Dict[str, str]]
+    ) -> 'DocumentResult':
+        context_size = payload['context_size']
+        indicators = []
+        for name, confidence, detector, offsets in payload['indicators']:
+            indicator = IndicatorResult(name, confidence, detector, (), context_size, document)
+            indicator.spans = array('q', offsets)
+            indicators.append(indicator)
+        return cls(indicators, payload['document_type'], fingerprints)
+
+    @classmethod
+    def from_dict(
+        cls,
+        result: Dict[str, Any],
+        context_size: int,
+        document: Optional[Document] = None
+    ) -> 'DocumentResult':
+        """Rebuild from a to_dict() result, e.g. one stored by an earlier run"""
+        return cls(
+            [IndicatorResult.from_dict(indicator, context_size, document)
+             for indicator in result.get('indicators', [])],
+            result.get('document_type', 'unknown'),
+            result.get('fingerprints') or {}
+        )
@@ -0,0 +1,197 @@
+"""
+Index of recently scanned documents, for skipping work on duplicates
+
+Case files repeat themselves: the same exhibit is attached to several
+filings, a motion is re-filed with a new caption, an amended transcript
+corrects a few pages. The index keeps the raw matches of recently
+scanned documents. An exact duplicate reuses them outright; a near
+duplicate, found by MinHash over its lines with LSH banding, is aligned
+with the most similar earlier document so that only the lines that
+differ are searched again (see detectors.Alignment).
+"""
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple, Optional
+
+import numpy as np
+
+from detectors import Document
+
+NUM_PERMUTATIONS = 64
+# 16 bands of 4 rows: documents sharing about half their lines or more
+# usually land in a common bucket
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+# Below 2**31, so a * (hash & 0xffffffff) + b cannot overflow 64 bits
+_random = np.random.RandomState(20240601)
+PERMUTATION_A = _random.randint(1, 1 << 31, NUM_PERMUTATIONS).astype(np.uint64)
+PERMUTATION_B = _random.randint(0, 1 << 31, NUM_PERMUTATIONS).astype(np.uint64)
+
+# Lines hashed at a time, bounding the permutation matrix's memory
+SIGNATURE_BLOCK = 8192
+
+# Documents too short to be worth aligning are only matched exactly
+MIN_LINES = 8
+
+
+def line_hashes(text: str) -> np.ndarray:
+    """Hashes of a text's distinct non-blank lines, ignoring surrounding whitespace"""
+    lines = {line.strip() for line in text.split('\n')}
+    lines.discard('')
+    hashes = np.fromiter((hash(line) for line in lines), dtype=np.int64, count=len(lines))
+    return hashes.view(np.uint64) & np.uint64(0xffffffff)
+
+
+def minhash(hashes: np.ndarray) -> np.ndarray:
+    """MinHash signature of a set of 32-bit hashes"""
+    signature = np.full(NUM_PERMUTATIONS, MERSENNE_PRIME, dtype=np.uint64)
+    for start in range(0, len(hashes), SIGNATURE_BLOCK):
+        block = hashes[start:start + SIGNATURE_BLOCK]
+        permuted = (np.outer(PERMUTATION_A, block) + PERMUTATION_B[:, None]) % MERSENNE_PRIME
+        np.minimum(signature, permuted.min(axis=1), out=signature)
+    return signature
+
+
+class _Entry:
+    __slots__ = ('document', 'hits', 'version', 'signature', 'buckets')
+
+    def __init__(self, document, hits, version, signature, buckets):
+        self.document = document
+        self.hits = hits
+        self.version = version
+        self.signature = signature
+        self.buckets = buckets
+
+
+class NearDuplicateIndex:
+    """
+    Raw scan results of recently scanned documents, found again by exact
+    content or by estimated line similarity of at least `threshold`
+
+    An LRU bounded by the characters of the documents held. Only str
+    documents whose lowercase copy lines up with the text are indexed;
+    entries scanned by another engine version are never returned.
+    """
+
+    def __init__(self, threshold: float = 0.8, max_chars: int = 64 * 1024 * 1024):
+        self.threshold = threshold
+        self.max_chars = max_chars
+
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self._chars = 0
+        # (band, band hash) -> texts of the entries in that bucket
+        self._buckets: Dict[Tuple[int, int], List[str]] = {}
+        self._lock = threading.Lock()
+
+        self.counters = {
+            'exact_hits': 0,
+            'near_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Workers started without fork get an empty index of their own
+        return {'threshold': self.threshold, 'max_chars': self.max_chars}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)
+
+    def accepts(self, document: Document) -> bool:
+        return isinstance(document.text, str) and document.aligned and len(document.text) > 0
+
+    def signature(self, document: Document) -> Optional[np.ndarray]:
+        """MinHash signature of a document, or None when it is too short to align"""
+        hashes = line_hashes(document.text)
+        return minhash(hashes) if len(hashes) >= MIN_LINES else None
+
+    def find(
+        self,
+        document: Document,
+        signature: Optional[np.ndarray],
+        version: str
+    ) -> Optional[_Entry]:
+        """
+        The entry of an identical document, else of the most similar near
+        duplicate; None when neither was scanned under this version
+        """
+        with self._lock:
+            entry = self._entries.get(document.text)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(document.text)
+                self.counters['exact_hits'] += 1
+                return entry
+
+            best, best_similarity = None, self.threshold
+            if signature is not None:
+                for text in self._candidates(signature):
+                    candidate = self._entries[text]
+                    if candidate.version != version:
+                        continue
+                    similarity = float(np.mean(candidate.signature == signature))
+                    if similarity >= best_similarity:
+                        best, best_similarity = candidate, similarity
+            if best is None:
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(best.document.text)
+            self.counters['near_hits'] += 1
+            return best
+
+    def add(
+        self,
+        document: Document,
+        signature: Optional[np.ndarray],
+        hits: Dict[str, Dict[str, Any]],
+        version: str
+    ) -> None:
+        """Remember a document's raw scan results, evicting the least recently used"""
+        text = document.text
+        if len(text) > self.max_chars:
+            return
+        with self._lock:
+            if text in self._entries:
+                self._remove(text)
+            buckets = self._bands(signature) if signature is not None else []
+            self._entries[text] = _Entry(document, hits, version, signature, buckets)
+            self._chars += len(text)
+            for bucket in buckets:
+                self._buckets.setdefault(bucket, []).append(text)
+            while self._chars > self.max_chars:
+                self._remove(next(iter(self._entries)))
+                self.counters['evictions'] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._chars = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries), chars=self._chars)
+
+    def _candidates(self, signature: np.ndarray) -> List[str]:
+        seen = {}
+        for bucket in self._bands(signature):
+            for text in self._buckets.get(bucket, ()):
+                seen[text] = None
+        return list(seen)
+
+    @staticmethod
+    def _bands(signature: np.ndarray) -> List[Tuple[int, int]]:
+        return [
+            (band, hash(signature[band * ROWS:(band + 1) * ROWS].tobytes()))
+            for band in range(BANDS)
+        ]
+
+    def _remove(self, text: str) -> None:
+        entry = self._entries.pop(text)
+        self._chars -= len(text)
+        for bucket in entry.buckets:
+            members = self._buckets[bucket]
+            members.remove(text)
+            if not members:
+                del self._buckets[bucket]
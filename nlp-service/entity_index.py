@@ -0,0 +1,431 @@
+"""
+Cross-case index of the people and agencies named in analyzed documents
+
+The same detective, jailhouse informant or discredited lab analyst turning
+up in several convictions is a pattern no single document shows. Each
+analyzed document's entities (see detectors.extract_entities) are recorded
+against its case in a SQLite file, and every entity keeps a running count
+of its cases, so "repeat actor" indicators come from the rows of one case
+rather than from comparing cases pairwise. Entities are stored under a
+64-bit hash of their normalized name, the table's integer primary key;
+adding a document costs a few keyed lookups per entity it names, however
+large the corpus.
+
+    python entity_index.py --index entities.db build --database sqlite:///db
+    python entity_index.py --index entities.db case 123
+    python entity_index.py --index entities.db lookup "Detective John Smith"
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+from detectors import (
+    Entity,
+    ROLE_LABELS,
+    agency_key,
+    extract_entities,
+    name_words,
+    person_key,
+    preprocess,
+)
+
+INDICATOR_NAME = 'Repeat Actor'
+
+# Other cases listed per entity in indicators and lookups
+LISTED_CASES = 20
+
+# Confidence that a person recurring in two cases points to misconduct,
+# by role; each further case adds REPEAT_STEP
+ROLE_CONFIDENCE = {
+    'informant': 0.8,
+    'analyst': 0.75,
+    'expert': 0.7,
+    'detective': 0.7,
+    'officer': 0.6,
+    'prosecutor': 0.6,
+    'witness': 0.55,
+}
+DEFAULT_CONFIDENCE = 0.5
+REPEAT_STEP = 0.05
+MAX_CONFIDENCE = 0.95
+
+ID_MASK = (1 << 63) - 1
+
+# Titles a looked-up name may start with, by role
+TITLE_WORDS = {
+    'detective': 'detective', 'det': 'detective', 'investigator': 'detective',
+    'officer': 'officer', 'deputy': 'officer', 'sergeant': 'officer', 'sgt': 'officer',
+    'lieutenant': 'officer', 'lt': 'officer', 'agent': 'officer',
+    'analyst': 'analyst', 'examiner': 'analyst', 'criminalist': 'analyst',
+    'dr': 'expert', 'doctor': 'expert',
+    'informant': 'informant', 'prosecutor': 'prosecutor', 'witness': 'witness',
+}
+
+
+def entity_id(key: str) -> int:
+    """Row id of an entity key (before resolving collisions)"""
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') & ID_MASK
+
+
+class EntityIndex:
+    """
+    Entity -> cases index in a SQLite file shared by every process
+
+    Each document's mentions replace those it had before, so re-analyzing
+    a document (or moving it to another case) never counts it twice.
+    Agencies are indexed for lookup but never reported as repeat actors:
+    the same police department recurring across cases is expected.
+    """
+
+    def __init__(self, path: str, min_cases: int = 2):
+        self.path = path
+        self.min_cases = min_cases
+        self._sqlite = None
+        self._sqlite_pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {'path': self.path, 'min_cases': self.min_cases}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Connection of this process, reopened after a fork"""
+        if self._sqlite is None or self._sqlite_pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entities ('
+                'id INTEGER PRIMARY KEY, key TEXT NOT NULL, kind TEXT NOT NULL, '
+                'role TEXT, name TEXT NOT NULL, surname TEXT, '
+                'cases INTEGER NOT NULL DEFAULT 0)'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS idx_entities_surname ON entities(surname)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entity_cases ('
+                'entity_id INTEGER NOT NULL, case_id NOT NULL, documents INTEGER NOT NULL, '
+                'PRIMARY KEY (entity_id, case_id)) WITHOUT ROWID'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS idx_entity_cases_case '
+                'ON entity_cases(case_id, entity_id)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entity_mentions ('
+                'document_key TEXT NOT NULL, entity_id INTEGER NOT NULL, case_id NOT NULL, '
+                'role TEXT, mentions INTEGER NOT NULL, '
+                'PRIMARY KEY (document_key, entity_id)) WITHOUT ROWID'
+            )
+            self._sqlite = connection
+            self._sqlite_pid = os.getpid()
+        return self._sqlite
+
+    def add_document(self, case_id: Any, document_key: str, content: Any) -> Set[Any]:
+        """
+        Record the entities a document names against its case
+
+        Returns the cases whose repeat actors changed: this case when an
+        entity it names joins or leaves it, and every case of an entity
+        that now recurs across cases (or has stopped recurring).
+        """
+        entities = extract_entities(preprocess(content))
+        changed: Set[Any] = set()
+        with self._lock:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                previous = set(connection.execute(
+                    'SELECT entity_id, case_id FROM entity_mentions WHERE document_key = ?',
+                    (document_key,)
+                ))
+                connection.execute(
+                    'DELETE FROM entity_mentions WHERE document_key = ?', (document_key,)
+                )
+                rows = [(self._entity_row(connection, entity), entity) for entity in entities]
+                # Only entities the document stopped or started naming change counts
+                current = {(row_id, case_id) for row_id, _ in rows}
+                for previous_id, previous_case in previous - current:
+                    self._leave(connection, previous_id, previous_case, changed)
+                for row_id, entity in rows:
+                    connection.execute(
+                        'INSERT INTO entity_mentions '
+                        '(document_key, entity_id, case_id, role, mentions) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (document_key, row_id, case_id, entity.role, entity.mentions)
+                    )
+                    if (row_id, case_id) not in previous:
+                        self._join(connection, row_id, case_id, changed)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        return changed
+
+    def add_case(self, case_id: Any, documents: List[Dict[str, Any]]) -> Set[Any]:
+        """
+        add_document for each document of a case; documents without an 'id'
+        are keyed by their position in the case
+        """
+        changed: Set[Any] = set()
+        for index, doc in enumerate(documents):
+            document_key = str(doc['id']) if doc.get('id') is not None else f'{case_id}#{index}'
+            changed |= self.add_document(case_id, document_key, doc.get('content', ''))
+        return changed
+
+    def repeat_actors(self, case_id: Any) -> List[Dict[str, Any]]:
+        """People named in a case who are also named in at least min_cases - 1 others"""
+        with self._lock:
+            connection = self._connection()
+            rows = connection.execute(
+                'SELECT e.id, e.role, e.name, e.cases, c.documents '
+                'FROM entity_cases c JOIN entities e ON e.id = c.entity_id '
+                "WHERE c.case_id = ? AND e.kind = 'person' AND e.cases >= ? "
+                'ORDER BY e.cases DESC, e.name',
+                (case_id, self.min_cases)
+            ).fetchall()
+            actors = []
+            for row_id, role, name, cases, documents in rows:
+                others = [
+                    other for other, in connection.execute(
+                        'SELECT case_id FROM entity_cases WHERE entity_id = ? AND case_id != ? '
+                        'LIMIT ?',
+                        (row_id, case_id, LISTED_CASES)
+                    )
+                ]
+                actors.append({
+                    'name': name,
+                    'role': role,
+                    'cases': cases,
+                    'documents': documents,
+                    'other_cases': others
+                })
+        return actors
+
+    def indicator(self, case_id: Any) -> Optional[Dict[str, Any]]:
+        """
+        The case's "Repeat Actor" indicator, in the form of the case
+        result's indicators, or None when no one in it recurs
+        """
+        actors = self.repeat_actors(case_id)
+        if not actors:
+            return None
+        evidence = []
+        confidence = 0.0
+        for actor in actors:
+            label = ' '.join(filter(None, (ROLE_LABELS.get(actor['role']), actor['name'])))
+            others = actor['cases'] - 1
+            listed = ', '.join(str(other) for other in actor['other_cases'])
+            more = others - len(actor['other_cases'])
+            evidence.append(
+                f'{label} also appears in {others} other case{"s" if others > 1 else ""}: '
+                f'{listed}{f" and {more} more" if more > 0 else ""}'
+            )
+            confidence = max(confidence, min(
+                MAX_CONFIDENCE,
+                ROLE_CONFIDENCE.get(actor['role'], DEFAULT_CONFIDENCE)
+                + REPEAT_STEP * (actor['cases'] - self.min_cases)
+            ))
+        return {
+            'indicator_name': INDICATOR_NAME,
+            'confidence': confidence,
+            'evidence': evidence,
+            'citations': [],
+            'document_types': [],
+            'detectors': ['entities'],
+            'actors': actors
+        }
+
+    def lookup(self, name: str, role: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Entities a name may refer to ("Detective John Smith", "Smith",
+        "Springfield Police Dept."), each with the cases naming it; a bare
+        surname matches every person with that surname (in that role)
+        """
+        words = name_words(name)
+        if words and words[0] in TITLE_WORDS:
+            role = role or TITLE_WORDS[words[0]]
+            words = words[1:]
+        found = []
+        with self._lock:
+            connection = self._connection()
+            rows = [self._find(connection, agency_key(name))]
+            if len(words) > 1:
+                rows.append(self._find(connection, person_key(words, role)))
+            elif words:
+                rows += connection.execute(
+                    'SELECT id, key, kind, role, name, cases FROM entities '
+                    'WHERE surname = ? AND (? IS NULL OR role = ?) ORDER BY cases DESC LIMIT ?',
+                    (words[0], role, role, LISTED_CASES)
+                ).fetchall()
+            for row in filter(None, rows):
+                row_id, key, kind, known_role, display, cases = row
+                found.append({
+                    'key': key,
+                    'kind': kind,
+                    'role': known_role,
+                    'name': display,
+                    'cases': cases,
+                    'case_ids': [
+                        case for case, in connection.execute(
+                            'SELECT case_id FROM entity_cases WHERE entity_id = ? LIMIT ?',
+                            (row_id, LISTED_CASES)
+                        )
+                    ]
+                })
+        return found
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            connection = self._connection()
+            entities, repeated = connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(cases >= ?), 0) FROM entities',
+                (self.min_cases,)
+            ).fetchone()
+            return {'entities': entities, 'repeat_actors': repeated}
+
+    def _find(self, connection: sqlite3.Connection, key: str) -> Optional[Tuple]:
+        """(id, key, kind, role, name, cases) of an entity key, probing past hash collisions"""
+        row_id = entity_id(key)
+        while True:
+            row = connection.execute(
+                'SELECT id, key, kind, role, name, cases FROM entities WHERE id = ?', (row_id,)
+            ).fetchone()
+            if row is None or row[1] == key:
+                return row
+            row_id = (row_id + 1) & ID_MASK
+
+    def _entity_row(self, connection: sqlite3.Connection, entity: Entity) -> int:
+        """Row id of an entity, inserted on first sight"""
+        row_id = entity_id(entity.key)
+        surname = entity.key.split(':', 1)[1].split()[-1] if entity.kind == 'person' else None
+        while True:
+            row = connection.execute(
+                'SELECT key FROM entities WHERE id = ?', (row_id,)
+            ).fetchone()
+            if row is None:
+                connection.execute(
+                    'INSERT INTO entities (id, key, kind, role, name, surname, cases) '
+                    'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                    (row_id, entity.key, entity.kind, entity.role, entity.name, surname)
+                )
+                return row_id
+            if row[0] == entity.key:
+                return row_id
+            row_id = (row_id + 1) & ID_MASK
+
+    def _join(
+        self,
+        connection: sqlite3.Connection,
+        row_id: int,
+        case_id: Any,
+        changed: Set[Any]
+    ) -> None:
+        updated = connection.execute(
+            'UPDATE entity_cases SET documents = documents + 1 '
+            'WHERE entity_id = ? AND case_id = ?',
+            (row_id, case_id)
+        ).rowcount
+        if updated:
+            return
+        connection.execute(
+            'INSERT INTO entity_cases (entity_id, case_id, documents) VALUES (?, ?, 1)',
+            (row_id, case_id)
+        )
+        self._count_cases(connection, row_id, case_id, 1, changed)
+
+    def _leave(
+        self,
+        connection: sqlite3.Connection,
+        row_id: int,
+        case_id: Any,
+        changed: Set[Any]
+    ) -> None:
+        connection.execute(
+            'UPDATE entity_cases SET documents = documents - 1 '
+            'WHERE entity_id = ? AND case_id = ?',
+            (row_id, case_id)
+        )
+        removed = connection.execute(
+            'DELETE FROM entity_cases WHERE entity_id = ? AND case_id = ? AND documents <= 0',
+            (row_id, case_id)
+        ).rowcount
+        if removed:
+            self._count_cases(connection, row_id, case_id, -1, changed)
+
+    def _count_cases(
+        self,
+        connection: sqlite3.Connection,
+        row_id: int,
+        case_id: Any,
+        delta: int,
+        changed: Set[Any]
+    ) -> None:
+        """Adjust an entity's case count, noting the cases whose repeat actors change"""
+        connection.execute('UPDATE entities SET cases = cases + ? WHERE id = ?', (delta, row_id))
+        kind, cases = connection.execute(
+            'SELECT kind, cases FROM entities WHERE id = ?', (row_id,)
+        ).fetchone()
+        if kind != 'person':
+            return
+        if max(cases, cases - delta) >= self.min_cases:
+            changed.add(case_id)
+            # The other cases gain or lose this case in their listing
+            changed.update(
+                case for case, in connection.execute(
+                    'SELECT case_id FROM entity_cases WHERE entity_id = ?', (row_id,)
+                )
+            )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--index', default=os.getenv('ENTITY_INDEX'),
+                        help='entity index file (default $ENTITY_INDEX)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='index the entities of the documents table')
+    build.add_argument('--database', default=os.getenv('DATABASE_URL'))
+    build.add_argument('--batch-size', type=int, default=512)
+    case = subparsers.add_parser('case', help="print a case's Repeat Actor indicator")
+    case.add_argument('case_id', type=int)
+    lookup = subparsers.add_parser('lookup', help='print the cases naming a person or agency')
+    lookup.add_argument('name')
+    lookup.add_argument('--role', choices=sorted(ROLE_LABELS))
+    args = parser.parse_args()
+
+    if not args.index:
+        parser.error('--index or ENTITY_INDEX is required')
+    index = EntityIndex(args.index)
+
+    if args.command == 'case':
+        print(json.dumps(index.indicator(args.case_id), indent=2))
+    elif args.command == 'lookup':
+        print(json.dumps(index.lookup(args.name, args.role), indent=2))
+    else:
+        from db import connect
+        if not args.database:
+            parser.error('--database or DATABASE_URL is required')
+        db = connect(args.database)
+        rows = db.iter_batches(
+            'SELECT id, case_id, content_text FROM documents ORDER BY id', (), args.batch_size
+        )
+        for batch in rows:
+            for document_id, case_id, content in batch:
+                index.add_document(case_id, str(document_id), content or '')
+        db.close()
+        print(json.dumps(index.stats()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,757 @@
+"""
+Priority job queue for analysis work, in a local SQLite file
+
+Interactive requests, newly ingested documents and corpus backfills all
+want the analyzer's cores. Jobs wait in one of three priority classes and
+a worker always takes the most urgent class that has work. Within a class,
+organizations get turns in proportion to their weight (stride scheduling
+over the jobs each has been served), so one organization's bulk upload
+cannot starve another's. A document already waiting is not queued twice;
+enqueueing it again at a more urgent class promotes the waiting job.
+
+Workers lease jobs for a limited time and renew the lease while they
+work on them. A job whose worker dies is leased again once its lease
+expires, and a job that fails is retried with exponential backoff until
+it has been attempted max_attempts times.
+
+    python jobs.py --queue jobs.db work --workers 8 --reserved 1 --database sqlite:///db
+    python jobs.py --queue jobs.db backfill --database sqlite:///db
+    python jobs.py --queue jobs.db stats
+
+With --reserved, that many of the workers only take interactive jobs, so
+an interactive analysis waits for at most a poll interval however long
+the backfill, while the other workers keep every remaining core busy.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator, NamedTuple, Optional, Sequence, Tuple
+
+INTERACTIVE = 'interactive'
+INGEST = 'ingest'
+BACKFILL = 'backfill'
+# Lower is more urgent
+PRIORITIES = {INTERACTIVE: 0, INGEST: 1, BACKFILL: 2}
+CLASSES = {priority: name for name, priority in PRIORITIES.items()}
+
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+# Idle workers poll at most this often, and back off to MAX_POLL_INTERVAL
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.5
+
+# Seconds between the supervisor's checks on workers and purges of old jobs
+SUPERVISE_INTERVAL = 5
+PURGE_INTERVAL = 600
+
+
+class Job(NamedTuple):
+    id: int
+    priority: str
+    organization: str
+    payload: Dict[str, Any]
+    attempts: int
+
+
+def dedupe_key(payload: Dict[str, Any]) -> str:
+    """Key under which identical waiting jobs are merged"""
+    if payload.get('document_id') is not None:
+        return f'document:{payload["document_id"]}'
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return 'sha256:' + hashlib.sha256(canonical.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class JobQueue:
+    """
+    Jobs in a SQLite file that the app and every worker process share
+
+    Scheduling state is kept in two small tables next to the jobs: the
+    number of waiting jobs per class and organization, and each
+    organization's weight and pass (jobs served divided by weight). A lease
+    reads them to pick the organization, so its cost depends on the number
+    of organizations, not on the length of the queue.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        lease_seconds: float = 300,
+        max_attempts: int = 5,
+        backoff_seconds: float = 5,
+        max_backoff_seconds: float = 3600
+    ):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._sqlite = None
+        self._sqlite_pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {
+            'path': self.path,
+            'lease_seconds': self.lease_seconds,
+            'max_attempts': self.max_attempts,
+            'backoff_seconds': self.backoff_seconds,
+            'max_backoff_seconds': self.max_backoff_seconds,
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Connection of this process, reopened after a fork"""
+        if self._sqlite is None or self._sqlite_pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, priority INTEGER NOT NULL, '
+                'organization TEXT NOT NULL, dedupe_key TEXT NOT NULL, '
+                'payload TEXT NOT NULL, state TEXT NOT NULL, '
+                'attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, '
+                'lease_owner TEXT, lease_expires REAL, created_at REAL NOT NULL, '
+                'finished_at REAL, result TEXT, error TEXT)'
+            )
+            # Only one waiting job per document
+            connection.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_waiting ON jobs(dedupe_key) '
+                f"WHERE state = '{QUEUED}'"
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS idx_jobs_queue '
+                'ON jobs(state, priority, organization, id)'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs(state, lease_expires)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS job_backlog ('
+                'priority INTEGER NOT NULL, organization TEXT NOT NULL, '
+                'queued INTEGER NOT NULL, PRIMARY KEY (priority, organization)) WITHOUT ROWID'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS job_shares ('
+                'organization TEXT PRIMARY KEY, weight REAL NOT NULL DEFAULT 1, '
+                'pass REAL NOT NULL DEFAULT 0)'
+            )
+            self._sqlite = connection
+            self._sqlite_pid = os.getpid()
+        return self._sqlite
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Immediate-mode write transaction, committed unless it raises"""
+        with self._lock:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def enqueue(
+        self,
+        payload: Dict[str, Any],
+        priority: str = INTERACTIVE,
+        organization: Any = '',
+        key: Optional[str] = None
+    ) -> Tuple[int, bool]:
+        """
+        Queue a job; returns its id and whether it is new
+
+        A job with the same key (by default the document id, else a hash
+        of the payload) that is still waiting is returned instead, moved to
+        this priority class if that is more urgent.
+        """
+        with self._transaction() as connection:
+            return self._enqueue(connection, payload, priority, organization, key)
+
+    def enqueue_many(
+        self,
+        jobs: Sequence[Tuple[Dict[str, Any], Any]],
+        priority: str = BACKFILL
+    ) -> int:
+        """Queue (payload, organization) jobs in one transaction; returns how many are new"""
+        added = 0
+        with self._transaction() as connection:
+            for payload, organization in jobs:
+                added += self._enqueue(connection, payload, priority, organization, None)[1]
+        return added
+
+    def _enqueue(
+        self,
+        connection: sqlite3.Connection,
+        payload: Dict[str, Any],
+        priority: str,
+        organization: Any,
+        key: Optional[str]
+    ) -> Tuple[int, bool]:
+        level = PRIORITIES[priority]
+        organization = '' if organization is None else str(organization)
+        key = key or dedupe_key(payload)
+        row = connection.execute(
+            'SELECT id, priority, organization FROM jobs WHERE dedupe_key = ? AND state = ?',
+            (key, QUEUED)
+        ).fetchone()
+        if row is not None:
+            job_id, waiting_level, waiting_organization = row
+            if level < waiting_level:
+                connection.execute('UPDATE jobs SET priority = ? WHERE id = ?', (level, job_id))
+                self._backlog(connection, waiting_level, waiting_organization, -1)
+                self._backlog(connection, level, waiting_organization, 1)
+            return job_id, False
+
+        self._activate(connection, organization)
+        now = time.time()
+        job_id = connection.execute(
+            'INSERT INTO jobs (priority, organization, dedupe_key, payload, state, '
+            'available_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (level, organization, key, json.dumps(payload), QUEUED, now, now)
+        ).lastrowid
+        self._backlog(connection, level, organization, 1)
+        return job_id, True
+
+    def lease(
+        self,
+        owner: str,
+        priorities: Optional[Sequence[str]] = None,
+        limit: int = 1
+    ) -> List[Job]:
+        """
+        Lease up to `limit` jobs of the most urgent class with jobs ready
+        (among `priorities`), all of one organization: the one whose turn
+        it is. Returns [] when nothing is ready.
+        """
+        levels = sorted(PRIORITIES[name] for name in (priorities or PRIORITIES))
+        now = time.time()
+        with self._transaction() as connection:
+            self._reclaim(connection, now)
+            for level in levels:
+                organizations = connection.execute(
+                    'SELECT b.organization, COALESCE(s.weight, 1) FROM job_backlog b '
+                    'LEFT JOIN job_shares s ON s.organization = b.organization '
+                    'WHERE b.priority = ? AND b.queued > 0 '
+                    'ORDER BY COALESCE(s.pass, 0), b.organization',
+                    (level,)
+                ).fetchall()
+                for organization, weight in organizations:
+                    rows = connection.execute(
+                        'SELECT id, payload, attempts FROM jobs '
+                        'WHERE state = ? AND priority = ? AND organization = ? '
+                        'AND available_at <= ? ORDER BY id LIMIT ?',
+                        (QUEUED, level, organization, now, limit)
+                    ).fetchall()
+                    if not rows:
+                        # Every job of this organization is backing off
+                        continue
+                    connection.executemany(
+                        'UPDATE jobs SET state = ?, lease_owner = ?, lease_expires = ?, '
+                        'attempts = attempts + 1 WHERE id = ?',
+                        [(LEASED, owner, now + self.lease_seconds, job_id)
+                         for job_id, _, _ in rows]
+                    )
+                    self._backlog(connection, level, organization, -len(rows))
+                    connection.execute(
+                        'UPDATE job_shares SET pass = pass + ? WHERE organization = ?',
+                        (len(rows) / weight, organization)
+                    )
+                    return [
+                        Job(job_id, CLASSES[level], organization, json.loads(payload),
+                            attempts + 1)
+                        for job_id, payload, attempts in rows
+                    ]
+        return []
+
+    def extend(self, job_ids: Sequence[int], owner: str) -> int:
+        """Renew the leases `owner` holds on jobs; returns how many it still held"""
+        with self._transaction() as connection:
+            return sum(
+                connection.execute(
+                    'UPDATE jobs SET lease_expires = ? '
+                    'WHERE id = ? AND state = ? AND lease_owner = ?',
+                    (time.time() + self.lease_seconds, job_id, LEASED, owner)
+                ).rowcount
+                for job_id in job_ids
+            )
+
+    def complete(self, job_id: int, owner: str, result: Any = None) -> bool:
+        """
+        Record a leased job's result; False when the lease was lost (it
+        expired and the job went to another worker)
+        """
+        with self._transaction() as connection:
+            return connection.execute(
+                'UPDATE jobs SET state = ?, result = ?, finished_at = ?, lease_owner = NULL, '
+                'lease_expires = NULL WHERE id = ? AND state = ? AND lease_owner = ?',
+                (DONE, json.dumps(result), time.time(), job_id, LEASED, owner)
+            ).rowcount > 0
+
+    def fail(self, job_id: int, owner: str, error: str, retry: bool = True) -> bool:
+        """
+        Give a leased job back after an error, to be retried after a
+        backoff unless it is out of attempts or retry is False; False when
+        the lease was lost
+        """
+        with self._transaction() as connection:
+            held = connection.execute(
+                'SELECT 1 FROM jobs WHERE id = ? AND state = ? AND lease_owner = ?',
+                (job_id, LEASED, owner)
+            ).fetchone()
+            if held is None:
+                return False
+            self._retry(connection, job_id, error, time.time(), retry)
+            return True
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """A job's status, and its result or last error"""
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT id, priority, organization, state, attempts, available_at, '
+                'created_at, finished_at, result, error FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        (job_id, level, organization, state, attempts, available_at,
+         created_at, finished_at, result, error) = row
+        job = {
+            'job_id': job_id,
+            'priority': CLASSES[level],
+            'organization': organization,
+            'status': state,
+            'attempts': attempts,
+            'created_at': created_at,
+        }
+        if state == QUEUED and available_at > created_at:
+            job['retry_at'] = available_at
+        if finished_at is not None:
+            job['finished_at'] = finished_at
+        if result is not None:
+            job['result'] = json.loads(result)
+        if error is not None:
+            job['error'] = error
+        return job
+
+    def set_weight(self, organization: Any, weight: float) -> None:
+        """An organization's share relative to others (default 1)"""
+        with self._transaction() as connection:
+            self._activate(connection, str(organization))
+            connection.execute(
+                'UPDATE job_shares SET weight = ? WHERE organization = ?',
+                (weight, str(organization))
+            )
+
+    def purge(self, older_than: float) -> int:
+        """Delete finished jobs older than `older_than` seconds; returns how many"""
+        with self._transaction() as connection:
+            return connection.execute(
+                'DELETE FROM jobs WHERE state IN (?, ?) AND finished_at < ?',
+                (DONE, FAILED, time.time() - older_than)
+            ).rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """Jobs by class and state, and the age of the oldest waiting job of each class"""
+        now = time.time()
+        with self._lock:
+            connection = self._connection()
+            counts = connection.execute(
+                'SELECT priority, state, COUNT(*) FROM jobs GROUP BY priority, state'
+            ).fetchall()
+            oldest = connection.execute(
+                'SELECT priority, MIN(created_at) FROM jobs WHERE state = ? GROUP BY priority',
+                (QUEUED,)
+            ).fetchall()
+        stats: Dict[str, Any] = {
+            name: {QUEUED: 0, LEASED: 0, DONE: 0, FAILED: 0} for name in PRIORITIES
+        }
+        for level, state, count in counts:
+            stats[CLASSES[level]][state] = count
+        for level, created_at in oldest:
+            stats[CLASSES[level]]['oldest_queued_seconds'] = round(now - created_at, 3)
+        return stats
+
+    def _activate(self, connection: sqlite3.Connection, organization: str) -> None:
+        """
+        Start an organization with nothing waiting at the lowest pass of
+        those with jobs waiting, so a newcomer (or one back after a quiet
+        spell) takes its turn with the others instead of running ahead
+        """
+        waiting = connection.execute(
+            'SELECT 1 FROM job_backlog WHERE organization = ? AND queued > 0', (organization,)
+        ).fetchone()
+        if waiting is not None:
+            return
+        floor = connection.execute(
+            'SELECT MIN(s.pass) FROM job_shares s WHERE EXISTS ('
+            'SELECT 1 FROM job_backlog b WHERE b.organization = s.organization AND b.queued > 0)'
+        ).fetchone()[0] or 0.0
+        connection.execute(
+            'INSERT INTO job_shares (organization, pass) VALUES (?, ?) '
+            'ON CONFLICT (organization) DO UPDATE SET pass = MAX(pass, excluded.pass)',
+            (organization, floor)
+        )
+
+    @staticmethod
+    def _backlog(
+        connection: sqlite3.Connection,
+        level: int,
+        organization: str,
+        delta: int
+    ) -> None:
+        connection.execute(
+            'INSERT INTO job_backlog (priority, organization, queued) VALUES (?, ?, ?) '
+            'ON CONFLICT (priority, organization) DO UPDATE SET queued = queued + excluded.queued',
+            (level, organization, delta)
+        )
+
+    def _reclaim(self, connection: sqlite3.Connection, now: float) -> None:
+        """Put jobs whose lease expired back in the queue (or fail them)"""
+        expired = connection.execute(
+            'SELECT id FROM jobs WHERE state = ? AND lease_expires < ?', (LEASED, now)
+        ).fetchall()
+        for job_id, in expired:
+            self._retry(connection, job_id, 'lease expired', now, True)
+
+    def _retry(
+        self,
+        connection: sqlite3.Connection,
+        job_id: int,
+        error: str,
+        now: float,
+        retry: bool
+    ) -> None:
+        level, organization, attempts = connection.execute(
+            'SELECT priority, organization, attempts FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if not retry or attempts >= self.max_attempts:
+            connection.execute(
+                'UPDATE jobs SET state = ?, error = ?, finished_at = ?, lease_owner = NULL, '
+                'lease_expires = NULL WHERE id = ?',
+                (FAILED, error, now, job_id)
+            )
+            return
+        # Exponential backoff with jitter, so jobs that failed together
+        # are not retried together
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempts - 1))
+        delay *= 0.5 + random.random() / 2
+        key, = connection.execute('SELECT dedupe_key FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if connection.execute(
+            'SELECT 1 FROM jobs WHERE dedupe_key = ? AND state = ?', (key, QUEUED)
+        ).fetchone() is not None:
+            # The document was queued again meanwhile; that job covers it
+            connection.execute(
+                'UPDATE jobs SET state = ?, error = ?, finished_at = ?, lease_owner = NULL, '
+                'lease_expires = NULL WHERE id = ?',
+                (FAILED, f'{error} (superseded)', now, job_id)
+            )
+            return
+        self._activate(connection, organization)
+        connection.execute(
+            'UPDATE jobs SET state = ?, error = ?, available_at = ?, lease_owner = NULL, '
+            'lease_expires = NULL WHERE id = ?',
+            (QUEUED, error, now + delay, job_id)
+        )
+        self._backlog(connection, level, organization, 1)
+
+
+class JobWorker:
+    """
+    Leases jobs and analyzes them, until stopped
+
+    Jobs name a stored document ({"document_id": 42}), whose results are
+    written to the database as by reanalyze.py, or carry their documents
+    ({"case_id": 123, "documents": [...]} or {"documents": [...]}), whose
+    case or document results are kept with the job.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        analyzer,
+        owner: Optional[str] = None,
+        priorities: Optional[Sequence[str]] = None,
+        batch_size: int = 1,
+        database_url: Optional[str] = None,
+        document_store=None
+    ):
+        self.queue = queue
+        self.analyzer = analyzer
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+        self.priorities = priorities
+        self.batch_size = batch_size
+        self.database_url = database_url
+        self.document_store = document_store
+        self._db = None
+        self._writer = None
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        interval = POLL_INTERVAL
+        while stop is None or not stop.is_set():
+            if self.run_once():
+                interval = POLL_INTERVAL
+                continue
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    def run_once(self) -> int:
+        """Lease and process one batch of jobs; returns how many were leased"""
+        jobs = self.queue.lease(self.owner, self.priorities, self.batch_size)
+        if not jobs:
+            return 0
+        with self._heartbeat(jobs):
+            stored = [job for job in jobs if job.payload.get('document_id') is not None]
+            if stored:
+                self._run_stored(stored)
+            for job in jobs:
+                if job.payload.get('document_id') is None:
+                    self._run_inline(job)
+        return len(jobs)
+
+    @contextmanager
+    def _heartbeat(self, jobs: List[Job]) -> Iterator[None]:
+        """Renew the leases on jobs every third of a lease until the block exits"""
+        job_ids = [job.id for job in jobs]
+        done = threading.Event()
+
+        def renew() -> None:
+            while not done.wait(self.queue.lease_seconds / 3):
+                try:
+                    # Jobs already completed or failed are no longer leased
+                    self.queue.extend(job_ids, self.owner)
+                except sqlite3.OperationalError:
+                    # The queue is busy; the next beat is still well within the lease
+                    pass
+
+        thread = threading.Thread(target=renew, name='lease-heartbeat', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def _run_inline(self, job: Job) -> None:
+        try:
+            documents = job.payload.get('documents') or []
+            if self.document_store is not None:
+                documents = [self.document_store.resolve(doc) for doc in documents]
+            if job.payload.get('case_id') is not None:
+                results = self.analyzer.analyze_results(documents)
+                result = self.analyzer.merge_case(
+                    {'case_id': job.payload['case_id'], 'documents': documents}, results
+                )
+            else:
+                result = {'results': self.analyzer.analyze_documents(documents)}
+        except Exception as error:
+            self.queue.fail(job.id, self.owner, f'{type(error).__name__}: {error}')
+            return
+        self.queue.complete(job.id, self.owner, result)
+
+    def _run_stored(self, jobs: List[Job]) -> None:
+        try:
+            db, writer = self._database()
+            ids = [job.payload['document_id'] for job in jobs]
+            rows = {
+                row[0]: row for row in db.query(
+                    'SELECT id, case_id, document_type, content_text FROM documents '
+                    f'WHERE id IN ({db.in_clause(ids)})',
+                    ids
+                )
+            }
+            found = [job for job in jobs if job.payload['document_id'] in rows]
+            for job in jobs:
+                if job.payload['document_id'] not in rows:
+                    self.queue.fail(job.id, self.owner, 'document not found', retry=False)
+            batch = [rows[job.payload['document_id']] for job in found]
+            results = self.analyzer.analyze_results([
+                {'type': document_type, 'content': content or ''}
+                for _, _, document_type, content in batch
+            ])
+            if batch:
+                writer.write(batch, results)
+            db.commit()
+        except Exception as error:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+            for job in jobs:
+                self.queue.fail(job.id, self.owner, f'{type(error).__name__}: {error}')
+            return
+        for job, result in zip(found, results):
+            self.queue.complete(job.id, self.owner, {
+                'document_id': job.payload['document_id'],
+                'indicators': [indicator.indicator_name for indicator in result.indicators]
+            })
+
+    def _database(self):
+        if self.database_url is None:
+            raise RuntimeError('document jobs need --database or DATABASE_URL')
+        if self._db is None:
+            from db import connect
+            from reanalyze import ResultWriter
+            self._db = connect(self.database_url)
+            self._writer = ResultWriter(self._db, self.analyzer.indicator_names())
+        return self._db, self._writer
+
+
+def _work(worker: JobWorker, stop) -> None:
+    # The supervisor handles signals and sets stop; a worker then finishes
+    # its batch and exits
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    worker.owner = f'{socket.gethostname()}:{os.getpid()}'
+    worker.run(stop)
+
+
+def build_analyzer():
+    """Analyzer configured from the same environment variables as the app"""
+    from analyzer import WrongfulConvictionAnalyzer
+    from detectors import BUILTIN_PATH
+    from duplicates import NearDuplicateIndex
+    from registry import IndicatorRegistry
+
+    near_duplicate_mb = int(os.getenv('NEAR_DUPLICATE_MB', 64))
+    return WrongfulConvictionAnalyzer(
+        pattern_mode=os.getenv('PATTERN_MODE', 'proximity'),
+        proximity_tokens=int(os.getenv('PROXIMITY_TOKENS', 10)),
+        pattern_scope=os.getenv('PATTERN_SCOPE', 'document'),
+        registry=IndicatorRegistry(
+            os.getenv('INDICATOR_DEFINITIONS') or BUILTIN_PATH,
+            poll_interval=float(os.getenv('INDICATOR_RELOAD_SECONDS', 10))
+        ),
+        near_duplicates=NearDuplicateIndex(
+            threshold=float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.8)),
+            max_chars=near_duplicate_mb * 1024 * 1024
+        ) if near_duplicate_mb > 0 else None,
+        pattern_artifact=os.getenv('PATTERN_ARTIFACT') or None
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--queue', default=os.getenv('JOB_QUEUE'),
+                        help='job queue file (default $JOB_QUEUE)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    work = subparsers.add_parser('work', help='run worker processes until interrupted')
+    work.add_argument('--workers', type=int,
+                      default=int(os.getenv('JOB_WORKERS', os.cpu_count() or 1)))
+    work.add_argument('--reserved', type=int,
+                      default=int(os.getenv('JOB_RESERVED_WORKERS', 1)),
+                      help='workers that only take interactive jobs')
+    work.add_argument('--batch-size', type=int, default=int(os.getenv('JOB_BATCH_SIZE', 8)),
+                      help='jobs leased at a time by the other workers')
+    work.add_argument('--database', default=os.getenv('DATABASE_URL'))
+    work.add_argument('--retention-hours', type=float,
+                      default=float(os.getenv('JOB_RETENTION_HOURS', 24)),
+                      help='finished jobs are deleted after this long')
+    backfill = subparsers.add_parser(
+        'backfill', help='queue every document of the database as a backfill job'
+    )
+    backfill.add_argument('--database', default=os.getenv('DATABASE_URL'))
+    backfill.add_argument('--unprocessed', action='store_true',
+                          help='only documents not processed yet')
+    backfill.add_argument('--batch-size', type=int, default=1000)
+    subparsers.add_parser('stats', help='print the number of jobs by class and state')
+    args = parser.parse_args()
+
+    if not args.queue:
+        parser.error('--queue or JOB_QUEUE is required')
+    queue = JobQueue(
+        args.queue,
+        lease_seconds=float(os.getenv('JOB_LEASE_SECONDS', 300)),
+        max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+    )
+
+    if args.command == 'stats':
+        print(json.dumps(queue.stats(), indent=2))
+    elif args.command == 'backfill':
+        from db import connect
+        if not args.database:
+            parser.error('--database or DATABASE_URL is required')
+        db = connect(args.database)
+        where = 'WHERE d.processed = FALSE' if args.unprocessed else ''
+        added = 0
+        for rows in db.iter_batches(
+            'SELECT d.id, c.claimed_by_org_id FROM documents d '
+            f'LEFT JOIN cases c ON c.id = d.case_id {where} ORDER BY d.id',
+            (), args.batch_size
+        ):
+            added += queue.enqueue_many([
+                ({'document_id': document_id}, organization)
+                for document_id, organization in rows
+            ])
+        db.close()
+        print(json.dumps({'queued': added, **queue.stats()[BACKFILL]}))
+    else:
+        from pool import frozen
+        analyzer = build_analyzer()
+        document_store = None
+        if os.getenv('DOCUMENT_STORE'):
+            from store import DocumentStore
+            document_store = DocumentStore(
+                os.getenv('DOCUMENT_STORE'), document_root=os.getenv('DOCUMENT_ROOT') or None
+            )
+        # Workers fork from this process with the detectors already compiled
+        analyzer.warm()
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        stop = context.Event()
+
+        def start(index: int):
+            reserved = index < args.reserved
+            worker = JobWorker(
+                queue, analyzer,
+                priorities=(INTERACTIVE,) if reserved else None,
+                # Interactive work is leased one job at a time either way
+                batch_size=1 if reserved else args.batch_size,
+                database_url=args.database,
+                document_store=document_store
+            )
+            process = context.Process(target=_work, args=(worker, stop), daemon=True)
+            process.start()
+            return process
+
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        with frozen():
+            processes = [start(index) for index in range(max(args.workers, 1))]
+        print(f'{len(processes)} workers ({args.reserved} interactive only)', file=sys.stderr)
+        purged_at = 0.0
+        try:
+            while True:
+                time.sleep(SUPERVISE_INTERVAL)
+                # Replace workers that died; their jobs come back when the lease expires
+                for index, process in enumerate(processes):
+                    if not process.is_alive():
+                        processes[index] = start(index)
+                if time.monotonic() - purged_at > PURGE_INTERVAL:
+                    queue.purge(args.retention_hours * 3600)
+                    purged_at = time.monotonic()
+        except KeyboardInterrupt:
+            stop.set()
+        for process in processes:
+            process.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Optional linguistic filter that drops negated or unrelated pattern matches
+
+Regex patterns cannot tell "he was coerced" from "he was not coerced",
+and a gap such as `DNA.*(not|never).*test` happily joins words from
+unrelated clauses. This stage runs after the pattern scan and before
+evidence is built: the sentence around every candidate match is parsed
+with spaCy (batched through nlp.pipe, only the parser kept) and a match
+is dropped when
+
+- a negation outside the match governs it, e.g. "did not confess under
+  pressure" for the pattern `pressure`, or
+- its first and last words are not syntactically related (more than
+  max_distance dependency edges apart).
+
+Without a spaCy model the filter falls back to lexical negation cues in
+the few words before each match. With the filter disabled the analyzer
+uses the plain regex results.
+"""
+import logging
+import re
+from typing import List, Dict, Any, Tuple, Iterable
+
+from detectors import Document
+
+logger = logging.getLogger(__name__)
+
+Span = Tuple[int, int]
+Hits = Dict[str, Dict[str, List[Span]]]
+
+NEGATION_CUES = frozenset((
+    'not', "n't", 'never', 'no', 'neither', 'nor', 'none', 'nobody',
+    'nothing', 'nowhere', 'without', 'cannot',
+))
+
+# Components the filter never needs; only the parser (and the tok2vec
+# layer it listens to) is kept
+UNUSED_COMPONENTS = ('tagger', 'attribute_ruler', 'lemmatizer', 'ner', 'textcat', 'senter')
+
+# Characters of context parsed on each side of a match within its sentence
+CONTEXT_CHARS = 300
+
+WORD = re.compile(r"\w+(?:'\w+)*")
+
+
+class LinguisticFilter:
+    """
+    Filters candidate matches using negation and dependency features
+
+    The spaCy model is loaded once per process by load(), which the app
+    calls at startup and every pool worker calls when it starts; the
+    model itself is never pickled.
+    """
+
+    def __init__(
+        self,
+        model: str = 'en_core_web_sm',
+        batch_size: int = 256,
+        n_process: int = 1,
+        max_distance: int = 3,
+        window: int = 3
+    ):
+        self.model = model
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.max_distance = max_distance
+        self.window = window
+        self._nlp = None
+        self._loaded = False
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = dict(self.__dict__)
+        state['_nlp'] = None
+        state['_loaded'] = False
+        return state
+
+    @property
+    def key(self) -> str:
+        """Identifies the filter's configuration, for cache keys"""
+        return f'linguistic:{self.model}:{self.max_distance}:{self.window}'
+
+    def load(self) -> bool:
+        """Load the model; returns False when falling back to lexical cues"""
+        if not self._loaded:
+            self._loaded = True
+            try:
+                import spacy
+                self._nlp = spacy.load(self.model, exclude=list(UNUSED_COMPONENTS))
+            except (ImportError, OSError) as error:
+                logger.warning(
+                    'spaCy model %s unavailable (%s); using lexical negation cues',
+                    self.model, error
+                )
+        return self._nlp is not None
+
+    def filter(self, scanned: List[Tuple[Document, Hits]]) -> List[Hits]:
+        """
+        Drop negated and unrelated matches from the hits of several
+        documents, parsing all of their candidate sentences in one batch
+
+        Returns new hits with the same shape; categories left without a
+        match are omitted.
+        """
+        self.load()
+        candidates = [
+            (index, detector_name, category, span)
+            for index, (document, hits) in enumerate(scanned)
+            for detector_name, categories in hits.items()
+            for category, spans in categories.items()
+            for span in spans
+        ]
+        contexts = [self._context(scanned[index][0], span) for index, _, _, span in candidates]
+        if self._nlp is not None:
+            kept = self._parse_filter(contexts)
+        else:
+            kept = [self._lexical_keep(text, start) for text, start, _ in contexts]
+
+        filtered: List[Hits] = [
+            {detector_name: {} for detector_name in hits} for _, hits in scanned
+        ]
+        for (index, detector_name, category, span), keep in zip(candidates, kept):
+            if keep:
+                filtered[index][detector_name].setdefault(category, []).append(span)
+        return filtered
+
+    def _context(self, document: Document, span: Span) -> Tuple[str, int, int]:
+        """Text around a match within its sentence, and the match's offsets in it"""
+        start, end = span
+        sentence_start, sentence_end = document.sentence(start)
+        context_start = max(sentence_start, start - CONTEXT_CHARS)
+        context_end = min(max(sentence_end, end), end + CONTEXT_CHARS)
+        text = document.normalized[context_start:context_end]
+        return text, start - context_start, end - context_start
+
+    def _lexical_keep(self, text: str, start: int) -> bool:
+        """Keep unless a negation cue is among the words just before the match"""
+        before = WORD.findall(text[:start].lower())[-self.window:]
+        return not any(_is_cue(word) for word in before)
+
+    def _parse_filter(self, contexts: List[Tuple[str, int, int]]) -> List[bool]:
+        # Identical contexts (repeated boilerplate) are parsed once
+        unique = list(dict.fromkeys(text for text, _, _ in contexts))
+        parsed = dict(zip(unique, self._pipe(unique)))
+        return [self._parsed_keep(parsed[text], start, end) for text, start, end in contexts]
+
+    def _pipe(self, texts: List[str]) -> Iterable[Any]:
+        return self._nlp.pipe(texts, batch_size=self.batch_size, n_process=self.n_process)
+
+    def _parsed_keep(self, doc, start: int, end: int) -> bool:
+        if not doc.has_annotation('DEP'):
+            # A pipeline without a parser
+            return self._lexical_keep(doc.text, start)
+        span = doc.char_span(start, end, alignment_mode='expand')
+        if span is None or len(span) == 0:
+            return True
+
+        inside = {token.i for token in span}
+        ancestors = {token.i for token in span.root.ancestors}
+        for token in doc:
+            if token.i in inside:
+                continue
+            # "did not confess under pressure": the negation modifies a
+            # word the match depends on
+            if token.dep_ == 'neg' and (token.head.i in inside or token.head.i in ancestors):
+                return False
+            # "no DNA test", "without pressure": a negating word attached
+            # to the match or governing it
+            if _is_cue(token.lower_) and (token.head.i in inside or token.i in ancestors):
+                return False
+
+        if len(span) > 1 and _distance(span[0], span[-1]) > self.max_distance:
+            return False
+        return True
+
+
+def _is_cue(word: str) -> bool:
+    return word in NEGATION_CUES or word.endswith("n't")
+
+
+def _distance(first, last) -> int:
+    """Dependency edges between two tokens of one parse"""
+    first_path = [first] + list(first.ancestors)
+    last_path = [last] + list(last.ancestors)
+    last_depth = {token.i: depth for depth, token in enumerate(last_path)}
+    for depth, token in enumerate(first_path):
+        if token.i in last_depth:
+            return depth + last_depth[token.i]
+    # Different sentences inside one context
+    return len(first_path) + len(last_path)
+
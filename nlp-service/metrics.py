@@ -0,0 +1,314 @@
+"""
+Opt-in instrumentation: per-pattern and per-stage timings
+
+Collection is off unless enabled (ANALYSIS_METRICS=1) or a request asks
+for its own timing breakdown. When off, stage() hands back a shared
+no-op context manager and the engine skips its instrumented scan loop,
+so the hot path is unchanged.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Any, Optional, Tuple, List, Iterator
+
+# Pipeline stages timed per request, in order
+STAGES = ('parse', 'lowercase', 'scan', 'linguistics', 'contexts', 'aggregate', 'serialize')
+
+_NULL_STAGE = nullcontext()
+
+
+class Registry:
+    """Cumulative counters, safe to update from several threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (detector, category, pattern index) -> [seconds, scans, matches, bytes]
+        self.patterns: Dict[Tuple[str, str, int], List[float]] = {}
+        # (detector, category) -> [seconds, scans, matches, bytes]
+        self.categories: Dict[Tuple[str, str], List[float]] = {}
+        # stage -> [seconds, calls]
+        self.stages: Dict[str, List[float]] = {}
+        # endpoint -> [seconds, calls]
+        self.requests: Dict[str, List[float]] = {}
+        self.pattern_samples = 0
+
+    def add_category(
+        self,
+        detector: str,
+        category: str,
+        seconds: float,
+        matches: Dict[int, int],
+        pattern_count: int,
+        scanned: int
+    ) -> None:
+        with self.lock:
+            totals = self.categories.setdefault((detector, category), [0.0, 0, 0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+            totals[2] += sum(matches.values())
+            totals[3] += scanned
+            # Every pattern of the alternation takes part in each scan
+            for index in range(pattern_count):
+                pattern = self.patterns.setdefault((detector, category, index), [0.0, 0, 0, 0])
+                pattern[1] += 1
+                pattern[2] += matches.get(index, 0)
+                pattern[3] += scanned
+
+    def add_pattern_time(self, detector: str, category: str, index: int, seconds: float) -> None:
+        with self.lock:
+            self.patterns.setdefault((detector, category, index), [0.0, 0, 0, 0])[0] += seconds
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        with self.lock:
+            totals = self.stages.setdefault(name, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+
+    def add_request(self, endpoint: str, seconds: float) -> None:
+        with self.lock:
+            totals = self.requests.setdefault(endpoint, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Picklable copy, used to ship worker process counters to the parent"""
+        with self.lock:
+            return {
+                'patterns': {key: list(value) for key, value in self.patterns.items()},
+                'categories': {key: list(value) for key, value in self.categories.items()},
+                'stages': {key: list(value) for key, value in self.stages.items()},
+                'pattern_samples': self.pattern_samples,
+            }
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        with self.lock:
+            for field in ('patterns', 'categories', 'stages'):
+                totals = getattr(self, field)
+                for key, values in snapshot[field].items():
+                    current = totals.setdefault(key, [0] * len(values))
+                    for index, value in enumerate(values):
+                        current[index] += value
+            self.pattern_samples += snapshot['pattern_samples']
+
+
+registry = Registry()
+_enabled = os.getenv('ANALYSIS_METRICS', '').lower() in ('1', 'true', 'yes')
+# Time each pattern on its own for every Nth instrumented document
+_sample_every = int(os.getenv('METRICS_PATTERN_SAMPLE_EVERY', 50))
+_documents_seen = 0
+
+# Stage timings of the request being served on this thread, if requested
+_request_timings: 'contextvars.ContextVar[Optional[Dict[str, float]]]' = (
+    contextvars.ContextVar('request_timings', default=None)
+)
+
+
+def enable(sample_every: Optional[int] = None) -> None:
+    global _enabled, _sample_every
+    _enabled = True
+    if sample_every is not None:
+        _sample_every = sample_every
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def enabled() -> bool:
+    """Whether per-pattern and per-detector counters are being collected"""
+    return _enabled
+
+
+def recording() -> bool:
+    """Whether stage timings are wanted, globally or by the current request"""
+    return _enabled or _request_timings.get() is not None
+
+
+def sample_patterns() -> bool:
+    """Whether this document's patterns should also be timed one by one"""
+    global _documents_seen
+    if not _enabled or _sample_every <= 0:
+        return False
+    _documents_seen += 1
+    return _documents_seen % _sample_every == 0
+
+
+def stage(name: str):
+    """Context manager timing one pipeline stage"""
+    if not _enabled and _request_timings.get() is None:
+        return _NULL_STAGE
+    return _timed_stage(name)
+
+
+@contextmanager
+def _timed_stage(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - started)
+
+
+def add_stage(name: str, seconds: float) -> None:
+    if _enabled:
+        registry.add_stage(name, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def begin_request() -> contextvars.Token:
+    """Start collecting stage timings for the current request"""
+    return _request_timings.set({})
+
+
+def end_request(token: contextvars.Token) -> Dict[str, float]:
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+
+def format_timing(timings: Dict[str, float], total: float) -> str:
+    """Server-Timing style header value, in milliseconds"""
+    names = [name for name in STAGES if name in timings]
+    names += sorted(name for name in timings if name not in STAGES)
+    parts = [f'{name};dur={timings[name] * 1000:.2f}' for name in names]
+    parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
+
+
+@contextmanager
+def capture() -> Iterator[Dict[str, Any]]:
+    """
+    Collect everything recorded inside the block into a fresh snapshot
+
+    Used in pool workers, whose counters would otherwise stay in the
+    worker process. The caller passes the snapshot to merge() in the
+    parent.
+    """
+    global registry
+    previous = registry
+    registry = Registry()
+    token = _request_timings.set({})
+    result: Dict[str, Any] = {}
+    try:
+        yield result
+    finally:
+        result.update(registry.snapshot())
+        if not _enabled:
+            # Only the parent's request wants timings; keep just the stages
+            timings = _request_timings.get() or {}
+            result['stages'] = {name: [seconds, 1] for name, seconds in timings.items()}
+        registry = previous
+        _request_timings.reset(token)
+
+
+def merge(snapshot: Optional[Dict[str, Any]]) -> None:
+    """Fold a worker snapshot into the counters and the current request"""
+    if not snapshot:
+        return
+    if _enabled:
+        registry.merge(snapshot)
+    timings = _request_timings.get()
+    if timings is not None:
+        for name, (seconds, _) in snapshot['stages'].items():
+            timings[name] = timings.get(name, 0.0) + seconds
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels: Any) -> str:
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def render_prometheus(
+    patterns: Optional[Dict[str, Dict[str, List[str]]]] = None,
+    extra: Optional[Dict[str, float]] = None
+) -> str:
+    """
+    Counters in the Prometheus text exposition format
+
+    patterns (detector -> category -> regexes) adds the regex source as a
+    label; extra adds plain gauges such as cache statistics.
+    """
+    lines = [
+        '# HELP nlp_metrics_enabled Whether per-pattern instrumentation is on',
+        '# TYPE nlp_metrics_enabled gauge',
+        f'nlp_metrics_enabled {int(_enabled)}',
+    ]
+
+    def family(name: str, kind: str, description: str, samples) -> None:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{name}{labels} {value}')
+
+    with registry.lock:
+        categories = sorted(registry.categories.items())
+        pattern_items = sorted(registry.patterns.items())
+        stages = sorted(registry.stages.items())
+        requests = sorted(registry.requests.items())
+        samples = registry.pattern_samples
+
+    def detector_totals(field: int):
+        totals: Dict[str, float] = {}
+        for (detector, _), values in categories:
+            totals[detector] = totals.get(detector, 0) + values[field]
+        return [(_labels(detector=detector), value) for detector, value in sorted(totals.items())]
+
+    def pattern_labels(detector: str, category: str, index: int) -> str:
+        source = ''
+        if patterns is not None:
+            category_patterns = patterns.get(detector, {}).get(category, [])
+            if index < len(category_patterns):
+                source = category_patterns[index]
+        return _labels(detector=detector, category=category, index=index, pattern=source)
+
+    family('nlp_detector_seconds_total', 'counter',
+           'Time spent scanning per detector', detector_totals(0))
+    family('nlp_detector_matches_total', 'counter',
+           'Evidence matches per detector', detector_totals(2))
+    family('nlp_detector_bytes_total', 'counter',
+           'Characters scanned per detector', detector_totals(3))
+
+    family('nlp_category_seconds_total', 'counter',
+           'Time spent scanning per indicator category',
+           [(_labels(detector=d, category=c), v[0]) for (d, c), v in categories])
+    family('nlp_category_scans_total', 'counter',
+           'Scans per indicator category',
+           [(_labels(detector=d, category=c), v[1]) for (d, c), v in categories])
+
+    family('nlp_pattern_sampled_seconds_total', 'counter',
+           'Time running each pattern on its own, over sampled documents only',
+           [(pattern_labels(*key), v[0]) for key, v in pattern_items])
+    family('nlp_pattern_scans_total', 'counter',
+           'Scans that included each pattern',
+           [(pattern_labels(*key), v[1]) for key, v in pattern_items])
+    family('nlp_pattern_matches_total', 'counter',
+           'Evidence matches produced by each pattern',
+           [(pattern_labels(*key), v[2]) for key, v in pattern_items])
+    family('nlp_pattern_bytes_total', 'counter',
+           'Characters scanned by each pattern',
+           [(pattern_labels(*key), v[3]) for key, v in pattern_items])
+    family('nlp_pattern_samples_total', 'counter',
+           'Documents whose patterns were timed one by one', [('', samples)])
+
+    family('nlp_stage_seconds_total', 'counter', 'Time spent per pipeline stage',
+           [(_labels(stage=name), v[0]) for name, v in stages])
+    family('nlp_stage_calls_total', 'counter', 'Calls per pipeline stage',
+           [(_labels(stage=name), v[1]) for name, v in stages])
+    family('nlp_request_seconds_total', 'counter', 'Time serving requests per endpoint',
+           [(_labels(endpoint=name), v[0]) for name, v in requests])
+    family('nlp_requests_total', 'counter', 'Requests served per endpoint',
+           [(_labels(endpoint=name), v[1]) for name, v in requests])
+
+    for name, value in (extra or {}).items():
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,158 @@
+"""
+Adversarial scaling harness for detector patterns
+
+Feeds every detector pattern inputs built to provoke backtracking (long
+single lines of the pattern's own words with the final word missing, so
+the pattern keeps almost matching) at doubling sizes, and fails any
+pattern whose scan time grows super-linearly with input length.
+
+Usage:
+    python pattern_harness.py [--mode proximity|legacy] [--tokens 10]
+"""
+import argparse
+import math
+import re
+import sys
+import time
+from typing import List, Dict, Any
+
+from analyzer import WrongfulConvictionAnalyzer
+from detectors import PATTERN_MODES
+
+WORD = re.compile(r'(?<!\\)[a-z]{2,}')
+
+
+def adversarial_inputs(pattern: str, size: int) -> Dict[str, str]:
+    """Build single-line inputs of roughly `size` characters for a pattern"""
+    words = WORD.findall(pattern.lower()) or ['a']
+    # Leave out the final literal so the pattern never completes
+    prefix = words[:-1] or words
+
+    def repeat(unit: str) -> str:
+        return (unit * (size // len(unit) + 1))[:size]
+
+    return {
+        'near_miss': repeat(' '.join(prefix) + ' '),
+        'near_miss_unspaced': repeat(''.join(prefix)),
+        'vocabulary': repeat(' '.join(words) + ' , '),
+    }
+
+
+def time_scan(regex, text: str, max_seconds: float, repeats: int = 3) -> float:
+    """Best-of-n time to run a regex over the whole input"""
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in regex.finditer(text):
+            pass
+        best = min(best, time.perf_counter() - started)
+        if best > max_seconds:
+            break
+    return best
+
+
+def check_pattern(
+    regex,
+    pattern: str,
+    sizes: List[int],
+    max_exponent: float,
+    max_seconds: float,
+    noise_floor: float
+) -> Dict[str, Any]:
+    """Measure growth of scan time over doubling input sizes"""
+    worst = {'exponent': 0.0, 'input': None, 'seconds': 0.0}
+
+    for name in adversarial_inputs(pattern, sizes[0]):
+        timings = []
+        for size in sizes:
+            elapsed = time_scan(
+                regex, adversarial_inputs(pattern, size)[name], max_seconds
+            )
+            timings.append(elapsed)
+            if elapsed > max_seconds:
+                # Stop before a pathological pattern hangs the harness
+                return {
+                    'exponent': math.inf,
+                    'input': name,
+                    'seconds': elapsed,
+                    'passed': False
+                }
+
+        small, large = timings[-2], timings[-1]
+        if large < noise_floor:
+            continue
+        exponent = math.log(large / max(small, 1e-9)) / math.log(sizes[-1] / sizes[-2])
+        if exponent > worst['exponent']:
+            worst = {'exponent': exponent, 'input': name, 'seconds': large}
+
+    worst['passed'] = worst['exponent'] <= max_exponent
+    return worst
+
+
+def run(
+    mode: str,
+    tokens: int,
+    sizes: List[int],
+    max_exponent: float,
+    max_seconds: float,
+    noise_floor: float
+) -> List[Dict[str, Any]]:
+    analyzer = WrongfulConvictionAnalyzer(pattern_mode=mode, proximity_tokens=tokens)
+    engine = analyzer.engine
+    results = []
+
+    for detector_name, categories in engine.patterns.items():
+        for category, patterns in categories.items():
+            for pattern in patterns:
+                regex = re.compile(engine.prepare_pattern(pattern.lower()))
+                result = check_pattern(
+                    regex, pattern, sizes, max_exponent, max_seconds, noise_floor
+                )
+                result.update({
+                    'detector': detector_name,
+                    'category': category,
+                    'pattern': pattern
+                })
+                results.append(result)
+
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--mode', choices=PATTERN_MODES, default='proximity')
+    parser.add_argument('--tokens', type=int, default=10)
+    parser.add_argument('--base-size', type=int, default=2000,
+                        help='smallest input size in characters')
+    parser.add_argument('--steps', type=int, default=4,
+                        help='number of doubling input sizes')
+    parser.add_argument('--max-exponent', type=float, default=1.5,
+                        help='largest accepted growth exponent (1.0 is linear)')
+    parser.add_argument('--max-seconds', type=float, default=2.0,
+                        help='fail a pattern outright once one scan takes this long')
+    parser.add_argument('--noise-floor', type=float, default=0.002,
+                        help='ignore timings below this many seconds')
+    args = parser.parse_args()
+
+    sizes = [args.base_size * 2 ** step for step in range(args.steps)]
+    results = run(
+        args.mode, args.tokens, sizes,
+        args.max_exponent, args.max_seconds, args.noise_floor
+    )
+
+    failures = [result for result in results if not result['passed']]
+    for result in results:
+        status = 'ok  ' if result['passed'] else 'FAIL'
+        print(
+            f"{status} {result['detector']}.{result['category']:<24} "
+            f"n^{result['exponent']:.2f} {result['seconds'] * 1000:8.1f}ms "
+            f"{result['input'] or '-':<20} {result['pattern']}"
+        )
+
+    print(f'\n{len(results) - len(failures)}/{len(results)} patterns scale linearly '
+          f'({args.mode} mode, sizes {sizes[0]}..{sizes[-1]})')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
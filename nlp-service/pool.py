@@ -0,0 +1,396 @@
+"""
+Process pool that fans document analysis out to warm worker processes
+"""
+import gc
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Callable, Tuple, Iterator
+
+import metrics
+from detectors import DocumentResult, preprocess
+from registry import Snapshot
+
+# Largest amount of text sent to a worker in one dispatch
+DEFAULT_CHUNK_CHARS = 1 << 20
+
+# How often the watchdog looks for chunks past their deadline, in seconds
+WATCHDOG_INTERVAL = 0.1
+
+# Analyzer inherited by (or unpickled into) each worker process
+_worker_analyzer = None
+
+# Lock and pipe on which workers report the chunks they start and finish
+_worker_progress = None
+
+
+@contextmanager
+def frozen() -> Iterator[None]:
+    """
+    Keep the garbage collector off every object allocated so far while
+    worker processes are forked
+
+    A collection in a worker would otherwise write to the headers of the
+    objects it inherited, copying the pages it shares with the parent.
+    The workers keep them frozen; the parent collects as usual afterwards.
+    """
+    gc.freeze()
+    try:
+        yield
+    finally:
+        gc.unfreeze()
+
+
+def _init_worker(analyzer, progress=None) -> None:
+    global _worker_analyzer, _worker_progress
+    _worker_analyzer = analyzer
+    _worker_progress = progress
+    # The parent process consults the cache before dispatching
+    _worker_analyzer.cache = None
+    if _worker_analyzer.registry is not None:
+        # New definitions arrive from the parent with the work instead
+        _worker_analyzer.registry.poll_interval = 0
+    if _worker_analyzer.linguistics is not None:
+        # Warm the model now rather than on the first request
+        _worker_analyzer.linguistics.load()
+
+
+def _report(task: int, running: bool) -> None:
+    """Tell the parent's watchdog that this worker started or finished a chunk"""
+    if _worker_progress is not None:
+        lock, connection = _worker_progress
+        with lock:
+            connection.send((task, os.getpid() if running else None))
+
+
+def _analyze_chunk(
+    task: int,
+    documents: List[Dict[str, Any]],
+    collect_metrics: bool = False,
+    definitions: Optional[Snapshot] = None
+) -> Tuple[List[DocumentResult], Optional[Dict[str, Any]]]:
+    _report(task, True)
+    try:
+        return _analyze(documents, collect_metrics, definitions)
+    finally:
+        _report(task, False)
+
+
+def _analyze(
+    documents: List[Dict[str, Any]],
+    collect_metrics: bool,
+    definitions: Optional[Snapshot]
+) -> Tuple[List[DocumentResult], Optional[Dict[str, Any]]]:
+    if definitions is not None:
+        # The parent reloaded its indicator definitions after this worker
+        # was forked; the next refresh_patterns recompiles with them
+        _worker_analyzer.registry.replace(definitions)
+    # Results are pickled without their text, as bare match offsets; the
+    # parent reattaches them to its own copy of each document
+    if not collect_metrics:
+        return _worker_analyzer.analyze_results(documents), None
+    # Ship this chunk's instrumentation back to the parent process
+    with metrics.capture() as snapshot:
+        results = _worker_analyzer.analyze_results(documents)
+    return results, snapshot
+
+
+def _attach(
+    documents: List[Dict[str, Any]],
+    chunk: List[int],
+    results: List[DocumentResult]
+) -> None:
+    for index, result in zip(chunk, results):
+        result.attach(preprocess(documents[index].get('content', '')))
+
+
+class DocumentTimeout(Exception):
+    """Raised when documents take longer than the per-document timeout"""
+
+    def __init__(self, indices: List[int], timeout: float):
+        self.indices = indices
+        self.timeout = timeout
+        super().__init__(
+            f'Documents {indices} exceeded the {timeout}s per-document timeout'
+        )
+
+
+class _Task:
+    """A dispatched chunk and, once a worker has started it, its deadline"""
+
+    def __init__(self, chunk: List[int], error_callback: Callable[[BaseException], None]):
+        self.chunk = chunk
+        self.error_callback = error_callback
+        self.pid: Optional[int] = None
+        self.deadline: Optional[float] = None
+
+
+class AnalysisPool:
+    """
+    Pre-forked pool of analyzer worker processes
+
+    Workers are forked from the process that owns the analyzer, after it
+    is warmed, so the compiled detectors are shared copy-on-write and stay
+    warm across requests. Small documents are batched into chunks of up to
+    `chunk_chars` characters (and `chunk_docs` documents) to amortize IPC,
+    and results always come back in input order.
+
+    With a timeout, a watchdog thread gives each chunk timeout seconds per
+    document from the moment a worker starts it, so time spent queued
+    behind other requests does not count. A chunk past its deadline fails
+    with DocumentTimeout and only the worker running it is killed; the
+    pool forks a replacement and every other chunk carries on.
+    """
+
+    def __init__(
+        self,
+        analyzer,
+        workers: Optional[int] = None,
+        timeout: Optional[float] = None,
+        chunk_chars: int = DEFAULT_CHUNK_CHARS,
+        chunk_docs: int = 32
+    ):
+        self.analyzer = analyzer
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.chunk_chars = chunk_chars
+        self.chunk_docs = chunk_docs
+        self._pool = None
+        self._forked_version = None
+        # Chunks dispatched and not yet finished, by task number
+        self._tasks: Dict[int, _Task] = {}
+        self._tasks_changed = threading.Condition()
+        self._task_numbers = itertools.count()
+        self._progress = None
+        self._closed = threading.Event()
+        self._watchdog = None
+        self._start()
+
+    def _start(self) -> None:
+        registry = self.analyzer.registry
+        self._forked_version = registry.version if registry is not None else None
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        progress = None
+        if self.timeout:
+            self._progress, writer = context.Pipe(duplex=False)
+            progress = (context.Lock(), writer)
+        # Workers fork with the compiled patterns and models already built
+        self.analyzer.warm()
+        with frozen():
+            self._pool = context.Pool(
+                self.workers,
+                initializer=_init_worker,
+                initargs=(self.analyzer, progress)
+            )
+        if self.timeout:
+            self._watchdog = threading.Thread(
+                target=self._watch, name='analysis-pool-watchdog', daemon=True
+            )
+            self._watchdog.start()
+
+    def _watch(self) -> None:
+        """Time chunks from when a worker starts them; kill workers that overrun"""
+        while not self._closed.is_set():
+            wait = WATCHDOG_INTERVAL
+            try:
+                while self._progress.poll(wait):
+                    task_number, pid = self._progress.recv()
+                    self._track(task_number, pid)
+                    wait = 0
+            except (EOFError, OSError):
+                return
+
+            now = time.monotonic()
+            with self._tasks_changed:
+                expired = [
+                    task_number for task_number, task in self._tasks.items()
+                    if task.deadline is not None and task.deadline <= now
+                ]
+                expired = [self._tasks.pop(task_number) for task_number in expired]
+                if expired:
+                    self._tasks_changed.notify_all()
+            for task in expired:
+                # The pool replaces the worker; the chunk's result never arrives
+                try:
+                    os.kill(task.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                task.error_callback(DocumentTimeout(sorted(task.chunk), self.timeout))
+
+    def _track(self, task_number: int, pid: Optional[int]) -> None:
+        """Start a chunk's deadline when its worker starts it, clear it when done"""
+        with self._tasks_changed:
+            task = self._tasks.get(task_number)
+            if task is None:
+                return
+            task.pid = pid
+            if pid is None:
+                task.deadline = None
+            else:
+                task.deadline = time.monotonic() + self.timeout * len(task.chunk)
+
+    def _dispatch(
+        self,
+        documents: List[Dict[str, Any]],
+        chunk: List[int],
+        collect_metrics: bool,
+        definitions: Optional[Snapshot],
+        callback: Callable[[Any], None],
+        error_callback: Callable[[BaseException], None]
+    ) -> None:
+        """Send one chunk to the pool; exactly one of the callbacks is called"""
+        task_number = next(self._task_numbers)
+        with self._tasks_changed:
+            self._tasks[task_number] = _Task(chunk, error_callback)
+
+        def finished(output) -> None:
+            if self._finish(task_number):
+                callback(output)
+
+        def failed(error: BaseException) -> None:
+            if self._finish(task_number):
+                error_callback(error)
+
+        self._pool.apply_async(
+            _analyze_chunk,
+            (task_number, [documents[i] for i in chunk], collect_metrics, definitions),
+            callback=finished,
+            error_callback=failed
+        )
+
+    def _finish(self, task_number: int) -> bool:
+        """False if the chunk already finished, e.g. timed out by the watchdog"""
+        with self._tasks_changed:
+            self._tasks_changed.notify_all()
+            return self._tasks.pop(task_number, None) is not None
+
+    def _definitions(self) -> Optional[Snapshot]:
+        """Indicator definitions the workers were not forked with, if any"""
+        registry = self.analyzer.registry
+        if registry is None or registry.version == self._forked_version:
+            return None
+        return registry.snapshot()
+
+    def _chunks(self, documents: List[Dict[str, str]]) -> List[List[int]]:
+        """Group document indices into dispatch chunks"""
+        chunks = []
+        current: List[int] = []
+        current_chars = 0
+
+        for index, doc in enumerate(documents):
+            size = len(doc.get('content', ''))
+            if current and (
+                current_chars + size > self.chunk_chars
+                or len(current) >= self.chunk_docs
+            ):
+                chunks.append(current)
+                current, current_chars = [], 0
+            current.append(index)
+            current_chars += size
+
+        if current:
+            chunks.append(current)
+
+        # Dispatch the largest chunks first so stragglers start early
+        chunks.sort(
+            key=lambda chunk: -sum(len(documents[i].get('content', '')) for i in chunk)
+        )
+        return chunks
+
+    def analyze_documents(self, documents: List[Dict[str, str]]) -> List[DocumentResult]:
+        """
+        Analyze documents in parallel
+
+        Returns one compact DocumentResult per document, in input order.
+        Documents carrying a 'previous' result are brought up to date as by
+        reanalyze_document instead.
+        Raises DocumentTimeout if a chunk runs longer than the per-document
+        timeout times its number of documents; chunks still running for
+        this call finish in the background and their results are dropped.
+        """
+        chunks = self._chunks(documents)
+        collect = metrics.recording()
+        definitions = self._definitions()
+        finished: 'queue.Queue' = queue.Queue()
+        for chunk in chunks:
+            self._dispatch(
+                documents, chunk, collect, definitions,
+                lambda output, chunk=chunk: finished.put((chunk, output, None)),
+                lambda error: finished.put((None, None, error))
+            )
+
+        results: List[Optional[DocumentResult]] = [None] * len(documents)
+        for _ in chunks:
+            chunk, output, error = finished.get()
+            if error is not None:
+                raise error
+            chunk_results, snapshot = output
+            metrics.merge(snapshot)
+            _attach(documents, chunk, chunk_results)
+            for index, result in zip(chunk, chunk_results):
+                results[index] = result
+
+        return results
+
+    def submit(
+        self,
+        documents: List[Dict[str, Any]],
+        callback: Callable[[List[int], List[DocumentResult]], None],
+        error_callback: Callable[[BaseException], None]
+    ) -> int:
+        """
+        Dispatch documents without waiting for them
+
+        callback(indices, results) is called from the pool's result thread
+        as each chunk finishes, with the chunk's input indices. A chunk that
+        fails, or times out, calls error_callback(error) instead, possibly
+        from the watchdog thread. Returns the number of chunks dispatched.
+        """
+        def on_result(chunk: List[int], output) -> None:
+            results, snapshot = output
+            metrics.merge(snapshot)
+            _attach(documents, chunk, results)
+            callback(chunk, results)
+
+        chunks = self._chunks(documents)
+        collect = metrics.enabled()
+        definitions = self._definitions()
+        for chunk in chunks:
+            self._dispatch(
+                documents, chunk, collect, definitions,
+                lambda output, chunk=chunk: on_result(chunk, output),
+                error_callback
+            )
+        return len(chunks)
+
+    def close(self) -> None:
+        """Finish every chunk dispatched, then stop the workers"""
+        self._pool.close()
+        # A chunk whose worker was killed never finishes in the pool's
+        # eyes, so wait on the chunks themselves rather than pool.join()
+        with self._tasks_changed:
+            self._tasks_changed.wait_for(lambda: not self._tasks)
+        self.terminate()
+
+    def terminate(self) -> None:
+        """Stop all workers immediately"""
+        self._pool.terminate()
+        self._pool.join()
+        self._stop_watchdog()
+
+    def _stop_watchdog(self) -> None:
+        self._closed.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+
+    def __enter__(self) -> 'AnalysisPool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,487 @@
+"""
+Batch re-analysis of the documents table
+
+Streams documents.content_text in batches, analyzes them (in parallel
+with --workers), bulk-writes case_indicators and evidence citations and
+marks each batch processed. Progress is checkpointed after every batch so
+an interrupted run resumes where it stopped.
+
+Each document's result is stored with the per-category fingerprints of
+the patterns that produced it. With --incremental, only the categories
+whose patterns changed since then are rescanned, and documents with no
+stale categories are skipped entirely.
+
+With --search-index, each batch is also added to the positional search
+index (see search_index.py), replacing earlier copies of its documents.
+With --entity-index, the people and agencies each document names are
+recorded in the cross-case entity index (see entity_index.py), and the
+Repeat Actor indicator of every case whose recurring people changed,
+earlier cases included, is written to case_indicators.
+
+Usage:
+    python reanalyze.py --database sqlite:///../database/wrongful_conviction.db
+    python reanalyze.py --database postgresql://localhost/wrongful_conviction_db \\
+        --all --workers 8 --checkpoint reanalyze.checkpoint.json
+    python reanalyze.py --incremental --workers 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List, Dict, Iterable, Tuple, Optional
+
+from analyzer import WrongfulConvictionAnalyzer
+from db import Database, connect
+from linguistics import LinguisticFilter
+from detectors import BUILTIN_PATH, DocumentResult, PATTERN_MODES, SCOPES
+from duplicates import NearDuplicateIndex
+from entity_index import INDICATOR_NAME, EntityIndex
+from pool import AnalysisPool
+from registry import IndicatorRegistry
+from search_index import SearchIndex
+
+# Citation fields written when the citations table has the column
+CITATION_FIELDS = ('page_number', 'line_number', 'context_before', 'context_after')
+
+
+class Checkpoint:
+    """Last committed document id and running totals, saved atomically"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.last_id = 0
+        self.documents = 0
+        self.characters = 0
+        if path and os.path.exists(path):
+            with open(path) as handle:
+                state = json.load(handle)
+            self.last_id = state['last_id']
+            self.documents = state['documents']
+            self.characters = state['characters']
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as handle:
+            json.dump({
+                'last_id': self.last_id,
+                'documents': self.documents,
+                'characters': self.characters
+            }, handle)
+        os.replace(temp_path, self.path)
+
+    def clear(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ResultWriter:
+    """
+    Bulk-writes analysis results for a batch of documents
+
+    The case indicators of every case a batch touches are rebuilt from the
+    stored results of all its documents, so a confidence can go down and an
+    indicator the patterns no longer detect is removed. Only indicators in
+    indicator_names (those the detectors report) are ever removed; others,
+    such as indicators added by hand, are left alone.
+    """
+
+    def __init__(self, db: Database, indicator_names: Iterable[str] = ()):
+        self.db = db
+        self.indicator_ids = dict(
+            (name, indicator_id)
+            for indicator_id, name in db.query('SELECT id, name FROM indicators')
+        )
+
+        # The SQLite schema names the citations table differently
+        self.citations_table = 'evidence_citations'
+        if db.dialect == 'sqlite' and not db.table_exists('evidence_citations'):
+            self.citations_table = 'case_indicator_citations'
+        self.citation_columns = db.columns(self.citations_table)
+        self.stores_results = 'analysis_result' in db.columns('documents')
+        self.detected_ids = sorted(
+            self.indicator_ids[name] for name in indicator_names if name in self.indicator_ids
+        )
+
+        if db.dialect == 'sqlite':
+            # Upserts need the uniqueness PostgreSQL declares on the table
+            db.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS idx_case_indicators_unique '
+                'ON case_indicators(case_id, indicator_id)'
+            )
+
+    def write(self, documents: List[Tuple], results: List[DocumentResult]) -> None:
+        # Case-level confidence is the strongest document-level detection,
+        # which keeps re-runs and resumed runs idempotent
+        confidences: Dict[Tuple[int, int], float] = {}
+        citations = []
+        for (document_id, case_id, document_type, _), result in zip(documents, results):
+            for indicator in result.indicators:
+                indicator_id = self.indicator_ids.get(indicator.indicator_name)
+                if indicator_id is None:
+                    continue
+                key = (case_id, indicator_id)
+                confidences[key] = max(confidences.get(key, 0), indicator.confidence)
+                for citation in indicator.citations():
+                    citations.append((key, document_type, str(document_id), citation))
+
+        if self.stores_results:
+            case_ids = sorted({case_id for _, case_id, _, _ in documents if case_id is not None})
+            self._add_stored(case_ids, [document[0] for document in documents], confidences)
+            self._replace_case_indicators(case_ids, confidences)
+        else:
+            # Without stored results the other documents of a case are
+            # unknown, so a case indicator can only be raised
+            greatest = 'GREATEST' if self.db.dialect == 'postgresql' else 'MAX'
+            self.db.insert_many(
+                'INSERT INTO case_indicators (case_id, indicator_id, confidence_score) '
+                'VALUES (?, ?, ?) '
+                'ON CONFLICT (case_id, indicator_id) DO UPDATE SET '
+                f'confidence_score = {greatest}(case_indicators.confidence_score, '
+                'excluded.confidence_score), detected_at = CURRENT_TIMESTAMP',
+                [(case_id, indicator_id, confidence)
+                 for (case_id, indicator_id), confidence in confidences.items()]
+            )
+
+        self._write_citations(documents, citations)
+
+        document_ids = [document[0] for document in documents]
+        self.db.execute(
+            'UPDATE documents SET processed = TRUE, processed_at = CURRENT_TIMESTAMP '
+            f'WHERE id IN ({self.db.in_clause(document_ids)})',
+            document_ids
+        )
+        if self.stores_results:
+            self.db.update_many(
+                'UPDATE documents SET analysis_result = ? WHERE id = ?',
+                [(json.dumps(result.to_dict(fingerprints=True)), document[0])
+                 for document, result in zip(documents, results)]
+            )
+
+    def _add_stored(
+        self,
+        case_ids: List[int],
+        document_ids: List[int],
+        confidences: Dict[Tuple[int, int], float]
+    ) -> None:
+        """Fold in the stored results of the cases' documents outside the batch"""
+        if not case_ids:
+            return
+        batch = set(document_ids)
+        for document_id, case_id, stored in self.db.query(
+            'SELECT id, case_id, analysis_result FROM documents '
+            f'WHERE case_id IN ({self.db.in_clause(case_ids)}) AND analysis_result IS NOT NULL',
+            case_ids
+        ):
+            if document_id in batch:
+                continue
+            if isinstance(stored, str):
+                stored = json.loads(stored)
+            for indicator in stored.get('indicators', []):
+                indicator_id = self.indicator_ids.get(indicator['indicator_name'])
+                if indicator_id is None:
+                    continue
+                key = (case_id, indicator_id)
+                confidences[key] = max(confidences.get(key, 0), indicator['confidence'])
+
+    def _replace_case_indicators(
+        self,
+        case_ids: List[int],
+        confidences: Dict[Tuple[int, int], float]
+    ) -> None:
+        """Make the cases' detected indicators exactly those in confidences"""
+        if case_ids and self.detected_ids:
+            vanished = [
+                row_id for row_id, case_id, indicator_id in self.db.query(
+                    'SELECT id, case_id, indicator_id FROM case_indicators '
+                    f'WHERE case_id IN ({self.db.in_clause(case_ids)}) '
+                    f'AND indicator_id IN ({self.db.in_clause(self.detected_ids)})',
+                    case_ids + self.detected_ids
+                )
+                if (case_id, indicator_id) not in confidences
+            ]
+            if vanished:
+                # SQLite only cascades with foreign keys enabled
+                self.db.execute(
+                    f'DELETE FROM {self.citations_table} '
+                    f'WHERE case_indicator_id IN ({self.db.in_clause(vanished)})',
+                    vanished
+                )
+                self.db.execute(
+                    f'DELETE FROM case_indicators WHERE id IN ({self.db.in_clause(vanished)})',
+                    vanished
+                )
+        self.db.insert_many(
+            'INSERT INTO case_indicators (case_id, indicator_id, confidence_score) '
+            'VALUES (?, ?, ?) '
+            'ON CONFLICT (case_id, indicator_id) DO UPDATE SET '
+            'confidence_score = excluded.confidence_score, detected_at = CURRENT_TIMESTAMP',
+            [(case_id, indicator_id, confidence)
+             for (case_id, indicator_id), confidence in confidences.items()]
+        )
+
+    def write_case_indicators(self, name: str, indicators: Dict[int, Optional[Dict]]) -> None:
+        """
+        Store an indicator worked out per case rather than per document
+        (Repeat Actor), replacing its earlier confidence; cases mapped to
+        None lose the indicator
+        """
+        indicator_id = self.indicator_ids.get(name)
+        if indicator_id is None:
+            return
+        cleared = [case_id for case_id, indicator in indicators.items() if indicator is None]
+        if cleared:
+            self.db.execute(
+                'DELETE FROM case_indicators WHERE indicator_id = ? '
+                f'AND case_id IN ({self.db.in_clause(cleared)})',
+                [indicator_id] + cleared
+            )
+        self.db.insert_many(
+            'INSERT INTO case_indicators (case_id, indicator_id, confidence_score) '
+            'VALUES (?, ?, ?) '
+            'ON CONFLICT (case_id, indicator_id) DO UPDATE SET '
+            'confidence_score = excluded.confidence_score, detected_at = CURRENT_TIMESTAMP',
+            [(case_id, indicator_id, indicator['confidence'])
+             for case_id, indicator in indicators.items() if indicator is not None]
+        )
+
+    def _write_citations(self, documents: List[Tuple], citations: List[Tuple]) -> None:
+        has_document_id = 'document_id' in self.citation_columns
+
+        if has_document_id:
+            # Replace citations from earlier runs over the same documents
+            document_ids = [str(document[0]) for document in documents]
+            self.db.execute(
+                f'DELETE FROM {self.citations_table} '
+                f'WHERE document_id IN ({self.db.in_clause(document_ids)})',
+                document_ids
+            )
+
+        if not citations:
+            return
+
+        case_ids = sorted({key[0] for key, _, _, _ in citations})
+        case_indicator_ids = {
+            (case_id, indicator_id): case_indicator_id
+            for case_indicator_id, case_id, indicator_id in self.db.query(
+                'SELECT id, case_id, indicator_id FROM case_indicators '
+                f'WHERE case_id IN ({self.db.in_clause(case_ids)})',
+                case_ids
+            )
+        }
+
+        columns = ['case_indicator_id', 'document_type', 'quoted_text']
+        if has_document_id:
+            columns.append('document_id')
+        located = [
+            column for column in CITATION_FIELDS if column in self.citation_columns
+        ]
+        columns += located
+        rows = []
+        for key, document_type, document_id, citation in citations:
+            row = [case_indicator_ids[key], document_type, citation.quoted_text]
+            if has_document_id:
+                row.append(document_id)
+            if located:
+                # Page and line are only worked out when they are stored
+                fields = citation.to_dict()
+                row += [fields.get(column) for column in located]
+            rows.append(row)
+
+        self.db.insert_many(
+            f'INSERT INTO {self.citations_table} ({", ".join(columns)}) '
+            f'VALUES ({", ".join("?" for _ in columns)})',
+            rows
+        )
+
+
+def reanalyze(
+    db: Database,
+    analyzer: WrongfulConvictionAnalyzer,
+    pool: Optional[AnalysisPool],
+    checkpoint: Checkpoint,
+    process_all: bool,
+    batch_size: int,
+    incremental: bool = False,
+    search_index: Optional[SearchIndex] = None,
+    entity_index: Optional[EntityIndex] = None
+) -> None:
+    writer = ResultWriter(db, analyzer.indicator_names())
+    if entity_index is not None and INDICATOR_NAME not in writer.indicator_ids:
+        print(f'No "{INDICATOR_NAME}" row in indicators; Repeat Actor results are not stored',
+              file=sys.stderr)
+    where = 'id > ?' if process_all or incremental else 'id > ? AND processed = FALSE'
+    previous_column = 'analysis_result' if incremental else 'NULL'
+    batches = db.iter_batches(
+        f'SELECT id, case_id, document_type, content_text, {previous_column} '
+        f'FROM documents WHERE {where} ORDER BY id',
+        (checkpoint.last_id,),
+        batch_size
+    )
+
+    started = time.perf_counter()
+    documents_done = 0
+    characters_done = 0
+    skipped = 0
+    relinked = set()
+
+    for rows in batches:
+        batch = []
+        documents = []
+        for document_id, case_id, document_type, content, previous in rows:
+            if isinstance(previous, str):
+                previous = json.loads(previous)
+            if previous and not analyzer.stale_categories(previous):
+                skipped += 1
+                continue
+            batch.append((document_id, case_id, document_type, content))
+            documents.append({
+                'type': document_type,
+                'content': content or '',
+                'previous': previous
+            })
+
+        # Compact results; evidence text is sliced only for the rows written
+        results = analyzer.analyze_results(documents, pool)
+
+        if batch:
+            writer.write(batch, results)
+        if entity_index is not None:
+            changed = set()
+            for (document_id, case_id, _, _), doc in zip(batch, documents):
+                changed |= entity_index.add_document(case_id, str(document_id), doc['content'])
+            # Cases whose people now recur elsewhere, including earlier ones
+            writer.write_case_indicators(
+                INDICATOR_NAME, {case_id: entity_index.indicator(case_id) for case_id in changed}
+            )
+            relinked |= changed
+        db.commit()
+        if search_index is not None and batch:
+            for (document_id, case_id, document_type, _), doc, result in zip(
+                batch, documents, results
+            ):
+                search_index.add(document_id, case_id, document_type, doc['content'], result)
+            search_index.commit()
+            search_index.merge()
+
+        batch_characters = sum(len(doc['content']) for doc in documents)
+        documents_done += len(batch)
+        characters_done += batch_characters
+        checkpoint.last_id = rows[-1][0]
+        checkpoint.documents += len(batch)
+        checkpoint.characters += batch_characters
+        checkpoint.save()
+
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        print(
+            f'{checkpoint.documents} documents (last id {checkpoint.last_id}): '
+            f'{documents_done / elapsed:.1f} docs/sec, '
+            f'{characters_done / elapsed / 1e6:.2f} MB/sec',
+            file=sys.stderr
+        )
+
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    print(
+        f'Done: {documents_done} documents, {characters_done / 1e6:.1f} MB in '
+        f'{elapsed:.1f}s ({documents_done / elapsed:.1f} docs/sec, '
+        f'{characters_done / elapsed / 1e6:.2f} MB/sec)'
+        + (f', {skipped} already up to date' if incremental else '')
+        + (f', repeat actors changed in {len(relinked)} cases' if entity_index else ''),
+        file=sys.stderr
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--database', default=os.getenv('DATABASE_URL'),
+                        help='postgresql://... URL or SQLite path (default $DATABASE_URL)')
+    parser.add_argument('--all', action='store_true',
+                        help='re-analyze the whole corpus, not only unprocessed documents')
+    parser.add_argument('--incremental', action='store_true',
+                        help='rescan only categories whose patterns changed since '
+                             'each stored result')
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('BATCH_SIZE', 32)) * 16)
+    parser.add_argument('--workers', type=int, default=int(os.getenv('MAX_WORKERS', 1)))
+    parser.add_argument('--checkpoint', help='checkpoint file for resumable runs')
+    parser.add_argument('--pattern-mode', choices=PATTERN_MODES,
+                        default=os.getenv('PATTERN_MODE', 'proximity'))
+    parser.add_argument('--proximity-tokens', type=int,
+                        default=int(os.getenv('PROXIMITY_TOKENS', 10)))
+    parser.add_argument('--pattern-scope', choices=SCOPES,
+                        default=os.getenv('PATTERN_SCOPE', 'document'))
+    parser.add_argument('--linguistic-filter', action='store_true',
+                        default=os.getenv('LINGUISTIC_FILTER', '').lower() in ('1', 'true', 'yes'),
+                        help='drop negated or unrelated matches with spaCy')
+    parser.add_argument('--definitions',
+                        default=os.getenv('INDICATOR_DEFINITIONS') or BUILTIN_PATH,
+                        help='indicator definitions file (default the built-in one)')
+    parser.add_argument('--indicators-from-db', action='store_true',
+                        default=os.getenv('INDICATORS_FROM_DATABASE', '').lower()
+                        in ('1', 'true', 'yes'),
+                        help='also use indicators rows that have a detection_pattern')
+    parser.add_argument('--near-duplicate-mb', type=int,
+                        default=int(os.getenv('NEAR_DUPLICATE_MB', 64)),
+                        help='recent documents kept per process for reusing the matches of '
+                             'duplicates (0 disables)')
+    parser.add_argument('--search-index', default=os.getenv('SEARCH_INDEX'),
+                        help='also add the documents to this search index directory')
+    parser.add_argument('--entity-index', default=os.getenv('ENTITY_INDEX'),
+                        help='also record the people and agencies named in this entity '
+                             'index file')
+    parser.add_argument('--spacy-model', default=os.getenv('SPACY_MODEL', 'en_core_web_sm'))
+    parser.add_argument('--spacy-processes', type=int,
+                        default=int(os.getenv('LINGUISTIC_PROCESSES', 1)),
+                        help='nlp.pipe processes (without --workers)')
+    args = parser.parse_args()
+
+    if not args.database:
+        parser.error('--database or DATABASE_URL is required')
+
+    db = connect(args.database)
+    if args.incremental and 'analysis_result' not in db.columns('documents'):
+        parser.error('--incremental needs the documents.analysis_result column')
+    analyzer = WrongfulConvictionAnalyzer(
+        pattern_mode=args.pattern_mode,
+        proximity_tokens=args.proximity_tokens,
+        pattern_scope=args.pattern_scope,
+        linguistic_filter=LinguisticFilter(
+            model=args.spacy_model,
+            # Worker processes already parallelize parsing
+            n_process=args.spacy_processes if args.workers <= 1 else 1
+        ) if args.linguistic_filter else None,
+        registry=IndicatorRegistry(
+            args.definitions,
+            database_url=args.database if args.indicators_from_db else None,
+            poll_interval=0
+        ),
+        near_duplicates=NearDuplicateIndex(
+            threshold=float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.8)),
+            max_chars=args.near_duplicate_mb * 1024 * 1024
+        ) if args.near_duplicate_mb > 0 else None
+    )
+    if analyzer.linguistics is not None:
+        analyzer.linguistics.load()
+    checkpoint = Checkpoint(args.checkpoint)
+    if checkpoint.last_id:
+        print(f'Resuming after document {checkpoint.last_id}', file=sys.stderr)
+
+    pool = AnalysisPool(analyzer, workers=args.workers) if args.workers > 1 else None
+    try:
+        reanalyze(
+            db, analyzer, pool, checkpoint, args.all, args.batch_size, args.incremental,
+            SearchIndex(args.search_index) if args.search_index else None,
+            EntityIndex(args.entity_index) if args.entity_index else None
+        )
+    finally:
+        if pool is not None:
+            pool.close()
+        db.close()
+
+    checkpoint.clear()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+Indicator registry: the current indicator definitions, reloaded when their
+sources change
+
+Definitions come from a versioned JSON file (the built-in
+detectors/indicators.json unless another is given) and, optionally, from
+indicators rows whose detection_pattern column is set. A row naming an
+indicator already in the file replaces its patterns; any other row adds a
+new indicator, so indicators can be added without a code change or a
+redeploy. detection_pattern holds one of
+
+- a JSON object: {"patterns": [...], "confidence": 0.8, "scope": "sentence",
+  "detector": "informant", "category": "jailhouse_informant"}, where only
+  "patterns" is required,
+- a JSON list of patterns, or
+- a single bare pattern.
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import List, Dict, Any, Tuple, Optional
+
+from db import connect
+from detectors import (
+    BUILTIN_PATH,
+    PatternEngine,
+    build_detectors,
+    load_definitions,
+    validate_definitions,
+)
+
+logger = logging.getLogger(__name__)
+
+# Base confidence of indicators added in the database without one
+DEFAULT_CONFIDENCE = 0.75
+
+# Detector grouping database-defined indicators that name none
+DATABASE_DETECTOR = 'registry'
+
+Snapshot = Tuple[str, Dict[str, Any]]
+
+
+class IndicatorRegistry:
+    """
+    Indicator definitions, replaced as a whole when a source changes
+
+    Sources are checked at most every poll_interval seconds (never when it
+    is 0), so between checks poll() costs a clock read. New definitions are
+    validated completely, and compiled into a candidate engine, before they
+    replace the current ones; definitions that fail are logged and the
+    previous ones stay in use.
+    """
+
+    def __init__(
+        self,
+        path: str = BUILTIN_PATH,
+        database_url: Optional[str] = None,
+        poll_interval: float = 10.0
+    ):
+        self.path = path
+        self.database_url = database_url
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._checked = time.monotonic()
+        self._file_stat: Optional[Tuple[int, int]] = None
+        self._file_definitions: Dict[str, Any] = {}
+        # Version and definitions, swapped in one assignment
+        self._current: Snapshot = self._load()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        return self._current[0]
+
+    @property
+    def definitions(self) -> Dict[str, Any]:
+        return self._current[1]
+
+    def snapshot(self) -> Snapshot:
+        """Version and definitions, consistent with each other"""
+        return self._current
+
+    def poll(self) -> bool:
+        """Reload if the check interval has passed; True when definitions changed"""
+        if not self.poll_interval or time.monotonic() - self._checked < self.poll_interval:
+            return False
+        # One thread checks while the others carry on with the current definitions
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._checked = time.monotonic()
+            return self.reload()
+        finally:
+            self._lock.release()
+
+    def reload(self) -> bool:
+        """Re-read the sources now; True when definitions changed"""
+        try:
+            snapshot = self._load()
+        except (OSError, ValueError, RuntimeError) as error:
+            logger.error('Keeping indicator definitions %s: %s', self.version, error)
+            return False
+        if snapshot[0] == self.version:
+            return False
+        logger.info('Indicator definitions changed: %s -> %s', self.version, snapshot[0])
+        self._current = snapshot
+        return True
+
+    def replace(self, snapshot: Snapshot) -> None:
+        """Adopt definitions loaded elsewhere, e.g. by the parent of a worker"""
+        if snapshot[0] != self.version:
+            self._current = snapshot
+
+    def _load(self) -> Snapshot:
+        definitions = copy.deepcopy(self._read_file())
+        if self.database_url:
+            apply_database_rows(definitions, self._database_rows())
+        validate_definitions(definitions)
+        try:
+            PatternEngine(build_detectors(definitions))
+        except re.error as error:
+            raise ValueError(f'Indicator patterns do not compile: {error}')
+        encoded = json.dumps(definitions, sort_keys=True).encode()
+        return hashlib.sha256(encoded).hexdigest()[:16], definitions
+
+    def _read_file(self) -> Dict[str, Any]:
+        """The file's definitions, parsed again only when it changed"""
+        stat = os.stat(self.path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key != self._file_stat:
+            self._file_definitions = load_definitions(self.path)
+            self._file_stat = key
+        return self._file_definitions
+
+    def _database_rows(self) -> List[Tuple[str, str]]:
+        db = connect(self.database_url)
+        try:
+            return db.query(
+                'SELECT name, detection_pattern FROM indicators '
+                'WHERE detection_pattern IS NOT NULL ORDER BY id'
+            )
+        finally:
+            db.close()
+
+
+def parse_detection_pattern(value: str) -> Optional[Dict[str, Any]]:
+    """An indicators.detection_pattern value as a partial category definition"""
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return {'patterns': [value]}
+    if isinstance(parsed, list):
+        return {'patterns': parsed}
+    if isinstance(parsed, dict):
+        if 'patterns' not in parsed:
+            raise ValueError(f'detection_pattern object without "patterns": {value}')
+        return dict(parsed)
+    return {'patterns': [value]}
+
+
+def apply_database_rows(definitions: Dict[str, Any], rows: List[Tuple[str, str]]) -> None:
+    """Overlay (indicator name, detection_pattern) rows onto definitions"""
+    detectors = definitions.setdefault('detectors', {})
+    by_name = {
+        spec['indicator']: spec
+        for detector in detectors.values()
+        for spec in detector.get('categories', {}).values()
+    }
+    for name, value in rows:
+        spec = parse_detection_pattern(value)
+        if spec is None:
+            continue
+        detector_name = spec.pop('detector', DATABASE_DETECTOR)
+        category = spec.pop('category', re.sub(r'\W+', '_', name.lower()).strip('_'))
+
+        existing = by_name.get(name)
+        if existing is not None:
+            existing.update(spec)
+            continue
+        spec['indicator'] = name
+        spec.setdefault('confidence', DEFAULT_CONFIDENCE)
+        categories = detectors.setdefault(detector_name, {'categories': {}})['categories']
+        categories[category] = spec
+        by_name[name] = spec
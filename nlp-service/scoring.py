@@ -0,0 +1,304 @@
+"""
+Vectorized priority scoring of every case in the corpus
+
+Case indicators are loaded once into a cases x indicators confidence
+matrix and all priority scores are computed in a single NumPy pass,
+following the backend's RankingService formula:
+
+    base  = sum(weight * category weight * severity multiplier * confidence)
+    score = min(100, base * count multiplier * combination bonus * critical bonus)
+
+Weights live in a separate vector, so after a change to indicators.weight
+or indicator_categories.weight the whole corpus is re-ranked by
+recomputing that vector and one matrix-vector product, without reloading
+case_indicators.
+
+Usage:
+    python scoring.py --database sqlite:///../database/wrongful_conviction.db
+    python scoring.py --dry-run --top 20
+"""
+import argparse
+import os
+import sys
+import time
+from typing import List, Dict, Any, Callable, Tuple, Sequence, Iterable
+
+import numpy as np
+
+from db import Database, connect
+
+SEVERITY_MULTIPLIERS = {
+    'low': 1.0,
+    'medium': 1.5,
+    'high': 2.0,
+    'critical': 3.0,
+}
+
+# Bonus for specific high-value indicator combinations; the largest
+# bonus a case qualifies for applies
+INDICATOR_COMBINATIONS = (
+    (('DNA Not Tested', 'Brady Violations'), 1.5),
+    (('Witness Recantation', 'Weak Prosecution Evidence'), 1.3),
+    (('Multiple Appeals', 'New Exculpatory Evidence'), 1.4),
+)
+
+# More indicators = higher confidence, up to doubling the score
+COUNT_STEP = 0.1
+MAX_COUNT_BONUS = 1.0
+
+CRITICAL_BONUS = 1.2
+MAX_SCORE = 100.0
+
+# Order-independent ways to combine one indicator's confidences across
+# the documents of a case
+AGGREGATES = ('max', 'mean', 'noisy_or')
+
+
+class IndicatorTable:
+    """Indicator weights, category weights and severities as column vectors"""
+
+    def __init__(self, rows: Sequence[Tuple[int, str, str, float, float]]):
+        """rows: (indicator id, name, severity, weight, category weight)"""
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.names = [row[1] for row in rows]
+        self.severities = [row[2] for row in rows]
+        self.weights = np.array([row[3] for row in rows], dtype=np.float64)
+        self.category_weights = np.array([row[4] for row in rows], dtype=np.float64)
+        self.columns = {int(indicator_id): column for column, indicator_id in enumerate(self.ids)}
+        self.name_columns = {name: column for column, name in enumerate(self.names)}
+
+    @classmethod
+    def from_db(cls, db: Database) -> 'IndicatorTable':
+        rows = db.query(
+            'SELECT i.id, i.name, i.severity, i.weight, COALESCE(c.weight, 1.0) '
+            'FROM indicators i LEFT JOIN indicator_categories c ON c.id = i.category_id '
+            'ORDER BY i.id'
+        )
+        return cls([(row[0], row[1], row[2], float(row[3]), float(row[4])) for row in rows])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def severity_multipliers(self) -> np.ndarray:
+        return np.array([SEVERITY_MULTIPLIERS.get(severity, 1.0) for severity in self.severities])
+
+    @property
+    def critical(self) -> np.ndarray:
+        return np.array([severity == 'critical' for severity in self.severities], dtype=bool)
+
+    def factors(self) -> np.ndarray:
+        """Per-indicator multiplier of its confidence in the base score"""
+        return self.weights * self.category_weights * self.severity_multipliers
+
+    def set_weight(self, name: str, weight: float) -> None:
+        self.weights[self.name_columns[name]] = weight
+
+    def set_category_weight(self, indicator_names: Iterable[str], weight: float) -> None:
+        for name in indicator_names:
+            self.category_weights[self.name_columns[name]] = weight
+
+    def combinations(self) -> List[Tuple[np.ndarray, float]]:
+        """Columns and bonus of each combination whose indicators all exist"""
+        found = []
+        for names, bonus in INDICATOR_COMBINATIONS:
+            if all(name in self.name_columns for name in names):
+                found.append((np.array([self.name_columns[name] for name in names]), bonus))
+        return found
+
+
+class CaseMatrix:
+    """
+    Confidence of every indicator in every case
+
+    confidences[i, j] is case case_ids[i]'s confidence for indicator
+    column j of the IndicatorTable; present marks the pairs that were
+    detected at all, so a stored confidence of 0 still counts.
+    """
+
+    def __init__(self, case_ids: np.ndarray, confidences: np.ndarray, present: np.ndarray):
+        self.case_ids = case_ids
+        self.confidences = confidences
+        self.present = present
+
+    @classmethod
+    def from_pairs(
+        cls,
+        case_ids: Sequence[int],
+        columns: Sequence[int],
+        confidences: Sequence[float],
+        width: int,
+        aggregate: str = 'max'
+    ) -> 'CaseMatrix':
+        """
+        Build the matrix from (case, column, confidence) triples, combining
+        repeated pairs with an order-independent aggregate
+        """
+        if aggregate not in AGGREGATES:
+            raise ValueError(f'Unknown aggregate {aggregate!r}; expected one of {AGGREGATES}')
+        cases, rows = np.unique(np.asarray(case_ids, dtype=np.int64), return_inverse=True)
+        columns = np.asarray(columns, dtype=np.int64)
+        values = np.asarray(confidences, dtype=np.float64)
+        shape = (len(cases), width)
+
+        present = np.zeros(shape, dtype=bool)
+        present[rows, columns] = True
+        if aggregate == 'max':
+            matrix = np.zeros(shape)
+            np.maximum.at(matrix, (rows, columns), values)
+        elif aggregate == 'mean':
+            totals = np.zeros(shape)
+            counts = np.zeros(shape)
+            np.add.at(totals, (rows, columns), values)
+            np.add.at(counts, (rows, columns), 1)
+            matrix = np.divide(totals, counts, out=np.zeros(shape), where=counts > 0)
+        else:
+            # Probability that at least one document's detection holds
+            misses = np.zeros(shape)
+            np.add.at(misses, (rows, columns), np.log1p(-np.clip(values, 0.0, 1.0 - 1e-12)))
+            matrix = 1.0 - np.exp(misses)
+        return cls(cases, matrix, present)
+
+    @classmethod
+    def from_db(cls, db: Database, table: IndicatorTable) -> 'CaseMatrix':
+        rows = db.query('SELECT case_id, indicator_id, confidence_score FROM case_indicators')
+        rows = [row for row in rows if row[1] in table.columns]
+        return cls.from_pairs(
+            [row[0] for row in rows],
+            [table.columns[row[1]] for row in rows],
+            [float(row[2]) if row[2] is not None else 0.0 for row in rows],
+            len(table)
+        )
+
+    @classmethod
+    def from_results(
+        cls,
+        results: List[Dict[str, Any]],
+        table: IndicatorTable,
+        aggregate: str = 'max'
+    ) -> 'CaseMatrix':
+        """Build the matrix from analyze_case results"""
+        triples = [
+            (result['case_id'], table.name_columns[indicator['indicator_name']],
+             indicator['confidence'])
+            for result in results
+            for indicator in result.get('indicators', [])
+            if indicator['indicator_name'] in table.name_columns
+        ]
+        return cls.from_pairs(
+            [case_id for case_id, _, _ in triples],
+            [column for _, column, _ in triples],
+            [confidence for _, _, confidence in triples],
+            len(table),
+            aggregate
+        )
+
+
+def priority_scores(matrix: CaseMatrix, table: IndicatorTable) -> np.ndarray:
+    """Priority score (0-100, two decimals) of every case in the matrix"""
+    present = matrix.present
+    base = matrix.confidences @ table.factors()
+
+    count = present.sum(axis=1)
+    count_multiplier = 1.0 + np.minimum(count * COUNT_STEP, MAX_COUNT_BONUS)
+
+    combination_bonus = np.ones(len(base))
+    for columns, bonus in table.combinations():
+        qualifies = present[:, columns].all(axis=1)
+        combination_bonus[qualifies] = np.maximum(combination_bonus[qualifies], bonus)
+
+    critical_bonus = np.where(present[:, table.critical].any(axis=1), CRITICAL_BONUS, 1.0)
+
+    raw = base * count_multiplier * combination_bonus * critical_bonus
+    return np.round(np.minimum(MAX_SCORE, raw), 2)
+
+
+def case_scorer(table: IndicatorTable) -> Callable[[Dict[str, float]], float]:
+    """
+    Priority score of a single case from {indicator name: confidence}, as
+    priority_scores computes it
+
+    Every factor of the formula grows with the indicators present and
+    their confidences, so the score can bound a case's final score from
+    partial results (see WrongfulConvictionAnalyzer.triage).
+    """
+    def score(confidences: Dict[str, float]) -> float:
+        columns = [
+            (table.name_columns[name], confidence)
+            for name, confidence in confidences.items() if name in table.name_columns
+        ]
+        if not columns:
+            return 0.0
+        matrix = CaseMatrix.from_pairs(
+            [0] * len(columns),
+            [column for column, _ in columns],
+            [confidence for _, confidence in columns],
+            len(table)
+        )
+        return float(priority_scores(matrix, table)[0])
+    return score
+
+
+def rank(matrix: CaseMatrix, scores: np.ndarray) -> List[Tuple[int, float]]:
+    """(case id, score) pairs, highest score first"""
+    order = np.argsort(-scores, kind='stable')
+    return list(zip(matrix.case_ids[order].tolist(), scores[order].tolist()))
+
+
+def write_scores(db: Database, matrix: CaseMatrix, scores: np.ndarray) -> int:
+    """Update cases.priority_score where it changed; returns the rows updated"""
+    current = dict(db.query('SELECT id, priority_score FROM cases'))
+    updates = [
+        (score, case_id)
+        for case_id, score in zip(matrix.case_ids.tolist(), scores.tolist())
+        if current.get(case_id) is None or abs(float(current[case_id]) - score) >= 0.005
+    ]
+    # Cases that lost all their indicators drop to zero
+    scored = set(matrix.case_ids.tolist())
+    updates += [
+        (0.0, case_id) for case_id, score in current.items()
+        if case_id not in scored and score
+    ]
+    db.update_many('UPDATE cases SET priority_score = ? WHERE id = ?', updates)
+    db.commit()
+    return len(updates)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--database', default=os.getenv('DATABASE_URL'),
+                        help='postgresql://... URL or SQLite path (default $DATABASE_URL)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='compute scores without writing cases.priority_score')
+    parser.add_argument('--top', type=int, default=0, help='print the N highest-ranked cases')
+    args = parser.parse_args()
+
+    if not args.database:
+        parser.error('--database or DATABASE_URL is required')
+
+    db = connect(args.database)
+    try:
+        started = time.perf_counter()
+        table = IndicatorTable.from_db(db)
+        matrix = CaseMatrix.from_db(db, table)
+        loaded = time.perf_counter()
+        scores = priority_scores(matrix, table)
+        scored = time.perf_counter()
+
+        for case_id, score in rank(matrix, scores)[:args.top]:
+            print(f'{case_id}\t{score:.2f}')
+        updated = 0 if args.dry_run else write_scores(db, matrix, scores)
+    finally:
+        db.close()
+
+    print(
+        f'{len(matrix.case_ids)} cases x {len(table)} indicators: '
+        f'loaded in {loaded - started:.3f}s, scored in {scored - loaded:.3f}s, '
+        f'{updated} priority scores updated',
+        file=sys.stderr
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,664 @@
+"""
+Positional inverted index over analyzed documents and their evidence
+
+Answers queries such as every document where an analyst is named within
+20 words of hair analysis, or where a method is mentioned inside the
+evidence of a Discredited Forensic Methods hit, in milliseconds across
+the corpus. Unlike the Postgres full-text index, it knows the detector
+hits: the words of each evidence span are also indexed under the term
+`indicator:<indicator name>`.
+
+Query syntax (clauses are ANDed):
+
+    smith                         a word
+    "hair analysis"               a phrase
+    indicator:"brady violation"   the words of that indicator's evidence
+    a NEAR/20 b                   matches of a with a match of b at most
+                                  20 words away (before or after)
+
+    python search_index.py --index ./search build --database sqlite:///db
+    python search_index.py --index ./search query '"analyst smith" NEAR/20 "hair analysis"'
+
+The index is a directory of immutable segments named by segments.json.
+Documents are buffered in memory and written as a new segment on commit;
+a document added again replaces its earlier copy, which is marked
+deleted. Segments are merged, dropping deleted documents, once
+merge_factor of them are of a similar size. Writers in several processes
+serialize on a lock file; readers pick up new segments on refresh.
+"""
+import argparse
+import fcntl
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from typing import List, Dict, Any, Tuple, Optional, Iterator, Set
+
+import numpy as np
+
+from detectors import Document, DocumentResult, preprocess, scannable
+from detectors.document import TOKEN
+
+MANIFEST = 'segments.json'
+LOCK_FILE = 'write.lock'
+
+INDICATOR_PREFIX = 'indicator:'
+
+# Buffered tokens that trigger a commit
+FLUSH_TOKENS = 5_000_000
+
+# Segments of about the same size merged at once
+MERGE_FACTOR = 10
+
+# Matches listed per document in search results
+MATCHES_PER_DOCUMENT = 10
+
+# Postings are keyed doc << 32 | position, so documents never run together
+POSITION_BITS = 32
+
+QUERY_TOKEN = re.compile(
+    r'\s*(?:(?P<near>NEAR/(?P<distance>\d+))|(?P<field>indicator:)?'
+    r'(?:"(?P<phrase>[^"]*)"|(?P<word>[^\s"]+)))'
+)
+WORD = re.compile(r"\w+(?:'\w+)*")
+
+# (document numbers, position counts, positions) of one term
+Postings = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class QueryError(ValueError):
+    """Raised for a query that cannot be parsed"""
+
+
+class Segment:
+    """
+    One immutable segment: docs.json, terms.json and postings.bin
+
+    Each term's postings are three int32 runs in postings.bin: the
+    segment's document numbers, the count of positions in each, and the
+    positions themselves.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, 'docs.json')) as handle:
+            self.documents: List[List[Any]] = json.load(handle)
+        with open(os.path.join(path, 'terms.json')) as handle:
+            self.terms: Dict[str, List[int]] = json.load(handle)
+        postings = os.path.join(path, 'postings.bin')
+        self.postings = (
+            np.memmap(postings, dtype='<i4', mode='r') if os.path.getsize(postings)
+            else np.zeros(0, dtype='<i4')
+        )
+        # document_id -> document number, for replacing documents
+        self.ids = {str(document[0]): number for number, document in enumerate(self.documents)}
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def term(self, term: str) -> Optional[Postings]:
+        """(documents, position counts, positions) of a term, or None"""
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        offset, documents, positions = entry
+        postings = self.postings
+        return (
+            postings[offset:offset + documents],
+            postings[offset + documents:offset + 2 * documents],
+            postings[offset + 2 * documents:offset + 2 * documents + positions],
+        )
+
+    def keys(self, term: str) -> np.ndarray:
+        """Sorted doc << 32 | position keys of a term"""
+        found = self.term(term)
+        if found is None:
+            return np.zeros(0, dtype=np.int64)
+        documents, counts, positions = found
+        return (np.repeat(documents.astype(np.int64), counts) << POSITION_BITS) | positions
+
+
+def write_segment(
+    path: str,
+    documents: List[List[Any]],
+    postings: Dict[str, Postings]
+) -> None:
+    """Write a segment from term -> (document numbers ascending, counts, positions)"""
+    os.makedirs(path)
+    terms = {}
+    offset = 0
+    with open(os.path.join(path, 'postings.bin'), 'wb') as output:
+        for term in sorted(postings):
+            numbers, counts, positions = postings[term]
+            for run in (numbers, counts, positions):
+                output.write(run.astype('<i4').tobytes())
+            terms[term] = [offset, len(numbers), len(positions)]
+            offset += 2 * len(numbers) + len(positions)
+    with open(os.path.join(path, 'terms.json'), 'w') as output:
+        json.dump(terms, output, separators=(',', ':'))
+    with open(os.path.join(path, 'docs.json'), 'w') as output:
+        json.dump(documents, output, separators=(',', ':'))
+
+
+def index_terms(
+    content: Any,
+    result: Optional[DocumentResult] = None
+) -> Tuple[Dict[str, List[int]], List[str]]:
+    """
+    Term -> word positions of a document, including its indicators'
+    evidence words, and the names of the indicators detected
+    """
+    document = preprocess(content)
+    # The words of Document.tokens, in order
+    regex, target = scannable(TOKEN, document.lowered if document.aligned else document.normalized)
+    words = regex.findall(target)
+    if words and isinstance(words[0], bytes):
+        words = [word.decode('ascii') for word in words]
+    if not document.aligned:
+        words = [word.lower() for word in words]
+    terms: Dict[str, List[int]] = {}
+    for position, word in enumerate(words):
+        positions = terms.get(word)
+        if positions is None:
+            terms[word] = [position]
+        else:
+            positions.append(position)
+
+    indicators = []
+    for indicator in (result.indicators if result is not None else ()):
+        indicators.append(indicator.indicator_name)
+        starts, ends = document.tokens
+        covered: Set[int] = set()
+        for start, end in indicator.iter_spans():
+            covered.update(range(bisect_right(ends, start), bisect_left(starts, end)))
+        if covered:
+            terms.setdefault(indicator_term(indicator.indicator_name), []).extend(sorted(covered))
+    return terms, indicators
+
+
+def indicator_term(indicator_name: str) -> str:
+    """The term an indicator's evidence words are indexed under"""
+    return INDICATOR_PREFIX + ' '.join(WORD.findall(indicator_name.lower()))
+
+
+class SearchIndex:
+    """
+    Reads and incrementally maintains an index directory
+
+    add() buffers documents until commit(), which writes them as a new
+    segment and publishes it together with the deletion of any earlier
+    copies. merge() combines similar-sized segments.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        merge_factor: int = MERGE_FACTOR,
+        flush_tokens: int = FLUSH_TOKENS
+    ):
+        self.root = os.path.abspath(root)
+        self.merge_factor = merge_factor
+        self.flush_tokens = flush_tokens
+        os.makedirs(self.root, exist_ok=True)
+
+        self._segments: List[Segment] = []
+        self._deleted: Dict[str, Set[int]] = {}
+        self._manifest_stamp = None
+        self._lock = threading.Lock()
+        self._merging = threading.Lock()
+
+        self._pending_documents: List[List[Any]] = []
+        # term -> (document numbers, position counts, positions)
+        self._pending_postings: Dict[str, Tuple[List[int], List[int], List[int]]] = {}
+        self._pending_ids: Dict[str, int] = {}
+        self._pending_tokens = 0
+        self.refresh()
+
+    # Reading
+
+    def refresh(self) -> None:
+        """Pick up segments committed or merged since the last refresh"""
+        path = os.path.join(self.root, MANIFEST)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stamp == self._manifest_stamp:
+            return
+        for attempt in range(3):
+            manifest = self._read_manifest()
+            with self._lock:
+                known = {segment.name: segment for segment in self._segments}
+                try:
+                    segments = [
+                        known.get(entry['name']) or Segment(os.path.join(self.root, entry['name']))
+                        for entry in manifest['segments']
+                    ]
+                except FileNotFoundError:
+                    # Merged away by another process since the manifest was read
+                    continue
+                self._segments = segments
+                self._deleted = {
+                    entry['name']: set(entry['deleted']) for entry in manifest['segments']
+                }
+                self._manifest_stamp = stamp
+                return
+
+    def search(self, query: str, limit: int = 50) -> Dict[str, Any]:
+        """
+        Documents matching every clause of a query, most matches first
+
+        Each result carries the document's id, case, type and detected
+        indicators, and the word positions [first, last] of its matches.
+        """
+        clauses = parse_query(query)
+        self.refresh()
+        with self._lock:
+            segments = list(self._segments)
+            deleted = dict(self._deleted)
+
+        found = []
+        for segment in segments:
+            matches = _evaluate_clauses(clauses, segment)
+            if matches is None:
+                continue
+            order = np.argsort(matches[0], kind='stable')
+            starts, ends = matches[0][order], matches[1][order]
+            removed = deleted.get(segment.name, ())
+            numbers, firsts, counts = np.unique(
+                starts >> POSITION_BITS, return_index=True, return_counts=True
+            )
+            for number, first, count in zip(numbers.tolist(), firsts.tolist(), counts.tolist()):
+                if number not in removed:
+                    found.append((count, segment, number, starts, ends, first))
+        found.sort(key=lambda hit: -hit[0])
+
+        results = []
+        mask = (1 << POSITION_BITS) - 1
+        for count, segment, number, starts, ends, first in found[:limit]:
+            document_id, case_id, document_type, indicators = segment.documents[number]
+            shown = slice(first, first + min(count, MATCHES_PER_DOCUMENT))
+            results.append({
+                'document_id': document_id,
+                'case_id': case_id,
+                'document_type': document_type,
+                'indicators': indicators,
+                'match_count': count,
+                'matches': np.stack((starts[shown] & mask, ends[shown] & mask), axis=1).tolist()
+            })
+        return {'query': query, 'total': len(found), 'results': results}
+
+    def stats(self) -> Dict[str, int]:
+        self.refresh()
+        with self._lock:
+            return {
+                'segments': len(self._segments),
+                'documents': sum(
+                    len(segment) - len(self._deleted.get(segment.name, ()))
+                    for segment in self._segments
+                ),
+                'deleted': sum(len(deleted) for deleted in self._deleted.values()),
+                'pending': len(self._pending_documents),
+            }
+
+    # Writing
+
+    def add(
+        self,
+        document_id: Any,
+        case_id: Any,
+        document_type: Optional[str],
+        content: Any,
+        result: Optional[DocumentResult] = None
+    ) -> None:
+        """Buffer a document (and its indicators' evidence), replacing any earlier copy"""
+        terms, indicators = index_terms(content, result)
+        with self._lock:
+            key = str(document_id)
+            if key in self._pending_ids:
+                # Dropped with its postings on commit
+                self._pending_documents[self._pending_ids[key]] = None
+            number = len(self._pending_documents)
+            self._pending_ids[key] = number
+            self._pending_documents.append([document_id, case_id, document_type, indicators])
+            pending = self._pending_postings
+            for term, positions in terms.items():
+                postings = pending.get(term)
+                if postings is None:
+                    pending[term] = ([number], [len(positions)], positions)
+                else:
+                    postings[0].append(number)
+                    postings[1].append(len(positions))
+                    postings[2].extend(positions)
+                self._pending_tokens += len(positions)
+            full = self._pending_tokens >= self.flush_tokens
+        if full:
+            self.commit()
+
+    def commit(self) -> None:
+        """Write buffered documents as a segment and publish it"""
+        with self._lock:
+            documents = self._pending_documents
+            postings = self._pending_postings
+            self._pending_documents, self._pending_postings = [], {}
+            self._pending_ids, self._pending_tokens = {}, 0
+        if not any(document is not None for document in documents):
+            return
+
+        # Renumber past documents replaced while buffered
+        mapping = np.full(len(documents), -1, dtype=np.int64)
+        kept = []
+        for number, document in enumerate(documents):
+            if document is not None:
+                mapping[number] = len(kept)
+                kept.append(document)
+        postings = {
+            term: _renumber(mapping, *map(np.array, arrays))
+            for term, arrays in postings.items()
+        }
+        postings = {term: arrays for term, arrays in postings.items() if len(arrays[0])}
+        name = _segment_name()
+        with self._writing():
+            write_segment(os.path.join(self.root, name), kept, postings)
+            manifest = self._read_manifest()
+            ids = {str(document[0]) for document in kept}
+            for entry in manifest['segments']:
+                segment = self._segment(entry['name'])
+                deleted = set(entry['deleted'])
+                deleted.update(segment.ids[key] for key in ids if key in segment.ids)
+                entry['deleted'] = sorted(deleted)
+            manifest['segments'].append({'name': name, 'deleted': []})
+            self._write_manifest(manifest)
+        self.refresh()
+
+    def merge(self) -> bool:
+        """
+        Merge one tier of merge_factor similar-sized segments, if there is
+        one, into a segment without their deleted documents
+
+        Writers keep committing while the merged segment is written;
+        deletions made meanwhile are carried over when it is published.
+        Returns True when segments were merged.
+        """
+        if not self._merging.acquire(blocking=False):
+            return False
+        try:
+            manifest = self._read_manifest()
+            chosen = self._merge_candidates(manifest)
+            if not chosen:
+                return False
+            segments = [self._segment(entry['name']) for entry in chosen]
+            deleted = [set(entry['deleted']) for entry in chosen]
+
+            # Old document number -> merged number (-1 for deleted documents)
+            documents, mappings = [], []
+            for segment, removed in zip(segments, deleted):
+                mapping = np.full(len(segment), -1, dtype=np.int64)
+                for number, document in enumerate(segment.documents):
+                    if number not in removed:
+                        mapping[number] = len(documents)
+                        documents.append(document)
+                mappings.append(mapping)
+
+            # Segments are merged in order, so document numbers stay ascending
+            postings: Dict[str, Postings] = {}
+            for term in set().union(*(segment.terms for segment in segments)):
+                runs = []
+                for segment, mapping in zip(segments, mappings):
+                    found = segment.term(term)
+                    if found is None:
+                        continue
+                    runs.append(_renumber(mapping, *found))
+                if any(len(numbers) for numbers, _, _ in runs):
+                    postings[term] = tuple(np.concatenate(run) for run in zip(*runs))
+
+            name = _segment_name()
+            temporary = os.path.join(self.root, f'.{name}')
+            write_segment(temporary, documents, postings)
+            with self._writing():
+                manifest = self._read_manifest()
+                current = {entry['name']: entry for entry in manifest['segments']}
+                if any(entry['name'] not in current for entry in chosen):
+                    shutil.rmtree(temporary)
+                    return False
+                # Documents replaced while the merge ran
+                merged_deleted = []
+                for entry, mapping, removed in zip(chosen, mappings, deleted):
+                    for number in set(current[entry['name']]['deleted']) - removed:
+                        merged_deleted.append(int(mapping[number]))
+                os.rename(temporary, os.path.join(self.root, name))
+                names = {entry['name'] for entry in chosen}
+                position = min(
+                    index for index, entry in enumerate(manifest['segments'])
+                    if entry['name'] in names
+                )
+                remaining = [entry for entry in manifest['segments'] if entry['name'] not in names]
+                remaining.insert(position, {'name': name, 'deleted': sorted(merged_deleted)})
+                manifest['segments'] = remaining
+                self._write_manifest(manifest)
+            for entry in chosen:
+                # Readers that still map the old files keep them until they refresh
+                shutil.rmtree(os.path.join(self.root, entry['name']), ignore_errors=True)
+            self.refresh()
+            return True
+        finally:
+            self._merging.release()
+
+    def optimize(self) -> None:
+        """Merge until no tier has merge_factor segments"""
+        while self.merge():
+            pass
+
+    def _merge_candidates(self, manifest: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """The segments of the smallest tier holding at least merge_factor of them"""
+        tiers: Dict[int, List[Dict[str, Any]]] = {}
+        for entry in manifest['segments']:
+            size = len(self._segment(entry['name'])) - len(entry['deleted'])
+            tier = int(math.log(max(size, 1), self.merge_factor))
+            tiers.setdefault(tier, []).append(entry)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier][:self.merge_factor]
+        return []
+
+    def _segment(self, name: str) -> Segment:
+        with self._lock:
+            for segment in self._segments:
+                if segment.name == name:
+                    return segment
+        return Segment(os.path.join(self.root, name))
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        """Hold the index's write lock, shared with writers in other processes"""
+        with open(os.path.join(self.root, LOCK_FILE), 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        path = os.path.join(self.root, MANIFEST)
+        if not os.path.exists(path):
+            return {'generation': 0, 'segments': []}
+        with open(path) as handle:
+            return json.load(handle)
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        manifest['generation'] += 1
+        path = os.path.join(self.root, MANIFEST)
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump(manifest, handle)
+        os.replace(temporary, path)
+
+
+def _renumber(
+    mapping: np.ndarray,
+    numbers: np.ndarray,
+    counts: np.ndarray,
+    positions: np.ndarray
+) -> Postings:
+    """Postings with document numbers mapped, dropping those mapped to -1"""
+    numbers = mapping[numbers]
+    live = numbers >= 0
+    return numbers[live], counts[live], positions[np.repeat(live, counts)]
+
+
+def _segment_name() -> str:
+    return f'segment-{time.time_ns():x}-{uuid.uuid4().hex[:8]}'
+
+
+def parse_query(query: str) -> List[Any]:
+    """
+    Clauses of a query; each is a phrase ('phrase', [terms]) or
+    ('near', left, right, distance)
+    """
+    clauses: List[Any] = []
+    near = None
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        match = QUERY_TOKEN.match(query, pos)
+        if match is None:
+            raise QueryError(f'Cannot parse query at: {query[pos:]!r}')
+        pos = match.end()
+        if match.group('near'):
+            if not clauses or near is not None:
+                raise QueryError('NEAR/n needs a term on each side')
+            near = int(match.group('distance'))
+            continue
+        text = match.group('phrase') if match.group('phrase') is not None else match.group('word')
+        if match.group('field'):
+            terms = [indicator_term(text)]
+        else:
+            terms = WORD.findall(text.lower())
+        if not terms or terms == [INDICATOR_PREFIX]:
+            raise QueryError(f'Nothing to search for in {match.group().strip()!r}')
+        node = ('phrase', terms)
+        if near is not None:
+            clauses[-1] = ('near', clauses[-1], node, near)
+            near = None
+        else:
+            clauses.append(node)
+    if near is not None:
+        raise QueryError('NEAR/n needs a term on each side')
+    if not clauses:
+        raise QueryError('Empty query')
+    return clauses
+
+
+def _evaluate(node: Any, segment: Segment) -> Tuple[np.ndarray, np.ndarray]:
+    """(first, last) keys of every match of a query node in a segment"""
+    if node[0] == 'phrase':
+        terms = node[1]
+        keys = segment.keys(terms[0])
+        for offset, term in enumerate(terms[1:], 1):
+            if not len(keys):
+                break
+            keys = np.intersect1d(keys, segment.keys(term) - offset, assume_unique=True)
+        return keys, keys + (len(terms) - 1)
+
+    _, left, right, distance = node
+    starts, ends = _evaluate(left, segment)
+    if not len(starts):
+        return starts, ends
+    other_starts, other_ends = _evaluate(right, segment)
+    if not len(other_starts):
+        return other_starts, other_ends
+    order = np.argsort(other_starts, kind='stable')
+    other_starts = other_starts[order]
+    # Keys of earlier documents are smaller by far, so a running maximum
+    # of ends never reaches into the next document
+    reach = np.maximum.accumulate(other_ends[order])
+    index = np.searchsorted(other_starts, ends + distance, side='right') - 1
+    near = (index >= 0) & (reach[np.maximum(index, 0)] >= starts - distance)
+    return starts[near], ends[near]
+
+
+def _evaluate_clauses(
+    clauses: List[Any],
+    segment: Segment
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Matches of every clause in the documents matching all of them"""
+    results = []
+    documents = None
+    for clause in clauses:
+        starts, ends = _evaluate(clause, segment)
+        if not len(starts):
+            return None
+        numbers = np.unique(starts >> POSITION_BITS)
+        documents = numbers if documents is None else np.intersect1d(documents, numbers)
+        if not len(documents):
+            return None
+        results.append((starts, ends))
+    starts = np.concatenate([starts for starts, _ in results])
+    ends = np.concatenate([ends for _, ends in results])
+    keep = np.isin(starts >> POSITION_BITS, documents)
+    return starts[keep], ends[keep]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--index', default=os.getenv('SEARCH_INDEX'),
+                        help='index directory (default $SEARCH_INDEX)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser(
+        'build', help='index the documents table with the analysis_result stored for each'
+    )
+    build.add_argument('--database', default=os.getenv('DATABASE_URL'))
+    build.add_argument('--batch-size', type=int, default=512)
+    query = subparsers.add_parser('query', help='print the documents matching a query')
+    query.add_argument('query')
+    query.add_argument('--limit', type=int, default=20)
+    subparsers.add_parser('optimize', help='merge segments until no tier is full')
+    args = parser.parse_args()
+
+    if not args.index:
+        parser.error('--index or SEARCH_INDEX is required')
+    index = SearchIndex(args.index)
+
+    if args.command == 'query':
+        try:
+            print(json.dumps(index.search(args.query, args.limit), indent=2))
+        except QueryError as error:
+            parser.error(str(error))
+    elif args.command == 'optimize':
+        index.optimize()
+        print(json.dumps(index.stats()))
+    else:
+        from db import connect
+        if not args.database:
+            parser.error('--database or DATABASE_URL is required')
+        db = connect(args.database)
+        stored = 'analysis_result' in db.columns('documents')
+        rows = db.iter_batches(
+            'SELECT id, case_id, document_type, content_text, '
+            f'{"analysis_result" if stored else "NULL"} FROM documents ORDER BY id',
+            (), args.batch_size
+        )
+        for batch in rows:
+            for document_id, case_id, document_type, content, result in batch:
+                document = Document(content or '')
+                if isinstance(result, str):
+                    result = DocumentResult.from_dict(json.loads(result), 0, document)
+                index.add(document_id, case_id, document_type, document, result)
+            index.commit()
+            index.merge()
+        db.close()
+        print(json.dumps(index.stats()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Production server: the Flask app under gunicorn's threaded (gthread) worker
+
+One gunicorn worker process serves requests on a bounded thread pool, and
+detection itself runs in the app's AnalysisPool worker processes, so a
+huge transcript never delays a health check or a small document. The app
+(and with it the pool) is loaded in the gunicorn worker after it forks.
+When the request queue is full, new requests are shed immediately with
+429 by a separate thread, which still answers health checks and metrics.
+Clients that stall while sending a request or reading its response are
+disconnected. SIGTERM stops accepting connections and drains in-flight
+requests before exiting.
+
+Usage:
+    python server.py
+
+Configuration (environment):
+    HOST, PORT             Listen address (default 0.0.0.0:5001)
+    SERVER_THREADS         Requests handled concurrently (default 32)
+    MAX_QUEUED_REQUESTS    Requests waiting for a thread before 429 (default 64)
+    SHUTDOWN_TIMEOUT       Seconds to drain in-flight requests (default 30)
+    READ_TIMEOUT           Seconds a client may stall mid-request or mid-response (default 10)
+    KEEPALIVE_TIMEOUT      Seconds an idle keep-alive connection stays open (default 15)
+    MAX_WORKERS, ...       Analysis processes and other app.py settings
+"""
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Tuple
+
+from gunicorn.app.base import BaseApplication
+from gunicorn.workers.gthread import ThreadWorker, TConn
+
+# Routes still served once requests are being shed. Nothing that can block
+# for long (database reads, analysis) belongs here.
+UNSHED_PATHS = ('/health', '/metrics')
+
+# Threads answering requests while the queue is full
+SHED_THREADS = 2
+
+MAX_QUEUED_REQUESTS = int(os.getenv('MAX_QUEUED_REQUESTS', 64))
+READ_TIMEOUT = float(os.getenv('READ_TIMEOUT', 10))
+
+_OVERLOADED_BODY = json.dumps({'error': 'Server overloaded, retry shortly'}).encode()
+OVERLOADED = (
+    b'HTTP/1.1 429 Too Many Requests\r\n'
+    b'Content-Type: application/json\r\n'
+    b'Content-Length: %d\r\n'
+    b'Retry-After: 1\r\n'
+    b'Connection: close\r\n'
+    b'\r\n' % len(_OVERLOADED_BODY)
+) + _OVERLOADED_BODY
+
+
+class Worker(ThreadWorker):
+    """
+    gthread worker with a request queue limit and client read timeouts
+
+    gthread hands each readable connection to its thread pool, whose queue
+    is unbounded; past SERVER_THREADS + MAX_QUEUED_REQUESTS requests in
+    flight, connections go to a small shedding pool instead.
+    """
+
+    def init_process(self) -> None:
+        self.capacity = self.cfg.threads + MAX_QUEUED_REQUESTS
+        self.shed_pool = ThreadPoolExecutor(SHED_THREADS, thread_name_prefix='shed')
+        super().init_process()
+
+    def enqueue_req(self, conn: TConn) -> None:
+        # Runs on the worker's main loop, which also owns self.futures
+        if len(self.futures) < self.capacity:
+            super().enqueue_req(conn)
+            return
+        conn.init()
+        self._wrap_future(self.shed_pool.submit(self.shed, conn), conn)
+
+    def handle(self, conn: TConn) -> Tuple[bool, TConn]:
+        # Reads and writes would otherwise hold a request thread indefinitely
+        conn.sock.settimeout(READ_TIMEOUT)
+        return super().handle(conn)
+
+    def shed(self, conn: TConn) -> Tuple[bool, TConn]:
+        """Answer 429 without queueing, unless the request is a health check"""
+        conn.sock.settimeout(READ_TIMEOUT)
+        try:
+            req = next(conn.parser)
+            if req.method in ('GET', 'HEAD') and req.path in UNSHED_PATHS:
+                return self.handle_request(req, conn), conn
+            conn.sock.sendall(OVERLOADED)
+        except Exception as error:
+            self.log.debug('Closing connection while shedding: %s', error)
+        return False, conn
+
+
+def _worker_ready(worker: Worker) -> None:
+    import app
+    import startup
+    # Fork the analysis processes now rather than on the first request
+    app.get_pool()
+    address = worker.cfg.bind[0]
+    print(f'NLP service listening on {address}, {startup.summary()}', file=sys.stderr)
+
+
+def _worker_exit(server, worker: Worker) -> None:
+    pool = getattr(sys.modules.get('app'), 'pool', None)
+    if pool is None:
+        return
+    if all(future.done() for future in worker.futures):
+        pool.close()
+    else:
+        # Workers still busy after the drain timeout are abandoned
+        print(f'{len(worker.futures)} requests still running at shutdown', file=sys.stderr)
+        pool.terminate()
+
+
+class Server(BaseApplication):
+    """Runs gunicorn with the service's settings instead of a config file"""
+
+    def __init__(self, options: Dict[str, Any]):
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Imported in the worker process, so the analysis pool's processes
+        # and threads belong to it rather than to the gunicorn master
+        from app import app
+        return app
+
+
+def main() -> int:
+    host = os.getenv('HOST', '0.0.0.0')
+    port = int(os.getenv('PORT', 5001))
+    Server({
+        'bind': f'{host}:{port}',
+        # Parallelism comes from the analysis pool; every further gunicorn
+        # worker would fork a pool of its own
+        'workers': 1,
+        'worker_class': 'server.Worker',
+        'threads': int(os.getenv('SERVER_THREADS', 32)),
+        'keepalive': int(os.getenv('KEEPALIVE_TIMEOUT', 15)),
+        'graceful_timeout': int(os.getenv('SHUTDOWN_TIMEOUT', 30)),
+        'post_worker_init': _worker_ready,
+        'worker_exit': _worker_exit,
+    }).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Service startup: timing report and precompiled pattern artifact
+
+app.py marks each step of its startup (imports, linguistic model,
+pattern compilation or artifact load, warming, forking the worker pool);
+the timings are served on /health and printed by server.py when it
+starts listening.
+
+`build` compiles the indicator patterns with the service's configuration
+and saves them to PATTERN_ARTIFACT, which the service then loads at
+startup instead of compiling (see detectors/artifact.py). `report`
+starts the service's app in this process, prints its startup timings
+and how long a worker forked from it takes to analyze its first
+document.
+
+Usage:
+    python startup.py build
+    python startup.py build --output /tmp/patterns.artifact
+    python startup.py report
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Dict, Any, List, Tuple
+
+# app.py imports this module first, so startup is timed from here
+STARTED = time.perf_counter()
+
+# (step, seconds since the previous mark)
+_phases: List[Tuple[str, float]] = []
+_last = STARTED
+
+PROBE_DOCUMENT = (
+    'Q. Did the detective tell you what to say?\n'
+    'A. Yes. After twelve hours he told me I could go home if I signed.\n'
+)
+
+
+def mark(step: str) -> None:
+    """Record the time since the previous mark (or since startup began) as step"""
+    global _last
+    now = time.perf_counter()
+    _phases.append((step, now - _last))
+    _last = now
+
+
+def report() -> Dict[str, Any]:
+    """Seconds taken by each startup step so far, and in total"""
+    return {
+        'steps': {step: round(seconds, 4) for step, seconds in _phases},
+        'total_seconds': round(_last - STARTED, 4),
+    }
+
+
+def summary() -> str:
+    steps = ', '.join(f'{step} {seconds:.2f}s' for step, seconds in _phases)
+    return f'started in {_last - STARTED:.2f}s ({steps})'
+
+
+def _probe(analyzer, started: float, results) -> None:
+    analyzer.analyze_document(PROBE_DOCUMENT)
+    results.put(time.perf_counter() - started)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='precompile the patterns into an artifact')
+    build.add_argument('--output', default=os.getenv('PATTERN_ARTIFACT'),
+                       help='artifact file (default $PATTERN_ARTIFACT)')
+    subparsers.add_parser('report', help='start the app and print its startup timings')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if not args.output:
+            parser.error('--output or PATTERN_ARTIFACT is required')
+        # Compiled as the app would, from its own configuration
+        os.environ.pop('PATTERN_ARTIFACT', None)
+        os.environ['MAX_WORKERS'] = '1'
+        from app import analyzer
+        from detectors import save_engine
+        analyzer.refresh_patterns()
+        save_engine(analyzer.engine, args.output)
+        print(f'{args.output}: {len(list(analyzer.engine.regexes()))} regexes, '
+              f'engine {analyzer.engine.version}', file=sys.stderr)
+        return 0
+
+    # The app marks its steps in the startup module it imports, which is
+    # not this one when this file runs as a script
+    import app
+    app.get_pool()
+    recorded = sys.modules['startup']
+    timings = recorded.report()
+    methods = multiprocessing.get_all_start_methods()
+    if 'fork' in methods:
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        started = time.perf_counter()
+        process = context.Process(target=_probe, args=(app.analyzer, started, results))
+        process.start()
+        timings['worker_first_document_seconds'] = round(results.get(), 4)
+        process.join()
+    print(json.dumps(timings, indent=2))
+    if app.pool is not None:
+        app.pool.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Content-addressed document store, read through mmap
+
+Documents are stored once under the SHA-256 of their bytes and analyzed
+in place: an ASCII document is opened as a MappedDocument, whose text
+and lowercase copy (written next to it when it is stored) are mmaps, so
+even a multi-hundred-MB record bundle is scanned without being decoded
+into a Python string, JSON-encoded, or copied to a pool worker. Other
+documents are decoded as UTF-8 when opened.
+
+Layout under the root directory:
+
+    ab/abcdef...          the document's bytes
+    ab/abcdef....lower    its lowercase copy, for mappable documents
+
+Requests refer to stored documents by {"content_hash": "<sha256>"} or by
+{"file_path": "..."} (documents.file_path), a file under the document
+root that is added to the store on first use.
+
+Usage:
+    python store.py --root /var/lib/nlp/documents add bundle1.txt bundle2.txt
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+from typing import Dict, Any, Tuple, Optional, Iterable, IO
+
+from detectors import Document, MappedDocument
+
+# Bytes copied at a time when storing a document
+COPY_SIZE = 1 << 20
+
+LOWERED_SUFFIX = '.lower'
+
+DIGEST = re.compile(r'[0-9a-f]{64}')
+
+# Bytes scanned as bytes patterns find exactly what they would in the
+# decoded text: ASCII other than the separators \x1c-\x1f, which str
+# patterns (unlike bytes patterns) treat as whitespace
+UNMAPPABLE = re.compile(rb'[^\x00-\x1b\x20-\x7f]')
+
+
+class DocumentNotFound(KeyError):
+    """Raised for a reference to a document the store cannot provide"""
+
+    def __str__(self) -> str:
+        return f'Document not found: {self.args[0]}'
+
+
+class DocumentStore:
+    """
+    Documents stored by content hash and opened as mmap-backed Documents
+
+    Writes go to a temporary file that is renamed into place, so readers
+    (including other processes sharing the directory) never see a
+    partial document.
+    """
+
+    def __init__(self, root: str, document_root: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.document_root = os.path.realpath(document_root) if document_root else None
+        os.makedirs(self.root, exist_ok=True)
+        # file_path -> ((mtime, size), digest), so files are hashed once
+        self._paths: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        self._lock = threading.Lock()
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def __contains__(self, digest: str) -> bool:
+        return bool(DIGEST.fullmatch(digest)) and os.path.exists(self.path(digest))
+
+    def put(self, chunks: Iterable[bytes]) -> str:
+        """Store a document given as byte chunks; returns its content hash"""
+        digest = hashlib.sha256()
+        mappable = True
+        handle, temporary = tempfile.mkstemp(dir=self.root)
+        lowered_handle, lowered_temporary = tempfile.mkstemp(dir=self.root)
+        try:
+            with os.fdopen(handle, 'wb') as output, os.fdopen(lowered_handle, 'wb') as lowered:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    output.write(chunk)
+                    mappable = mappable and UNMAPPABLE.search(chunk) is None
+                    if mappable:
+                        lowered.write(chunk.lower())
+            content_hash = digest.hexdigest()
+            path = self.path(content_hash)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if mappable:
+                os.replace(lowered_temporary, path + LOWERED_SUFFIX)
+            os.replace(temporary, path)
+        finally:
+            for leftover in (temporary, lowered_temporary):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        return content_hash
+
+    def put_stream(self, stream: IO[bytes]) -> str:
+        """Store a document read from a binary stream, e.g. a request body"""
+        return self.put(iter(lambda: stream.read(COPY_SIZE), b''))
+
+    def put_file(self, file_path: str) -> str:
+        """Store a file, hashing it again only when it changed"""
+        stat = os.stat(file_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            known = self._paths.get(file_path)
+        if known is not None and known[0] == key and known[1] in self:
+            return known[1]
+        with open(file_path, 'rb') as handle:
+            digest = self.put_stream(handle)
+        with self._lock:
+            self._paths[file_path] = (key, digest)
+        return digest
+
+    def open(self, digest: str) -> Document:
+        """The stored document, mapped in place when it is ASCII"""
+        if digest not in self:
+            raise DocumentNotFound(digest)
+        path = self.path(digest)
+        lowered_path = path + LOWERED_SUFFIX
+        if os.path.getsize(path) and os.path.exists(lowered_path):
+            return MappedDocument(path, lowered_path, digest)
+        with open(path, 'rb') as handle:
+            return Document(handle.read().decode('utf-8', errors='replace'))
+
+    def resolve_path(self, file_path: str) -> str:
+        """A documents.file_path as a real path, refusing any outside the document root"""
+        if self.document_root is None:
+            raise DocumentNotFound(file_path)
+        path = os.path.realpath(os.path.join(self.document_root, file_path))
+        if os.path.commonpath([path, self.document_root]) != self.document_root:
+            raise DocumentNotFound(file_path)
+        if not os.path.isfile(path):
+            raise DocumentNotFound(file_path)
+        return path
+
+    def resolve(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        A request document with its content_hash or file_path reference
+        replaced by the stored Document; documents with content pass through
+        """
+        if 'content' in document:
+            return document
+        if 'content_hash' in document:
+            content = self.open(document['content_hash'])
+        elif 'file_path' in document:
+            content = self.open(self.put_file(self.resolve_path(document['file_path'])))
+        else:
+            return document
+        resolved = {
+            key: value for key, value in document.items()
+            if key not in ('content_hash', 'file_path')
+        }
+        resolved['content'] = content
+        return resolved
+
+
+def is_reference(document: Dict[str, Any]) -> bool:
+    """Whether a request document names stored content instead of carrying it"""
+    return 'content' not in document and ('content_hash' in document or 'file_path' in document)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--root', default=os.getenv('DOCUMENT_STORE'),
+                        help='store directory (default $DOCUMENT_STORE)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add = subparsers.add_parser('add', help='store files and print their content hashes')
+    add.add_argument('files', nargs='+')
+    args = parser.parse_args()
+
+    if not args.root:
+        parser.error('--root or DOCUMENT_STORE is required')
+
+    store = DocumentStore(args.root)
+    for file_path in args.files:
+        print(f'{store.put_file(file_path)}\t{file_path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Streaming analysis of very large documents in overlapping windows
+"""
+import codecs
+import os
+from typing import Iterator, Dict, Any, List, Tuple, Union, IO, Iterable
+
+from detectors import Document, LineIndex
+
+# Text read per window
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# Cap on the overlap carried between windows for unbounded patterns
+MAX_OVERLAP = 4096
+
+Source = Union[str, os.PathLike, IO, Iterable[Union[str, bytes]]]
+
+
+def iter_text_chunks(source: Source, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yield decoded text from a file path, a file-like object (text or
+    binary, e.g. a chunked HTTP request body) or an iterable of chunks
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as handle:
+            yield from iter_text_chunks(handle, chunk_size)
+        return
+
+    if hasattr(source, 'read'):
+        def read_all():
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        chunks = read_all()
+    else:
+        chunks = iter(source)
+
+    # UTF-8 sequences may be split across chunk boundaries
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in chunks:
+        text = decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def analyze_stream(
+    analyzer,
+    source: Source,
+    document_type: str = 'transcript',
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[Dict[str, Any]]:
+    """
+    Analyze a document without holding it in memory
+
+    Text is scanned in windows of about chunk_size characters. Each window
+    keeps enough of the previous one (the longest possible match plus the
+    evidence context) that matches straddling a boundary are still found
+    with full context, so memory stays flat regardless of document size.
+
+    Yields {'event': 'evidence', ...} as soon as each evidence span is
+    found, then a final {'event': 'result', ...} with the same shape as
+    WrongfulConvictionAnalyzer.analyze_document.
+    """
+    engine = analyzer.engine
+    context_size = engine.context_size
+    overlap = engine.max_match_width(MAX_OVERLAP) + context_size
+
+    evidence: Dict[Tuple[str, str], List[str]] = {}
+    citations: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    confidences: Dict[Tuple[str, str], float] = {}
+    # End of each category's last match; finditer never overlaps matches
+    last_end: Dict[Tuple[str, str], int] = {}
+
+    buffer = ''
+    buffer_start = 0   # absolute offset of buffer[0]
+    scan_from = 0      # absolute offset of the first uncommitted match start
+    lines = LineIndex()
+
+    def scan_window(final: bool) -> Iterator[Dict[str, Any]]:
+        """Commit matches starting before the point later text cannot change"""
+        nonlocal scan_from
+
+        commit_limit = buffer_start + len(buffer)
+        if not final:
+            commit_limit -= overlap
+        if commit_limit <= scan_from:
+            return
+
+        window = Document(buffer)
+        for detector_name, detector in engine.detectors.items():
+            for category, (indicator_name, confidence) in detector.indicators.items():
+                key = (detector_name, category)
+                confidences[key] = max(
+                    confidences.get(key, confidence),
+                    detector.adjust_confidence(category, window, confidence)
+                )
+
+                contexts = evidence.setdefault(key, [])
+                located = citations.setdefault(key, [])
+                if len(contexts) >= engine.max_evidence:
+                    continue
+
+                pos = max(scan_from, last_end.get(key, 0)) - buffer_start
+                spans = engine.iter_spans(window, detector_name, category, pos)
+                for start, end in spans:
+                    if buffer_start + start >= commit_limit:
+                        break
+                    # The buffer is trimmed later, so materialize right away
+                    citation = engine.citations(
+                        buffer, [(start, end)], lines, buffer_start
+                    )[0]
+                    context = citation.context
+                    contexts.append(context)
+                    located.append(citation.to_dict())
+                    last_end[key] = buffer_start + end
+                    yield {
+                        'event': 'evidence',
+                        'detector': detector_name,
+                        'indicator_name': indicator_name,
+                        'offset': buffer_start + start,
+                        'evidence': context,
+                        'citation': located[-1]
+                    }
+                    if len(contexts) >= engine.max_evidence:
+                        break
+
+        scan_from = commit_limit
+
+    pending: List[str] = []
+    pending_size = 0
+
+    for chunk in iter_text_chunks(source, chunk_size):
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size < chunk_size:
+            continue
+
+        text = ''.join(pending)
+        pending, pending_size = [], 0
+        buffer += text
+        lines.extend(text)
+        yield from scan_window(final=False)
+
+        # Keep the uncommitted tail plus the context preceding it
+        keep_from = max(0, scan_from - context_size - buffer_start)
+        buffer = buffer[keep_from:]
+        buffer_start += keep_from
+        lines.trim(scan_from)
+
+    text = ''.join(pending)
+    buffer += text
+    lines.extend(text)
+    yield from scan_window(final=True)
+
+    indicators = []
+    for detector_name, detector in engine.detectors.items():
+        for category, (indicator_name, _) in detector.indicators.items():
+            contexts = evidence.get((detector_name, category))
+            if contexts:
+                indicators.append({
+                    'indicator_name': indicator_name,
+                    'confidence': confidences[(detector_name, category)],
+                    'evidence': contexts,
+                    'citations': citations[(detector_name, category)],
+                    'detector': detector_name
+                })
+
+    yield {
+        'event': 'result',
+        'total_indicators': len(indicators),
+        'indicators': indicators,
+        'document_type': document_type,
+        'analysis_complete': True,
+        'characters_analyzed': buffer_start + len(buffer)
+    }
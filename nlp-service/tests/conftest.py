@@ -0,0 +1,101 @@
+"""
+Shared fixtures: a SQLite database with the repository's schema and seed
+data, indicator definition files derived from the built-in ones, and a
+corpus of generated transcripts
+"""
+import copy
+import json
+import os
+import random
+import sqlite3
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE_DIR = os.path.join(SERVICE_DIR, '..', 'database')
+sys.path.insert(0, SERVICE_DIR)
+
+from detectors import BUILTIN_PATH  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Path of a SQLite database with the schema, the seed data and one case"""
+    path = str(tmp_path / 'wrongful_conviction.db')
+    connection = sqlite3.connect(path)
+    for name in ('schema.sqlite.sql', 'seed-data.sql'):
+        with open(os.path.join(DATABASE_DIR, name)) as handle:
+            connection.executescript(handle.read())
+    connection.execute(
+        "INSERT INTO cases (id, case_number, defendant_name, crime_charged, county) "
+        "VALUES (1, 'CR-1', 'Doe', 'Robbery', 'Cook')"
+    )
+    connection.commit()
+    connection.close()
+    return path
+
+
+@pytest.fixture
+def write_definitions(tmp_path):
+    """
+    Returns a function writing the built-in definitions, changed by
+    change(definitions), to a file and returning its path
+    """
+    with open(BUILTIN_PATH) as handle:
+        builtin = json.load(handle)
+    written = []
+
+    def write(change=None) -> str:
+        definitions = copy.deepcopy(builtin)
+        if change is not None:
+            change(definitions)
+        path = str(tmp_path / f'indicators-{len(written)}.json')
+        with open(path, 'w') as handle:
+            json.dump(definitions, handle)
+        written.append(path)
+        return path
+    return write
+
+
+# Words of the generated corpus: indicator phrases among transcript filler
+CORPUS_WORDS = (
+    'the witness said he was not sure it could be him the detective testified about '
+    'the lineup and the interrogation lasted 14 hours without a break the DNA was never '
+    'tested and the prosecutor withheld evidence brady violation the defendant later '
+    'recanted the confession hair analysis was used no physical evidence linked him the '
+    'white witness identified the black defendant police misconduct inflammatory '
+    'argument improper closing maybe perhaps stood out photo array lineup was '
+    'problematic Q: A: THE COURT: court reporter page exhibit counsel objection '
+    'sustained overruled jury verdict'
+).split()
+
+
+def generated_document(words: int, seed: int) -> str:
+    """Deterministic pseudo-transcript with sentence, line and page breaks"""
+    generator = random.Random(seed)
+    out = []
+    for _ in range(words):
+        out.append(generator.choice(CORPUS_WORDS))
+        roll = generator.random()
+        if roll < 0.08:
+            out.append('.')
+        elif roll < 0.11:
+            out.append('\n')
+        elif roll < 0.112:
+            out.append('\f')
+    return ' '.join(out)
+
+
+@pytest.fixture(scope='session')
+def corpus():
+    """Documents of assorted sizes, plus edge cases"""
+    documents = [
+        generated_document(words, seed)
+        for seed, words in enumerate([5, 20, 50, 200, 1000, 3000, 8000])
+    ]
+    return documents + [
+        '',
+        'Nothing relevant here at all.',
+        'DNA was NOT tested. Brady Violation!\nThe 3 hour interrogation was all night.',
+    ]
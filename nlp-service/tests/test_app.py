@@ -0,0 +1,24 @@
+"""The app forks its analysis pool in the process that uses it, not at import"""
+import app
+
+
+def test_pool_is_started_on_first_use(monkeypatch):
+    assert app.pool is None
+    monkeypatch.setattr(app, 'max_workers', 2)
+    pool = app.get_pool()
+    try:
+        assert pool.workers == 2
+        assert app.get_pool() is pool
+        # A process forked from this one starts a pool of its own
+        monkeypatch.setattr(app, '_pool_pid', -1)
+        replacement = app.get_pool()
+        assert replacement is not pool
+        replacement.terminate()
+    finally:
+        pool.terminate()
+        app.pool = None
+
+
+def test_no_pool_with_one_worker(monkeypatch):
+    monkeypatch.setattr(app, 'max_workers', 1)
+    assert app.get_pool() is None
@@ -0,0 +1,70 @@
+"""Every NDJSON line gets its own output, however malformed"""
+import json
+
+import pytest
+
+from analyzer import WrongfulConvictionAnalyzer
+from batch import analyze_batch
+from pool import AnalysisPool
+
+GOOD = {'id': 'good', 'content': 'The prosecutor committed a Brady violation.'}
+
+BAD_LINES = [
+    ({'id': 1, 'case_id': 1, 'documents': 5}, 'documents must be a list'),
+    ({'id': 2, 'case_id': 1, 'documents': ['x']}, 'Each document must be a JSON object'),
+    ({'id': 3, 'content': 5}, 'content must be a string'),
+    ({'id': 4, 'case_id': 1, 'documents': [{'content': None}]}, 'content must be a string'),
+    ({'id': 5, 'content_hash': 5}, 'content_hash must be a string'),
+    ({'id': 6, 'file_path': ['a']}, 'file_path must be a string'),
+    ({'id': 7, 'case_id': 1, 'documents': [{'type': 'appeal'}]}, 'Missing content field'),
+    ({'id': 8}, 'Missing content field'),
+]
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    return WrongfulConvictionAnalyzer()
+
+
+def lines():
+    yield json.dumps(GOOD)
+    for data, _ in BAD_LINES:
+        yield json.dumps(data)
+    yield '{not json'
+    yield json.dumps(GOOD)
+
+
+def check(outputs):
+    by_id = {}
+    for output in outputs:
+        by_id.setdefault(output['id'], []).append(output)
+    for data, message in BAD_LINES:
+        assert by_id[data['id']] == [{'id': data['id'], 'error': message}]
+    assert 'Invalid JSON' in by_id[len(BAD_LINES) + 2][0]['error']
+    good = by_id['good']
+    assert len(good) == 2
+    assert all('result' in output for output in good)
+
+
+def test_bad_lines_without_pool(analyzer):
+    check(list(analyze_batch(analyzer, lines())))
+
+
+def test_bad_lines_with_pool(analyzer):
+    pool = AnalysisPool(analyzer, workers=1)
+    try:
+        check(list(analyze_batch(analyzer, lines(), pool=pool)))
+    finally:
+        pool.terminate()
+
+
+def test_failing_item_does_not_end_the_stream(analyzer, monkeypatch):
+    def merge_case(case, results):
+        raise RuntimeError('merge failed')
+    monkeypatch.setattr(analyzer, 'merge_case', merge_case)
+    outputs = list(analyze_batch(analyzer, [
+        json.dumps({'id': 'case', 'case_id': 1, 'documents': [{'content': 'text'}]}),
+        json.dumps(GOOD),
+    ]))
+    assert outputs[0] == {'id': 'case', 'error': 'merge failed'}
+    assert 'result' in outputs[1]
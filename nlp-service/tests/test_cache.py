@@ -0,0 +1,51 @@
+"""The disk tier of AnalysisCache never holds up the in-process tier"""
+import threading
+
+from cache import AnalysisCache
+
+
+def test_memory_hits_do_not_wait_for_disk(tmp_path, monkeypatch):
+    cache = AnalysisCache(disk_path=str(tmp_path / 'cache.db'))
+    cache.put('warm', {'indicators': []})
+
+    reading = threading.Event()
+    release = threading.Event()
+    disk_get = cache._disk_get
+
+    def slow_disk_get(key):
+        reading.set()
+        release.wait(10)
+        return disk_get(key)
+    monkeypatch.setattr(cache, '_disk_get', slow_disk_get)
+
+    missing = threading.Thread(target=cache.get, args=('cold',))
+    missing.start()
+    try:
+        assert reading.wait(10)
+        # Both would block until release if the disk read held the lock
+        assert cache.get('warm') == {'indicators': []}
+        assert cache.stats()['memory_hits'] == 1
+    finally:
+        release.set()
+        missing.join()
+    assert cache.stats()['misses'] == 1
+
+
+def test_threads_share_the_disk_tier(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    writer = AnalysisCache(disk_path=path)
+    results = []
+
+    def put(index):
+        writer.put(f'key-{index}', {'index': index})
+    threads = [threading.Thread(target=put, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reader = AnalysisCache(disk_path=path)
+    for index in range(8):
+        results.append(reader.get(f'key-{index}'))
+    assert results == [{'index': index} for index in range(8)]
+    assert reader.stats()['disk_hits'] == 8
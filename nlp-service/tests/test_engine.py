@@ -0,0 +1,59 @@
+"""PatternEngine scans agree with the plain per-pattern regex scan they replace"""
+import re
+
+import pytest
+
+from analyzer import WrongfulConvictionAnalyzer
+from detectors import PATTERN_MODES, SCOPES, PatternEngine, build_detectors, builtin_definitions
+
+
+def reference_indicators(text, max_evidence=3, context_size=100):
+    """
+    The detectors' original semantics: a category is detected when any of
+    its patterns matches case-insensitively; its evidence is the first
+    matches of its patterns in document order
+    """
+    lowered = text.lower()
+    indicators = []
+    for detector_name, detector in builtin_definitions()['detectors'].items():
+        for category, spec in detector['categories'].items():
+            patterns = spec['patterns']
+            if not any(re.search(pattern, lowered, re.IGNORECASE) for pattern in patterns):
+                continue
+            confidence = spec['confidence']
+            if category == 'long_interrogation':
+                duration = re.search(r'(\d+)\s*hour', lowered)
+                if duration and int(duration.group(1)) >= 8:
+                    confidence = 0.9
+            alternation = re.compile('|'.join(f'(?:{p})' for p in patterns), re.IGNORECASE)
+            evidence = [
+                text[max(0, match.start() - context_size):match.end() + context_size].strip()
+                for match in alternation.finditer(text)
+            ][:max_evidence]
+            indicators.append((spec['indicator'], confidence, detector_name, evidence))
+    return indicators
+
+
+def test_legacy_mode_matches_per_pattern_scan(corpus):
+    analyzer = WrongfulConvictionAnalyzer(pattern_mode='legacy')
+    for text in corpus:
+        result = analyzer.analyze_document(text)
+        indicators = [
+            (indicator['indicator_name'], indicator['confidence'], indicator['detector'],
+             indicator['evidence'])
+            for indicator in result['indicators']
+        ]
+        assert indicators == reference_indicators(text)
+
+
+@pytest.mark.parametrize('mode', PATTERN_MODES)
+@pytest.mark.parametrize('scope', SCOPES)
+@pytest.mark.parametrize('max_evidence', [3, 1000])
+def test_prefilter_finds_the_same_matches(corpus, mode, scope, max_evidence):
+    detectors = build_detectors(builtin_definitions())
+    options = {'mode': mode, 'scope': scope, 'max_evidence': max_evidence}
+    filtered = PatternEngine(detectors, prefilter=True, **options)
+    unfiltered = PatternEngine(detectors, prefilter=False, **options)
+    assert filtered.prefilter is not None
+    for text in corpus:
+        assert filtered.scan(text) == unfiltered.scan(text)
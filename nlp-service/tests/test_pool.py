@@ -0,0 +1,82 @@
+"""Per-document timeouts fail only the chunk that overran, timed from its start"""
+import json
+import threading
+import time
+
+import pytest
+
+import pool as pool_module
+from analyzer import WrongfulConvictionAnalyzer
+from batch import analyze_batch
+from pool import AnalysisPool, DocumentTimeout
+
+BRADY = 'The prosecutor committed a Brady violation by withholding the report.'
+
+
+@pytest.fixture
+def slow_workers(monkeypatch):
+    """Workers sleep for each document's 'delay' before analyzing it"""
+    analyze = pool_module._analyze
+
+    def delayed(documents, collect_metrics, definitions):
+        for document in documents:
+            time.sleep(document.get('delay', 0))
+        return analyze(documents, collect_metrics, definitions)
+    monkeypatch.setattr(pool_module, '_analyze', delayed)
+
+
+def document(delay=0):
+    return {'type': 'transcript', 'content': BRADY, 'delay': delay}
+
+
+def test_time_spent_queued_does_not_count(slow_workers):
+    analyzer = WrongfulConvictionAnalyzer()
+    results = []
+    with AnalysisPool(analyzer, workers=1, timeout=0.5, chunk_docs=1) as pool:
+        # Each request's chunks wait behind the other's well past the timeout
+        requests = [
+            threading.Thread(
+                target=lambda: results.append(pool.analyze_documents([document(0.3)] * 2))
+            )
+            for _ in range(2)
+        ]
+        for request in requests:
+            request.start()
+        for request in requests:
+            request.join()
+    assert [len(request_results) for request_results in results] == [2, 2]
+
+
+def test_stuck_worker_alone_is_replaced(slow_workers):
+    analyzer = WrongfulConvictionAnalyzer()
+    pool = AnalysisPool(analyzer, workers=2, timeout=0.5, chunk_docs=1)
+    try:
+        others = []
+        neighbour = threading.Thread(
+            target=lambda: others.append(pool.analyze_documents([document(0.3)] * 3))
+        )
+        started = time.monotonic()
+        with pytest.raises(DocumentTimeout) as timeout:
+            neighbour.start()
+            pool.analyze_documents([document(60), document()])
+        assert timeout.value.indices == [0]
+        assert time.monotonic() - started < 10
+        neighbour.join()
+        assert len(others[0]) == 3
+
+        # The pool keeps serving with a replacement worker
+        assert len(pool.analyze_documents([document(), document()])) == 2
+    finally:
+        pool.close()
+
+
+def test_batch_reports_timeouts_per_item(slow_workers):
+    analyzer = WrongfulConvictionAnalyzer()
+    lines = [
+        json.dumps({'id': 'stuck', 'case_id': 1, 'documents': [document(), document(60)]}),
+        json.dumps({'id': 'fine', 'content': BRADY}),
+    ]
+    with AnalysisPool(analyzer, workers=2, timeout=0.5, chunk_docs=1) as pool:
+        outputs = {output['id']: output for output in analyze_batch(analyzer, lines, pool)}
+    assert 'result' in outputs['fine']
+    assert outputs['stuck']['error'] == str(DocumentTimeout([1], 0.5))
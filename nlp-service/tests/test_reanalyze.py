@@ -0,0 +1,117 @@
+"""Case indicators written by reanalyze.py follow the current patterns"""
+import sqlite3
+
+from analyzer import WrongfulConvictionAnalyzer
+from db import connect
+from reanalyze import Checkpoint, reanalyze
+from registry import IndicatorRegistry
+
+DOCUMENTS = [
+    ('transcript', 'The prosecutor committed a Brady violation by withholding the report.'),
+    ('appeal', 'The witness later recanted her testimony in a sworn affidavit.'),
+]
+
+
+def add_documents(path, documents=DOCUMENTS):
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        "INSERT INTO documents (case_id, document_type, document_name, content_text) "
+        "VALUES (1, ?, 'exhibit', ?)",
+        documents
+    )
+    connection.commit()
+    connection.close()
+
+
+def run(path, definitions, incremental=False):
+    analyzer = WrongfulConvictionAnalyzer(
+        registry=IndicatorRegistry(definitions, poll_interval=0)
+    )
+    db = connect(path)
+    try:
+        reanalyze(
+            db, analyzer, None, Checkpoint(None),
+            process_all=not incremental, batch_size=1, incremental=incremental
+        )
+    finally:
+        db.close()
+
+
+def case_indicators(path):
+    connection = sqlite3.connect(path)
+    rows = connection.execute(
+        'SELECT i.name, ci.confidence_score, '
+        '(SELECT COUNT(*) FROM case_indicator_citations c WHERE c.case_indicator_id = ci.id) '
+        'FROM case_indicators ci JOIN indicators i ON i.id = ci.indicator_id '
+        'WHERE ci.case_id = 1'
+    ).fetchall()
+    connection.close()
+    return {name: (confidence, citations) for name, confidence, citations in rows}
+
+
+def without_brady(definitions):
+    definitions['detectors']['misconduct']['categories']['brady_violation']['patterns'] = [
+        'zzzqqq'
+    ]
+
+
+def test_undetected_indicator_is_removed(database, write_definitions):
+    add_documents(database)
+    run(database, write_definitions())
+    before = case_indicators(database)
+    assert before['Brady Violations'][1] > 0
+    assert 'Witness Recantation' in before
+
+    run(database, write_definitions(without_brady))
+    after = case_indicators(database)
+    assert 'Brady Violations' not in after
+    assert after['Witness Recantation'] == before['Witness Recantation']
+
+
+def test_confidence_can_go_down(database, write_definitions):
+    add_documents(database)
+    run(database, write_definitions())
+    assert case_indicators(database)['Brady Violations'][0] > 0.5
+
+    def lower(definitions):
+        definitions['detectors']['misconduct']['categories']['brady_violation'][
+            'confidence'] = 0.5
+    run(database, write_definitions(lower))
+    assert case_indicators(database)['Brady Violations'][0] == 0.5
+
+
+def test_indicator_added_by_hand_is_kept(database, write_definitions):
+    add_documents(database)
+    connection = sqlite3.connect(database)
+    connection.execute(
+        'INSERT INTO case_indicators (case_id, indicator_id, confidence_score) '
+        "SELECT 1, id, 0.7 FROM indicators WHERE name = 'Maintained Innocence'"
+    )
+    connection.commit()
+    connection.close()
+
+    run(database, write_definitions(without_brady))
+    assert case_indicators(database)['Maintained Innocence'] == (0.7, 0)
+
+
+def test_other_documents_of_the_case_still_count(database, write_definitions):
+    # Each batch holds one document; the second must not drop what the
+    # first one found
+    add_documents(database, DOCUMENTS + [('evidence', 'Nothing of note happened.')])
+    run(database, write_definitions())
+    indicators = case_indicators(database)
+    assert 'Brady Violations' in indicators
+    assert 'Witness Recantation' in indicators
+
+
+def test_incremental_rescan_removes_vanished_indicator(database, write_definitions):
+    add_documents(database)
+    run(database, write_definitions())
+    before = case_indicators(database)
+    assert 'Brady Violations' in before
+
+    # Only the changed category is stale; the other document is skipped
+    run(database, write_definitions(without_brady), incremental=True)
+    after = case_indicators(database)
+    assert 'Brady Violations' not in after
+    assert after['Witness Recantation'] == before['Witness Recantation']
@@ -0,0 +1,64 @@
+"""Hot reloads never replace working patterns with ones that do not compile"""
+import copy
+
+import pytest
+
+from analyzer import WrongfulConvictionAnalyzer
+from registry import IndicatorRegistry
+
+BRADY = 'The prosecutor committed a Brady violation by withholding the report.'
+
+
+def brady_patterns(*patterns):
+    def change(definitions):
+        definitions['detectors']['misconduct']['categories']['brady_violation'][
+            'patterns'] = list(patterns)
+    return change
+
+
+def indicators(analyzer):
+    result = analyzer.analyze_document(BRADY)
+    return {indicator['indicator_name'] for indicator in result['indicators']}
+
+
+@pytest.mark.parametrize('patterns', [
+    ('(?i)giglio',),
+    ('brady', '(?P<p0>giglio)'),
+    ('(?P<name>brady)', '(?P<name>giglio)'),
+])
+def test_reload_keeps_definitions_whose_engine_compiles(write_definitions, patterns):
+    registry = IndicatorRegistry(write_definitions(), poll_interval=0)
+    analyzer = WrongfulConvictionAnalyzer(registry=registry)
+    version = registry.version
+
+    registry.path = write_definitions(brady_patterns(*patterns))
+    assert registry.reload() is False
+    assert registry.version == version
+    analyzer.refresh_patterns()
+    assert 'Brady Violations' in indicators(analyzer)
+
+
+def test_analyzer_keeps_engine_when_new_patterns_fail(write_definitions, caplog):
+    registry = IndicatorRegistry(write_definitions(), poll_interval=0)
+    analyzer = WrongfulConvictionAnalyzer(registry=registry)
+    engine = analyzer.engine
+    detectors = analyzer.detectors
+
+    # Workers adopt their parent's definitions without validating them
+    definitions = copy.deepcopy(registry.definitions)
+    definitions['detectors']['misconduct']['categories']['brady_violation'][
+        'patterns'] = ['(?i)giglio']
+    registry.replace(('broken', definitions))
+
+    assert analyzer.refresh_patterns() is False
+    assert analyzer.refresh_patterns() is False
+    assert analyzer.engine is engine
+    assert analyzer.detectors is detectors
+    assert len([r for r in caplog.records if 'Keeping indicator patterns' in r.message]) == 1
+    assert 'Brady Violations' in indicators(analyzer)
+
+    # Definitions that compile are still picked up afterwards
+    registry.path = write_definitions(brady_patterns('withholding the report'))
+    assert registry.reload() is True
+    assert analyzer.refresh_patterns() is True
+    assert 'Brady Violations' in indicators(analyzer)
@@ -0,0 +1,51 @@
+"""Compact results convert to and from their other forms without loss"""
+import json
+import pickle
+
+import pytest
+
+from analyzer import WrongfulConvictionAnalyzer
+from cache import AnalysisCache
+from detectors import DocumentResult, preprocess
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    return WrongfulConvictionAnalyzer()
+
+
+def analyzed(analyzer, corpus):
+    for text in corpus:
+        result = analyzer.analyze_results([{'content': text, 'type': 'transcript'}])[0]
+        yield text, result, result.to_dict(fingerprints=True)
+
+
+def test_compact_round_trip(analyzer, corpus):
+    for text, result, expected in analyzed(analyzer, corpus):
+        # The cache stores the compact form as JSON
+        payload = json.loads(json.dumps(result.to_compact()))
+        rebuilt = DocumentResult.from_compact(payload, preprocess(text), result.fingerprints)
+        assert rebuilt.to_dict(fingerprints=True) == expected
+
+
+def test_dict_round_trip(analyzer, corpus):
+    context_size = analyzer.engine.context_size
+    for text, result, expected in analyzed(analyzer, corpus):
+        rebuilt = DocumentResult.from_dict(expected, context_size, preprocess(text))
+        assert rebuilt.to_dict(fingerprints=True) == expected
+        assert rebuilt.to_compact() == result.to_compact()
+
+
+def test_pickle_round_trip(analyzer, corpus):
+    # Worker processes send results without their text, to be reattached
+    for text, result, expected in analyzed(analyzer, corpus):
+        rebuilt = pickle.loads(pickle.dumps(result)).attach(preprocess(text))
+        assert rebuilt.to_dict(fingerprints=True) == expected
+
+
+def test_cached_results_match_fresh_ones(corpus):
+    analyzer = WrongfulConvictionAnalyzer(cache=AnalysisCache())
+    fresh = [analyzer.analyze_document(text) for text in corpus]
+    assert analyzer.cache.stats()['memory_entries'] > 0
+    assert [analyzer.analyze_document(text) for text in corpus] == fresh
+    assert analyzer.cache.stats()['memory_hits'] == len(corpus)
@@ -0,0 +1,34 @@
+"""Streaming analysis gives analyze_document's result whatever the window size"""
+import io
+
+import pytest
+
+from analyzer import WrongfulConvictionAnalyzer
+from conftest import generated_document
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    return WrongfulConvictionAnalyzer()
+
+
+@pytest.mark.parametrize('chunk_size', [64, 1000, 4096, 1 << 20])
+def test_chunk_size_does_not_change_the_result(analyzer, corpus, chunk_size):
+    for text in corpus + [generated_document(12000, 99)]:
+        events = list(analyzer.analyze_stream(io.StringIO(text), chunk_size=chunk_size))
+        result = events[-1]
+        assert result.pop('event') == 'result'
+        assert result.pop('characters_analyzed') == len(text)
+        assert result == analyzer.analyze_document(text)
+
+        evidence = [event for event in events[:-1] if event['event'] == 'evidence']
+        assert len(evidence) == sum(len(i['evidence']) for i in result['indicators'])
+
+
+def test_byte_chunks_split_inside_characters(analyzer):
+    text = 'The café owner saw a brady violation. ' * 200
+    encoded = text.encode()
+    chunks = [encoded[i:i + 7] for i in range(0, len(encoded), 7)]
+    result = list(analyzer.analyze_stream(chunks, chunk_size=256))[-1]
+    del result['event'], result['characters_analyzed']
+    assert result == analyzer.analyze_document(text)
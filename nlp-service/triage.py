@@ -0,0 +1,170 @@
+"""
+Nightly screening of cases against a priority score threshold
+
+Runs WrongfulConvictionAnalyzer.triage over the documents of each case,
+scoring with the backend's priority formula (see scoring.py) and the
+largest confidence of each indicator, as case_indicators stores it. Cases
+stop being scanned as soon as their score is known to reach or miss the
+threshold, and no evidence is extracted; the cases that pass are printed
+and, with --queue, their documents are queued as ingest jobs (see jobs.py)
+so that only they get a full analysis.
+
+Usage:
+    python triage.py --database sqlite:///../database/wrongful_conviction.db --threshold 40
+    python triage.py --threshold 40 --status submitted under_review \\
+        --since 2024-06-01 --workers 8 --queue jobs.db
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from db import Database, connect
+from jobs import INGEST, JobQueue, build_analyzer
+from pool import frozen
+from scoring import IndicatorTable, case_scorer
+
+# Set in the parent before the workers fork
+_state: Dict[str, Any] = {}
+
+
+def iter_cases(
+    db: Database,
+    statuses: Optional[List[str]] = None,
+    since: Optional[str] = None,
+    batch_size: int = 500
+) -> Iterator[Tuple[int, Any, List[Dict[str, Any]]]]:
+    """(case id, organization, documents) of the selected cases, one case at a time"""
+    conditions = ['d.case_id IS NOT NULL']
+    params: List[Any] = []
+    if statuses:
+        conditions.append(f'c.case_status IN ({db.in_clause(statuses)})')
+        params.extend(statuses)
+    if since:
+        conditions.append('c.updated_at >= ?')
+        params.append(since)
+    case: Optional[Tuple[int, Any, List[Dict[str, Any]]]] = None
+    for rows in db.iter_batches(
+        'SELECT d.case_id, c.claimed_by_org_id, d.id, d.document_type, d.content_text '
+        'FROM documents d JOIN cases c ON c.id = d.case_id '
+        f'WHERE {" AND ".join(conditions)} ORDER BY d.case_id, d.id',
+        params, batch_size
+    ):
+        for case_id, organization, document_id, document_type, content in rows:
+            if case is None or case[0] != case_id:
+                if case is not None:
+                    yield case
+                case = (case_id, organization, [])
+            case[2].append({
+                'id': document_id, 'type': document_type or '', 'content': content or ''
+            })
+    if case is not None:
+        yield case
+
+
+def _triage(case: Tuple[int, Any, List[Dict[str, Any]]]) -> Tuple[int, Dict[str, Any]]:
+    case_id, _, documents = case
+    result = _state['analyzer'].triage(
+        documents, _state['threshold'], score=_state['score'], aggregate='max'
+    )
+    return case_id, result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--database', default=os.getenv('DATABASE_URL'))
+    parser.add_argument('--threshold', type=float, required=True,
+                        help='priority score (0-100) a case must reach')
+    parser.add_argument('--status', nargs='+', metavar='STATUS',
+                        help='only cases with one of these case_status values')
+    parser.add_argument('--since', help='only cases updated on or after this date')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--queue', help='queue the documents of passing cases in this job queue')
+    args = parser.parse_args()
+    if not args.database:
+        parser.error('--database or DATABASE_URL is required')
+
+    db = connect(args.database)
+    _state.update(
+        analyzer=build_analyzer(),
+        score=case_scorer(IndicatorTable.from_db(db)),
+        threshold=args.threshold
+    )
+    # Workers fork from this process with the detectors already compiled
+    _state['analyzer'].warm()
+
+    queue = JobQueue(args.queue) if args.queue else None
+    # Document ids and organization of each case, to queue the ones that pass
+    pending: Dict[int, Tuple[Any, List[int]]] = {}
+
+    def cases():
+        for case_id, organization, documents in iter_cases(db, args.status, args.since):
+            if queue is not None:
+                pending[case_id] = (organization, [doc['id'] for doc in documents])
+            yield case_id, organization, documents
+
+    pool = None
+    if args.workers > 1:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with frozen():
+            pool = context.Pool(args.workers)
+
+    def results():
+        if pool is None:
+            yield from map(_triage, cases())
+            return
+        # The database cursor stays in this thread, so cases are read here
+        # and handed to the pool a few at a time
+        batch = []
+        for case in cases():
+            batch.append(case)
+            if len(batch) == args.workers * 4:
+                yield from pool.imap_unordered(_triage, batch)
+                batch = []
+        yield from pool.imap_unordered(_triage, batch)
+
+    started = time.perf_counter()
+    passed = triaged = evaluated = total = 0
+    try:
+        for case_id, result in results():
+            triaged += 1
+            evaluated += result['indicators_evaluated']
+            total += result['indicators_total']
+            documents = pending.pop(case_id, None)
+            if not result['passed']:
+                continue
+            passed += 1
+            print(json.dumps({
+                'case_id': case_id,
+                'score_lower_bound': round(result['score_lower_bound'], 2),
+                'indicators': [ind['indicator_name'] for ind in result['indicators']]
+            }))
+            if documents is not None:
+                organization, document_ids = documents
+                queue.enqueue_many(
+                    [({'document_id': document_id}, organization)
+                     for document_id in document_ids],
+                    priority=INGEST
+                )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    db.close()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f'{passed} of {triaged} cases reach {args.threshold:g} '
+        f'({evaluated} of {total} indicators evaluated) in {elapsed:.1f}s'
+        + (f'; their documents were queued in {args.queue}' if args.queue else ''),
+        file=sys.stderr
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())